@@ -0,0 +1,91 @@
+"""
+Micro-benchmark of the per date band means of polygonal_mean_timeseries, on a synthetic layer of 20 bands and
+100 dates (by default): the vectorized BandMeans accumulator versus the previous per band loop with Python tuples.
+
+Does not need Spark: the tiles of a date are folded in a single accumulator, as aggregateByKey does within a partition.
+
+python benchmarks/benchmark_polygonal_mean.py [bands] [dates] [tiles per date] [tile size] [iterations]
+"""
+import sys
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+from geopyspark import Tile
+
+from openeogeotrellis.numpy_aggregators import BandMeans
+
+
+def _time(action: Callable[[], object]) -> (object, float):
+    start = time.time()
+    result = action()
+    end = time.time()
+
+    return result, end - start
+
+
+def _combine_cells_per_band(no_data, acc: List[Tuple[int, int]], tile) -> List[Tuple[int, int]]:
+    """Accumulation as it was done before: a mask and a sum per band."""
+    n_bands = len(tile.cells)
+
+    if not acc:
+        acc = [(0, 0)] * n_bands
+
+    for i in range(n_bands):
+        grid = tile.cells[i]
+        without_no_data = (~np.isnan(grid)) & (grid != no_data)
+        acc[i] = acc[i][0] + grid[without_no_data].sum(), acc[i][1] + without_no_data.sum()
+
+    return acc
+
+
+def _means_per_band(no_data, layer) -> List[List[float]]:
+    result = []
+    for tiles in layer:
+        acc = []
+        for tile in tiles:
+            acc = _combine_cells_per_band(no_data, acc, tile)
+        result.append([s / c for s, c in acc])
+    return result
+
+
+def _means_vectorized(no_data, layer) -> List[List[float]]:
+    band_means = BandMeans(no_data)
+    result = []
+    for tiles in layer:
+        state = None
+        for tile in tiles:
+            state = band_means.add(state, tile)
+        result.append(band_means.finish(state))
+    return result
+
+
+def main(argv: List[str]) -> None:
+    bands = int(argv[1]) if len(argv) > 1 else 20
+    dates = int(argv[2]) if len(argv) > 2 else 100
+    tiles_per_date = int(argv[3]) if len(argv) > 3 else 4
+    tile_size = int(argv[4]) if len(argv) > 4 else 256
+    iterations = int(argv[5]) if len(argv) > 5 else 3
+
+    no_data = -1.0
+    cells = np.random.random((bands, tile_size, tile_size)).astype(np.float32)
+    # a masked out polygon border and some clouds
+    cells[:, :tile_size // 4, :] = no_data
+    cells[:, :, -tile_size // 8:] = np.nan
+    tiles = [Tile(cells + i, 'FLOAT', no_data) for i in range(tiles_per_date)]
+    layer = [tiles] * dates
+
+    print("%d iteration(s) of %d band(s), %d date(s), %d tile(s) of %dx%d pixels per date" %
+          (iterations, bands, dates, tiles_per_date, tile_size, tile_size))
+
+    for i in range(iterations):
+        expected, legacy_time = _time(lambda: _means_per_band(no_data, layer))
+        actual, vectorized_time = _time(lambda: _means_vectorized(no_data, layer))
+        np.testing.assert_allclose(actual, expected, rtol=1e-5)
+
+        print("per band: %.3fs, vectorized: %.3fs (%.1fx)" %
+              (legacy_time, vectorized_time, legacy_time / vectorized_time))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of the stitching of a layer of 100x100 tiles of 64x64 pixels (by default) into a single window,
+as done for the NetCDF/JSON output formats: the slice based placement versus the previous one with index
+intersections and np.ix_.
+
+Does not need Spark:
+
+python benchmarks/benchmark_stitching.py [tiles per side] [tile size] [iterations]
+"""
+import sys
+import time
+from collections import namedtuple
+from typing import Callable, List
+
+import numpy as np
+from geopyspark import Tile
+
+from openeogeotrellis import stitching
+
+Key = namedtuple("Key", ["col", "row"])
+
+
+def _time(action: Callable[[], object]) -> (object, float):
+    start = time.time()
+    result = action()
+    end = time.time()
+
+    return result, end - start
+
+
+def _stitch_with_index_intersection(crop_win, layout_win, subarrs) -> np.ndarray:
+    """Stitching as it was done before, with np.intersect1d and np.ix_ for every block."""
+    bw, bh = subarrs[0][1].cells.shape[-2:]
+    bbands = sum(subarrs[0][1].cells.shape[:-2]) if len(subarrs[0][1].cells.shape) > 2 else 1
+    wbind = np.arange(0, bbands)
+    window = np.full((bbands, crop_win[2], crop_win[3]), subarrs[0][1].no_data_value, subarrs[0][1].cells.dtype)
+    wxind = np.arange(crop_win[0], crop_win[0] + crop_win[2])
+    wyind = np.arange(crop_win[1], crop_win[1] + crop_win[3])
+
+    nyblk = int(layout_win[3] / bh) - 1
+    for key, tile in subarrs:
+        iarr = tile.cells.reshape((-1, bh, bw)).transpose((0, 2, 1))
+        ixind = np.arange(key.col * bw, key.col * bw + bw)
+        iyind = np.arange((nyblk - key.row) * bh, (nyblk - key.row) * bh + bh)[::-1]
+        xoverlap = np.intersect1d(wxind, ixind, True, True)
+        yoverlap = np.intersect1d(wyind, iyind, True, True)
+        if len(xoverlap[1]) > 0 and len(yoverlap[1]) > 0:
+            window[np.ix_(wbind, xoverlap[1], yoverlap[1])] = iarr[np.ix_(wbind, xoverlap[2], yoverlap[2])]
+
+    return window
+
+
+def main(argv: List[str]) -> None:
+    tiles_per_side = int(argv[1]) if len(argv) > 1 else 100
+    tile_size = int(argv[2]) if len(argv) > 2 else 64
+    iterations = int(argv[3]) if len(argv) > 3 else 3
+
+    cells = np.random.random((2, tile_size, tile_size)).astype(np.float32)
+    tiles = [(Key(col, row), Tile(cells + col + row, 'FLOAT', -1.0))
+             for col in range(tiles_per_side) for row in range(tiles_per_side)]
+
+    size = tiles_per_side * tile_size
+    layout_win = (0, 0, size, size)
+    # crop half a tile on every side, so that blocks are placed partially as well
+    crop_win = (tile_size // 2, tile_size // 2, size - tile_size, size - tile_size)
+
+    print("%d iteration(s) stitching %dx%d tiles of %dx%d pixels" %
+          (iterations, tiles_per_side, tiles_per_side, tile_size, tile_size))
+
+    for i in range(iterations):
+        expected, legacy_time = _time(lambda: _stitch_with_index_intersection(crop_win, layout_win, tiles))
+        actual, slices_time = _time(lambda: stitching.stitch(tiles, crop_win, layout_win[3]))
+        assert np.array_equal(expected, actual)
+        expected = actual = None
+
+        print("intersect1d/ix_: %.3fs, slices: %.3fs (%.1fx)" % (legacy_time, slices_time, legacy_time / slices_time))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
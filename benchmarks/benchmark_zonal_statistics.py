@@ -0,0 +1,63 @@
+"""
+Micro-benchmark of the zone rasters of zonal_statistics for many small parcels (like the 59K parcels of
+benchmark.py): with the spatial index, a tile only rasterizes the parcels that intersect it, without it every
+tile rasterizes all of them.
+
+Does not need Spark:
+
+python benchmarks/benchmark_zonal_statistics.py [parcels] [tiles per side] [tile size]
+"""
+import sys
+import time
+from typing import Callable, List
+
+import numpy as np
+from shapely.geometry import box
+
+from openeogeotrellis.zonal_statistics import ZoneRasterizer
+
+
+def _time(action: Callable[[], object]) -> (object, float):
+    start = time.time()
+    result = action()
+    end = time.time()
+
+    return result, end - start
+
+
+class _UnindexedRasterizer(ZoneRasterizer):
+    """Every polygon is assigned to every key."""
+
+    def _index(self):
+        layout_cols, layout_rows = self.tile_layout[:2]
+        zones = list(range(len(self.geometries)))
+        return {(col, row): zones for col in range(layout_cols) for row in range(layout_rows)}
+
+
+def main(argv: List[str]) -> None:
+    parcels = int(argv[1]) if len(argv) > 1 else 2000
+    tiles_per_side = int(argv[2]) if len(argv) > 2 else 8
+    tile_size = int(argv[3]) if len(argv) > 3 else 256
+
+    # 10m pixels, parcels of 50 to 200m
+    size = tiles_per_side * tile_size * 10.0
+    random = np.random.default_rng(42)
+    corners = random.uniform(0, size - 200, (parcels, 2))
+    sides = random.uniform(50, 200, (parcels, 2))
+    geometries = [box(x, y, x + w, y + h) for (x, y), (w, h) in zip(corners, sides)]
+    extent = (0.0, 0.0, size, size)
+    tile_layout = (tiles_per_side, tiles_per_side, tile_size, tile_size)
+
+    print("zone rasters of %d parcels in %dx%d tiles of %dx%d pixels" %
+          (parcels, tiles_per_side, tiles_per_side, tile_size, tile_size))
+
+    for name, rasterizer_type in [("indexed", ZoneRasterizer), ("unindexed", _UnindexedRasterizer)]:
+        rasterizer, index_time = _time(lambda: rasterizer_type(geometries, extent, tile_layout))
+        _, rasterize_time = _time(lambda: [rasterizer.rasterize(col, row) for col, row in rasterizer.zones_by_key])
+        polygons_per_tile = np.mean([len(zones) for zones in rasterizer.zones_by_key.values()])
+        print("%s: index %.3fs, rasterization %.3fs (%.0f polygons per tile)" %
+              (name, index_time, rasterize_time, polygons_per_tile))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
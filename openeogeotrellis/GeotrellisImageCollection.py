@@ -1,9 +1,12 @@
 import functools
+import itertools
 import json
 import logging
 import math
 import os
 import pathlib
+import re
+import shutil
 import subprocess
 import tempfile
 import uuid
@@ -13,7 +16,6 @@ from typing import Dict, List, Union, Tuple, Iterable, Callable
 import geopyspark as gps
 import numpy as np
 import pandas as pd
-import pyproj
 import pytz
 from geopyspark import TiledRasterLayer, TMS, Pyramid, Tile, SpaceTimeKey, SpatialKey, Metadata
 from geopyspark.geotrellis import Extent, ResampleMethod
@@ -22,9 +24,14 @@ from openeo.internal.process_graph_visitor import ProcessGraphVisitor
 from openeo_driver.backend import ServiceMetadata
 from openeo_driver.delayed_vector import DelayedVector
 from openeo_driver.errors import FeatureUnsupportedException, OpenEOApiException, InternalException
-from openeogeotrellis.geotrellis_tile_processgraph_visitor import GeotrellisTileProcessGraphVisitor
-from openeogeotrellis.run_udf import run_user_code
+from openeogeotrellis.geotrellis_tile_processgraph_visitor import GeotrellisTileProcessGraphVisitor, \
+    fuse_process_graphs
+from openeogeotrellis import arrow_tiles, geotiff_writer, json_writer, neighborhood, netcdf_writer, point_timeseries, \
+    projections, stitching, zarr_writer, zonal_statistics
+from openeogeotrellis.numpy_aggregators import BandMeans, TemporalAggregator
+from openeogeotrellis.run_udf import UdfExecutor, DEFAULT_UDF_BATCH_SIZE
 from py4j.java_gateway import JVMView
+from pyspark import StorageLevel
 
 try:
     from openeo_udf.api.base import UdfData, SpatialExtent
@@ -43,7 +50,7 @@ from openeo.metadata import CollectionMetadata, Band
 from openeo_driver.save_result import AggregatePolygonResult
 from openeogeotrellis.configparams import ConfigParams
 from openeogeotrellis.service_registry import SecondaryService, AbstractServiceRegistry
-from openeogeotrellis.utils import to_projected_polygons,log_memory
+from openeogeotrellis.utils import to_projected_polygons, log_memory
 
 
 _log = logging.getLogger(__name__)
@@ -51,29 +58,127 @@ _log = logging.getLogger(__name__)
 
 class GeotrellisTimeSeriesImageCollection(ImageCollection):
 
+    # maximum number of tiles per partition when streaming tiles to the driver
+    STREAMING_TILES_PER_PARTITION = 16
+
     # TODO: no longer dependent on ServiceRegistry so it can be removed
     def __init__(self, pyramid: Pyramid, service_registry: AbstractServiceRegistry, metadata: CollectionMetadata = None):
         super().__init__(metadata=metadata)
-        self.pyramid = pyramid
+        self._pyramid = pyramid
+        # operations that are not applied to the levels of the pyramid yet, see `pyramid`
+        self._pending = []
+        # levels with the pending operations applied, by zoom level
+        self._levels = {}
+        # the collection this one was derived from, the number of its pending operations at that time, and the
+        # number of collections derived from this one: see `_level`
+        self._parent = None
+        self._parent_depth = 0
+        self._branches = 0
         self.tms = None
         self._service_registry = service_registry
 
+    @property
+    def pyramid(self) -> Pyramid:
+        """
+        The pyramid of this collection, with all pending operations applied to all of its levels.
+
+        Operations on the levels of the pyramid are recorded instead of applied right away (see `_with_operation`):
+        consecutive band math callbacks are fused into a single script (see `_apply_pending`), and a sink that only
+        needs the highest zoom level (see `_max_level`) doesn't build layers for the other levels.
+        """
+        if self._pending:
+            self._pyramid = Pyramid({k: self._level(k) for k in self._pyramid.levels})
+            self._pending = []
+            self._levels = {}
+        return self._pyramid
+
+    def _level(self, zoom: int) -> TiledRasterLayer:
+        """
+        A single level of the pyramid, with the pending operations applied to this level only.
+
+        The operations are applied to the level of the nearest collection this one was derived from that is shared
+        with other derived collections, or that has this level already, so their common operations are only applied
+        once; the operations of a chain without branches are applied together.
+        """
+        if not self._pending:
+            return self._pyramid.levels[zoom]
+        if zoom not in self._levels:
+            ancestor, depth = self._parent, self._parent_depth
+            while ancestor is not None and not (
+                    ancestor._branches > 1 or not ancestor._pending or zoom in ancestor._levels):
+                ancestor, depth = ancestor._parent, ancestor._parent_depth
+            if ancestor is None:
+                self._levels[zoom] = self._apply_pending(self._pyramid.levels[zoom], zoom, self._pending)
+            else:
+                self._levels[zoom] = self._apply_pending(ancestor._level(zoom), zoom, self._pending[depth:])
+        return self._levels[zoom]
+
+    def _max_level(self) -> TiledRasterLayer:
+        return self._level(self._pyramid.max_zoom)
+
+    def _with_operation(self, operation: Union[GeotrellisTileProcessGraphVisitor, Callable]) \
+            -> 'GeotrellisTimeSeriesImageCollection':
+        """
+        This collection with an extra pending operation on its levels: a band math callback,
+        or a function of a TiledRasterLayer and its zoom level.
+        """
+        collection = GeotrellisTimeSeriesImageCollection(self._pyramid, self._service_registry, metadata=self.metadata)
+        collection._pending = self._pending + [operation]
+        return self._derive(collection)
+
+    def _with_metadata(self, metadata: CollectionMetadata) -> 'GeotrellisTimeSeriesImageCollection':
+        """This collection, including its pending operations, with other metadata."""
+        collection = GeotrellisTimeSeriesImageCollection(self._pyramid, self._service_registry, metadata=metadata)
+        collection._pending = list(self._pending)
+        collection._levels = self._levels
+        return self._derive(collection)
+
+    def _derive(self, collection: 'GeotrellisTimeSeriesImageCollection') -> 'GeotrellisTimeSeriesImageCollection':
+        collection._parent = self
+        collection._parent_depth = len(self._pending)
+        self._branches += 1
+        return collection
+
+    def _apply_pending(self, layer: TiledRasterLayer, zoom: int, operations: List) -> TiledRasterLayer:
+        """Apply operations to a level, consecutive band math callbacks as a single script."""
+        for is_callback, group in itertools.groupby(
+                operations, key=lambda operation: isinstance(operation, GeotrellisTileProcessGraphVisitor)):
+            if not is_callback:
+                for function in group:
+                    layer = function(layer, zoom)
+                continue
+            map_bands = self._get_jvm().org.openeo.geotrellis.OpenEOProcesses().mapBands
+            for visitor in self._fuse_callbacks(list(group)):
+                layer = self._create_tilelayer(map_bands(layer.convert_data_type("float32").srdd.rdd(), visitor.builder),
+                                               layer.layer_type, zoom)
+        return layer
+
+    @staticmethod
+    def _fuse_callbacks(visitors: List[GeotrellisTileProcessGraphVisitor]) -> List[GeotrellisTileProcessGraphVisitor]:
+        if len(visitors) == 1 or any(visitor.process_graph is None for visitor in visitors):
+            return visitors
+        fused = fuse_process_graphs([visitor.process_graph for visitor in visitors])
+        if fused is None:
+            return visitors
+        return [GeotrellisTileProcessGraphVisitor().accept_process_graph(fused)]
+
     def _get_jvm(self) -> JVMView:
         # TODO: cache this?
         return gps.get_spark_context()._gateway.jvm
 
     def _is_spatial(self):
-        return self.pyramid.levels[self.pyramid.max_zoom].layer_type == gps.LayerType.SPATIAL
+        return self._max_level().layer_type == gps.LayerType.SPATIAL
 
     def apply_to_levels(self, func):
         """
         Applies a function to each level of the pyramid. The argument provided to the function is of type TiledRasterLayer
 
+        The function is only applied to a level once it is needed (see `pyramid`).
+
         :param func:
         :return:
         """
-        pyramid = Pyramid({k:func( l ) for k,l in self.pyramid.levels.items()})
-        return GeotrellisTimeSeriesImageCollection(pyramid, self._service_registry, metadata=self.metadata)
+        return self._with_operation(lambda layer, zoom: func(layer))
 
     def _create_tilelayer(self,contextrdd, layer_type, zoom_level):
         jvm = self._get_jvm()
@@ -91,11 +196,13 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         """
         Applies a function to each level of the pyramid. The argument provided to the function is the Geotrellis ContextRDD.
 
+        The function is only applied to a level once it is needed (see `pyramid`).
+
         :param func:
         :return:
         """
-        pyramid = Pyramid({k:self._create_tilelayer(func( l.srdd.rdd(),k ),l.layer_type,k) for k,l in self.pyramid.levels.items()})
-        return GeotrellisTimeSeriesImageCollection(pyramid, self._service_registry, metadata=self.metadata)
+        return self._with_operation(
+            lambda layer, zoom: self._create_tilelayer(func(layer.srdd.rdd(), zoom), layer.layer_type, zoom))
 
     def band_filter(self, bands) -> 'ImageCollection':
         return self.apply_to_levels(lambda rdd: rdd.bands(bands))
@@ -111,7 +218,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         return self
 
     def rename_dimension(self, source:str, target:str):
-        return GeotrellisTimeSeriesImageCollection(self.pyramid,self._service_registry,self.metadata.rename_dimension(source,target))
+        return self._with_metadata(self.metadata.rename_dimension(source,target))
 
     def apply(self, process: str, arguments: dict={}) -> 'ImageCollection':
         from openeogeotrellis.backend import SingleNodeUDFProcessGraphVisitor, GeoPySparkBackendImplementation
@@ -137,22 +244,13 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             applyProcess = gps.get_spark_context()._jvm.org.openeo.geotrellis.OpenEOProcesses().applyProcess
             return self._apply_to_levels_geotrellis_rdd(lambda rdd, k: applyProcess(rdd, process))
 
-    def reduce(self, reducer: str, dimension: str) -> 'ImageCollection':
+    def reduce(self, reducer: str, dimension: str, reducer_arguments: dict = None) -> 'ImageCollection':
         # TODO: rename this to reduce_temporal (because it only supports temporal reduce)?
-        from .numpy_aggregators import var_composite, std_composite, min_composite, max_composite, sum_composite
-
         reducer = self._normalize_temporal_reducer(dimension, reducer)
+        aggregator = self._temporal_numpy_aggregator(reducer, reducer_arguments)
 
-        if reducer == 'Variance':
-            return self._aggregate_over_time_numpy(var_composite)
-        elif reducer == 'StandardDeviation':
-            return self._aggregate_over_time_numpy(std_composite)
-        elif reducer == 'Min':
-            return self._aggregate_over_time_numpy(min_composite)
-        elif reducer == 'Max':
-            return self._aggregate_over_time_numpy(max_composite)
-        elif reducer == 'Sum':
-            return self._aggregate_over_time_numpy(sum_composite)
+        if aggregator is not None:
+            return self._aggregate_over_time_numpy(aggregator)
         else:
             return self.apply_to_levels(lambda layer: layer.to_spatial_layer().aggregate_by_cell(reducer))
 
@@ -162,16 +260,13 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         :param pgVisitor:
         :return:
         """
-        pysc = gps.get_spark_context()
-        float_datacube = self.apply_to_levels(lambda layer : layer.convert_data_type("float32"))
-        result = float_datacube._apply_to_levels_geotrellis_rdd(
-            lambda rdd, level: pysc._jvm.org.openeo.geotrellis.OpenEOProcesses().mapBands(rdd, pgVisitor.builder))
-        return result
+        # applied lazily, together with the per-pixel operations around it
+        return self._with_operation(pgVisitor)
 
     def _normalize_temporal_reducer(self, dimension: str, reducer: str) -> str:
         if dimension != self.metadata.temporal_dimension.name:
             raise FeatureUnsupportedException('Reduce on dimension {d!r} not supported'.format(d=dimension))
-        if reducer.upper() in ["MIN", "MAX", "SUM", "MEAN", "VARIANCE"]:
+        if reducer.upper() in ["MIN", "MAX", "SUM", "MEAN", "VARIANCE", "COUNT", "MEDIAN", "QUANTILES"]:
             reducer = reducer.lower().capitalize()
         elif reducer.upper() == "SD":
             reducer = "StandardDeviation"
@@ -179,11 +274,37 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             raise FeatureUnsupportedException('Reducer {r!r} not supported'.format(r=reducer))
         return reducer
 
+    @staticmethod
+    def _temporal_numpy_aggregator(reducer: str, reducer_arguments: dict = None) -> Union[TemporalAggregator, None]:
+        """
+        Python-side aggregator for a (normalized) temporal reducer, or None for reducers that are left to Geotrellis.
+        """
+        from . import numpy_aggregators
+
+        if reducer == 'Quantiles':
+            # a reducer computes a single value: several probabilities would result in an array per pixel
+            probabilities = (reducer_arguments or {}).get('probabilities')
+            if not isinstance(probabilities, list) or len(probabilities) != 1 \
+                    or not isinstance(probabilities[0], (int, float)) or not 0 <= probabilities[0] <= 1:
+                raise OpenEOApiException(
+                    message="Temporal quantiles reducer requires 'probabilities' to be a list of a single probability"
+                            " between 0 and 1, but got: {p!r}".format(p=probabilities),
+                    code="ProcessParameterInvalid", status_code=400)
+            return numpy_aggregators.percentile(100 * probabilities[0])
+
+        return {
+            'Mean': numpy_aggregators.MEAN,
+            'Variance': numpy_aggregators.VARIANCE,
+            'StandardDeviation': numpy_aggregators.STANDARD_DEVIATION,
+            'Min': numpy_aggregators.MIN,
+            'Max': numpy_aggregators.MAX,
+            'Sum': numpy_aggregators.SUM,
+            'Count': numpy_aggregators.COUNT,
+            'Median': numpy_aggregators.MEDIAN,
+        }.get(reducer)
+
     def add_dimension(self, name: str, label: str, type: str = None):
-        return GeotrellisTimeSeriesImageCollection(
-            pyramid=self.pyramid, service_registry=self._service_registry,
-            metadata=self.metadata.add_dimension(name=name, label=label, type=type)
-        )
+        return self._with_metadata(self.metadata.add_dimension(name=name, label=label, type=type))
 
     @classmethod
     def _mapTransform(cls, layoutDefinition, spatialKey):
@@ -201,6 +322,71 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             width=layoutDefinition.tileLayout.tileRows
         )
 
+    @staticmethod
+    def _udf_cell_types(context: dict) -> Tuple[Union[CellType, None], Union[CellType, None]]:
+        """
+        Cell types a UDF declares in its context:
+        - "input_cell_type": cell type of the tiles passed to the UDF, "native" to skip conversion
+          and keep the original cell type of the layer (default: "float32")
+        - "output_cell_type": cell type of the tiles returned by the UDF (default: same as its input tiles)
+
+        :return: tuple of input and output cell type, None meaning unchanged
+        """
+        def parse(key, default):
+            value = context.get(key, default) if isinstance(context, dict) else default
+            if value is None or value == "native":
+                return None
+            try:
+                return CellType(value)
+            except ValueError:
+                raise OpenEOApiException(
+                    message="Invalid UDF context {k!r}: {v!r}, should be one of {c!r}".format(
+                        k=key, v=value, c=["native"] + [c.value for c in CellType]),
+                    status_code=400)
+
+        return parse("input_cell_type", CellType.FLOAT32.value), parse("output_cell_type", None)
+
+    @staticmethod
+    def _udf_result_tile(values: np.ndarray, input_tile: Tile, cell_type: Union[CellType, None]) -> Tile:
+        """Tile of a UDF result, with the declared output cell type (None: cell type of the input tile)."""
+        dtype = input_tile.cells.dtype if cell_type is None else np.dtype(cell_type.value.replace("raw", ""))
+        no_data_value = input_tile.no_data_value
+        if np.issubdtype(dtype, np.integer):
+            no_data_value = GeotrellisTimeSeriesImageCollection._integer_no_data_value(
+                dtype, no_data_value, raw=cell_type is not None and cell_type.value.endswith("raw"))
+            if np.issubdtype(values.dtype, np.floating):
+                # NaN has no integer representation: it becomes no data (0 without no-data value)
+                values = np.where(np.isnan(values), 0 if no_data_value is None else no_data_value, values)
+        return Tile.from_numpy_array(values.astype(dtype, copy=False), no_data_value)
+
+    @staticmethod
+    def _integer_no_data_value(dtype: np.dtype, no_data_value, raw=False):
+        """
+        No-data value of integer cells: the given one if the dtype can represent it, otherwise the GeoTrellis default
+        of the cell type (the minimum for signed integers, 0 for unsigned ones), or None for a "raw" cell type.
+        """
+        if raw:
+            return None
+        if no_data_value is not None and not np.isnan(no_data_value) and no_data_value == int(no_data_value) \
+                and np.can_cast(np.min_scalar_type(int(no_data_value)), dtype):
+            return int(no_data_value)
+        return int(np.iinfo(dtype).min) if np.issubdtype(dtype, np.signedinteger) else 0
+
+    @staticmethod
+    def _with_cell_type(metadata: Metadata, cell_type: Union[CellType, None]) -> Metadata:
+        if cell_type is None:
+            return metadata
+        metadata_dict = metadata.to_dict()
+        metadata_dict['cellType'] = cell_type.value
+        dtype = np.dtype(cell_type.value.replace("raw", ""))
+        if np.issubdtype(dtype, np.integer) and not cell_type.value.endswith("raw"):
+            # the same no-data value as the tiles of `_udf_result_tile`
+            no_data_value = GeotrellisTimeSeriesImageCollection._integer_no_data_value(
+                dtype, getattr(metadata, 'no_data_value', None))
+            if no_data_value != GeotrellisTimeSeriesImageCollection._integer_no_data_value(dtype, None):
+                metadata_dict['cellType'] = "{c}ud{n}".format(c=cell_type.value, n=no_data_value)
+        return Metadata.from_dict(metadata_dict)
+
     @classmethod
     def _tile_to_datacube(cls, bands_numpy: np.ndarray, extent: SpatialExtent,
                           band_dimension: openeo.metadata.BandDimension, start_times=None):
@@ -214,6 +400,12 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         if band_dimension:
             # TODO: also use the band dimension name (`band_dimension.name`) instead of hardcoded "bands"?
             coords['bands'] = band_dimension.band_names
+        if extent is not None:
+            # pixel centers, y from the top (the first row of a tile)
+            x_size, y_size = bands_numpy.shape[-2], bands_numpy.shape[-1]
+            xres, yres = (extent.right - extent.left) / x_size, (extent.top - extent.bottom) / y_size
+            coords['x'] = np.linspace(extent.left + 0.5 * xres, extent.right - 0.5 * xres, x_size)
+            coords['y'] = np.linspace(extent.top - 0.5 * yres, extent.bottom + 0.5 * yres, y_size)
         the_array = xr.DataArray(bands_numpy, coords=coords,dims=dims,name="openEODataChunk")
         return DataCube(the_array)
 
@@ -221,14 +413,21 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
     def apply_tiles_spatiotemporal(self,function,context={}) -> ImageCollection:
         """
         Apply a function to a group of tiles with the same spatial key.
+
+        If the UDF defines an `apply_datacube_batch` function, it receives up to `batch_size` (a context key,
+        default 64) groups of a partition at once, stacked along an extra leading 'tiles' dimension; only groups with
+        the same dates are stacked together.
         :param function:
         :return:
         """
 
         #early compile to detect syntax errors
         compiled_code = compile(function,'UDF.py',mode='exec')
+        input_cell_type, output_cell_type = self._udf_cell_types(context)
+        result_tile = functools.partial(self._udf_result_tile, cell_type=output_cell_type)
 
-        def tilefunction(metadata:Metadata, openeo_metadata: CollectionMetadata, tiles:Tuple[gps.SpatialKey, List[Tuple[SpaceTimeKey, Tile]]]):
+        def to_datacube(metadata:Metadata, openeo_metadata: CollectionMetadata,
+                        tiles:Tuple[gps.SpatialKey, List[Tuple[SpaceTimeKey, Tile]]]):
             tile_list = list(tiles[1])
             #sort by instant
             tile_list.sort(key=lambda tup: tup[0].instant)
@@ -247,30 +446,76 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
                 band_dimension=openeo_metadata.band_dimension if openeo_metadata.has_band_dimension() else None,
                 start_times=pd.DatetimeIndex(dates)
             )
+            return tile_list, datacube
 
+        def result_tiles(spatial_key: gps.SpatialKey, tile_list: List[Tuple[SpaceTimeKey, Tile]],
+                         result_array: xr.DataArray):
+            if 't' in result_array.dims:
+                # slices of the result are views, unlike `groupby('t')`, which copies every group
+                result_array = result_array.transpose('t', *[d for d in result_array.dims if d != 't'])
+                values = result_array.values
+                return [(SpaceTimeKey(col=spatial_key.col, row=spatial_key.row,instant=pd.Timestamp(timestamp)),
+                  result_tile(values[i], tile_list[0][1]))
+                        for i, timestamp in enumerate(result_array.coords['t'].values)]
+            else:
+                return [(SpaceTimeKey(col=spatial_key.col, row=spatial_key.row,instant=datetime.now()),
+                  result_tile(result_array.values, tile_list[0][1]))]
+
+        def tilefunction(metadata:Metadata, openeo_metadata: CollectionMetadata, udf: UdfExecutor,
+                         tiles:Tuple[gps.SpatialKey, List[Tuple[SpaceTimeKey, Tile]]]):
+            tile_list, datacube = to_datacube(metadata, openeo_metadata, tiles)
             data = UdfData({"EPSG": 900913}, [datacube])
             data.user_context = context
 
-            result_data = run_user_code(function,data)
+            result_data = udf(data)
             cubes = result_data.get_datacube_list()
             if len(cubes)!=1:
                 raise ValueError("The provided UDF should return one datacube, but got: "+ str(cubes))
-            result_array:xr.DataArray = cubes[0].array
-            if 't' in result_array.dims:
-                return [(SpaceTimeKey(col=tiles[0].col, row=tiles[0].row,instant=pd.Timestamp(timestamp)),
-                  Tile(array_slice.values, CellType.FLOAT32, tile_list[0][1].no_data_value)) for timestamp, array_slice in result_array.groupby('t')]
-            else:
-                return [(SpaceTimeKey(col=tiles[0].col, row=tiles[0].row,instant=datetime.now()),
-                  Tile(result_array.values, CellType.FLOAT32, tile_list[0][1].no_data_value))]
+            return result_tiles(tiles[0], tile_list, cubes[0].array)
+
+        def batchfunction(metadata: Metadata, openeo_metadata: CollectionMetadata, udf: UdfExecutor,
+                          batch: List[Tuple[gps.SpatialKey, List[Tuple[SpaceTimeKey, Tile]]]]):
+            # tiles of different spatial keys can have different dates: only cubes with the same dates are stacked
+            stackable = {}
+            for tiles in batch:
+                tile_list, datacube = to_datacube(metadata, openeo_metadata, tiles)
+                dates = tuple(datacube.array.coords['t'].values)
+                stackable.setdefault((datacube.array.shape, dates), []).append((tiles[0], tile_list, datacube))
+            for group in stackable.values():
+                cubes = udf.apply_batch([datacube for _, _, datacube in group], context)
+                for (spatial_key, tile_list, _), cube in zip(group, cubes):
+                    yield from result_tiles(spatial_key, tile_list, cube.array)
+
+        def partition_function(metadata: Metadata, openeo_metadata: CollectionMetadata, partition):
+            # the UDF is compiled and resolved only once for all tiles in this partition
+            udf = UdfExecutor(function)
+            try:
+                if udf.batched:
+                    partition = iter(partition)
+                    batch_size = int(context.get("batch_size", DEFAULT_UDF_BATCH_SIZE))
+                    while True:
+                        batch = list(itertools.islice(partition, batch_size))
+                        if not batch:
+                            break
+                        yield from batchfunction(metadata, openeo_metadata, udf, batch)
+                else:
+                    for tiles in partition:
+                        yield from tilefunction(metadata, openeo_metadata, udf, tiles)
+            finally:
+                # also if the partition is only partly consumed
+                udf.log_stats()
 
         def rdd_function(openeo_metadata: CollectionMetadata, rdd):
-            floatrdd = rdd.convert_data_type(CellType.FLOAT32).to_numpy_rdd()
-            grouped_by_spatial_key = floatrdd.map(lambda t: (gps.SpatialKey(t[0].col, t[0].row), (t[0], t[1]))).groupByKey()
-
-            return gps.TiledRasterLayer.from_numpy_rdd(gps.LayerType.SPACETIME,
-                                                       grouped_by_spatial_key.flatMap(
-                                                    log_memory(partial(tilefunction, rdd.layer_metadata, openeo_metadata))),
-                                                       rdd.layer_metadata)
+            if input_cell_type is not None:
+                rdd = rdd.convert_data_type(input_cell_type)
+            numpy_rdd = arrow_tiles.to_numpy_rdd(rdd)
+            grouped_by_spatial_key = numpy_rdd.map(lambda t: (gps.SpatialKey(t[0].col, t[0].row), (t[0], t[1]))).groupByKey()
+
+            return arrow_tiles.from_numpy_rdd(gps.LayerType.SPACETIME,
+                                              grouped_by_spatial_key.mapPartitions(
+                                                  log_memory(partial(partition_function, rdd.layer_metadata,
+                                                                     openeo_metadata))),
+                                              self._with_cell_type(rdd.layer_metadata, output_cell_type))
         from functools import partial
         return self.apply_to_levels(partial(rdd_function, self.metadata))
 
@@ -296,51 +541,88 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         elif self.metadata.has_band_dimension() and dimension == self.metadata.band_dimension.name:
             result_collection = self.reduce_bands(reducer)
         elif hasattr(reducer,'processes') and isinstance(reducer.processes,dict) and len(reducer.processes) == 1:
-            result_collection = self.reduce(reducer.processes.popitem()[0],dimension)
+            process_id, arguments = reducer.processes.popitem()
+            result_collection = self.reduce(process_id, dimension, reducer_arguments=arguments)
         else:
             raise ValueError("Unsupported combination of reducer %s and dimension %s."%(reducer,dimension))
         if result_collection is not None:
             result_collection.metadata = result_collection.metadata.reduce_dimension(dimension)
-            if self.metadata.has_temporal_dimension() and dimension == self.metadata.temporal_dimension.name and self.pyramid.layer_type != gps.LayerType.SPATIAL:
+            if self.metadata.has_temporal_dimension() and dimension == self.metadata.temporal_dimension.name and self._max_level().layer_type != gps.LayerType.SPATIAL:
                 result_collection = result_collection.apply_to_levels(lambda rdd:  rdd.to_spatial_layer() if rdd.layer_type != gps.LayerType.SPATIAL else rdd)
         return result_collection
 
 
     def apply_tiles(self, function,context={}) -> 'ImageCollection':
-        """Apply a function to the given set of bands in this image collection."""
-        #TODO apply .bands(bands)
+        """
+        Apply a function to the given set of bands in this image collection.
 
-        def tilefunction(metadata: Metadata, openeo_metadata: CollectionMetadata,
-                         geotrellis_tile: Tuple[SpaceTimeKey, Tile]):
+        If the UDF defines an `apply_datacube_batch` function, it receives up to `batch_size` (a context key,
+        default 64) tiles of a partition at once, stacked along an extra leading 'tiles' dimension.
 
-            key = geotrellis_tile[0]
-            extent = GeotrellisTimeSeriesImageCollection._mapTransform(metadata.layout_definition,key)
+        Tiles are converted to float32 before calling the UDF, unless the UDF declares otherwise in its context
+        (see `_udf_cell_types`). Tiles are transported through Arrow if the JVM supports it (see `arrow_tiles`).
+        """
+        #TODO apply .bands(bands)
+        input_cell_type, output_cell_type = self._udf_cell_types(context)
+        result_tile = functools.partial(self._udf_result_tile, cell_type=output_cell_type)
 
+        def to_datacube(metadata: Metadata, openeo_metadata: CollectionMetadata,
+                        geotrellis_tile: Tuple[SpaceTimeKey, Tile]):
             from openeo_udf.api.datacube import DataCube
 
+            extent = GeotrellisTimeSeriesImageCollection._mapTransform(metadata.layout_definition, geotrellis_tile[0])
             datacube:DataCube = GeotrellisTimeSeriesImageCollection._tile_to_datacube(
                 geotrellis_tile[1].cells,
                 extent=extent,
                 band_dimension=openeo_metadata.band_dimension
             )
+            return datacube
 
-            data = UdfData({"EPSG": 900913}, [datacube])
+        def tilefunction(metadata: Metadata, openeo_metadata: CollectionMetadata, udf: UdfExecutor,
+                         geotrellis_tile: Tuple[SpaceTimeKey, Tile]):
+            data = UdfData({"EPSG": 900913}, [to_datacube(metadata, openeo_metadata, geotrellis_tile)])
             data.user_context = context
 
-            result_data = run_user_code(function,data)
+            result_data = udf(data)
             cubes = result_data.get_datacube_list()
             if len(cubes)!=1:
                 raise ValueError("The provided UDF should return one datacube, but got: "+ str(cubes))
             result_array:xr.DataArray = cubes[0].array
-            print(result_array.dims)
-            return (key,Tile(result_array.values, geotrellis_tile[1].cell_type,geotrellis_tile[1].no_data_value))
+            return (geotrellis_tile[0],result_tile(result_array.values, geotrellis_tile[1]))
 
+        def batchfunction(metadata: Metadata, openeo_metadata: CollectionMetadata, udf: UdfExecutor,
+                          geotrellis_tiles: List[Tuple[SpaceTimeKey, Tile]]):
+            cubes = udf.apply_batch([to_datacube(metadata, openeo_metadata, t) for t in geotrellis_tiles], context)
+            return [(key, result_tile(cube.array.values, tile))
+                    for (key, tile), cube in zip(geotrellis_tiles, cubes)]
+
+        def partition_function(metadata: Metadata, openeo_metadata: CollectionMetadata, partition):
+            # the UDF is compiled and resolved only once for all tiles in this partition
+            udf = UdfExecutor(function)
+            try:
+                if udf.batched:
+                    partition = iter(partition)
+                    batch_size = int(context.get("batch_size", DEFAULT_UDF_BATCH_SIZE))
+                    while True:
+                        batch = list(itertools.islice(partition, batch_size))
+                        if not batch:
+                            break
+                        yield from batchfunction(metadata, openeo_metadata, udf, batch)
+                else:
+                    for geotrellis_tile in partition:
+                        yield tilefunction(metadata, openeo_metadata, udf, geotrellis_tile)
+            finally:
+                # also if the partition is only partly consumed
+                udf.log_stats()
 
         def rdd_function(openeo_metadata: CollectionMetadata, rdd):
-            return gps.TiledRasterLayer.from_numpy_rdd(rdd.layer_type,
-                                                rdd.convert_data_type(CellType.FLOAT32).to_numpy_rdd().map(
-                                                    log_memory(partial(tilefunction, rdd.layer_metadata, openeo_metadata))),
-                                                rdd.layer_metadata)
+            if input_cell_type is not None:
+                rdd = rdd.convert_data_type(input_cell_type)
+            return arrow_tiles.from_numpy_rdd(rdd.layer_type,
+                                              arrow_tiles.to_numpy_rdd(rdd).mapPartitions(
+                                                  log_memory(partial(partition_function, rdd.layer_metadata,
+                                                                     openeo_metadata))),
+                                              self._with_cell_type(rdd.layer_metadata, output_cell_type))
         from functools import partial
         return self.apply_to_levels(partial(rdd_function, self.metadata))
 
@@ -349,7 +631,8 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         #reduce
         pass
 
-    def aggregate_temporal(self, intervals: List, labels: List, reducer, dimension: str = None) -> 'ImageCollection':
+    def aggregate_temporal(self, intervals: List, labels: List, reducer: Union[str, Dict],
+                           dimension: str = None) -> 'ImageCollection':
         """ Computes a temporal aggregation based on an array of date and/or time intervals.
 
             Calendar hierarchies such as year, month, week etc. must be transformed into specific intervals by the clients. For each interval, all data along the dimension will be passed through the reducer. The computed values will be projected to the labels, so the number of labels and the number of intervals need to be equal.
@@ -359,29 +642,54 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             :param intervals: Temporal left-closed intervals so that the start time is contained, but not the end time.
             :param labels: Labels for the intervals. The number of labels and the number of groups need to be equal.
             :param reducer: A reducer to be applied on all values along the specified dimension. The reducer must be a callable process (or a set processes) that accepts an array and computes a single return value of the same type as the input values, for example median.
+                Either the process id or the (single node) process graph of the reducer: the latter is required for reducers with additional arguments, e.g. the `probabilities` of `quantiles`.
             :param dimension: The temporal dimension for aggregation. All data along the dimension will be passed through the specified reducer. If the dimension is not set, the data cube is expected to only have one temporal dimension.
 
             :return: An ImageCollection containing  a result for each time window
         """
+        reducer_arguments = None
+        if isinstance(reducer, dict):
+            from openeogeotrellis.backend import GeoPySparkBackendImplementation
+            processes = getattr(GeoPySparkBackendImplementation.accept_process_graph(reducer), 'processes', {})
+            if len(processes) != 1:
+                raise FeatureUnsupportedException(
+                    "Temporal aggregation only supports a single reducer process, but got: {r!r}".format(r=reducer))
+            reducer, reducer_arguments = processes.popitem()
+
         intervals_iso = list(map(lambda d:pd.to_datetime(d).strftime('%Y-%m-%dT%H:%M:%SZ'),intervals))
         labels_iso = list(map(lambda l:pd.to_datetime(l).strftime('%Y-%m-%dT%H:%M:%SZ'), labels))
         pysc = gps.get_spark_context()
         mapped_keys = self._apply_to_levels_geotrellis_rdd(
             lambda rdd,level: pysc._jvm.org.openeo.geotrellis.OpenEOProcesses().mapInstantToInterval(rdd,intervals_iso,labels_iso))
         reducer = self._normalize_temporal_reducer(dimension, reducer)
+        if reducer in ['Mean', 'Count', 'Median', 'Quantiles']:
+            # aggregated by the streaming numpy engine: keys are mapped to their label, so aggregate per key
+            aggregator = self._temporal_numpy_aggregator(reducer, reducer_arguments)
+
+            def aggregate_per_interval(layer):
+                numpy_rdd = layer.convert_data_type(CellType.FLOAT32).to_numpy_rdd()
+                return TiledRasterLayer.from_numpy_rdd(gps.LayerType.SPACETIME, aggregator.aggregate_by_key(numpy_rdd),
+                                                       aggregator.result_metadata(layer.layer_metadata))
+
+            return mapped_keys.apply_to_levels(aggregate_per_interval)
         return mapped_keys.apply_to_levels(lambda rdd: rdd.aggregate_by_cell(reducer))
 
-    def _aggregate_over_time_numpy(self, reducer: Callable[[Iterable[Tile]], Tile]) -> 'ImageCollection':
+    def _aggregate_over_time_numpy(self, aggregator: 'TemporalAggregator') -> 'ImageCollection':
         """
         Aggregate over time.
-        :param reducer: a function that reduces n Tiles to a single Tile
+
+        Partial aggregates are combined map-side, so only one accumulator state per spatial key per partition
+        is shuffled instead of all the tiles.
+
+        :param aggregator: a mergeable aggregator that reduces n Tiles to a single Tile
         :return:
         """
         def aggregate_temporally(layer):
-            grouped_numpy_rdd = layer.to_spatial_layer().convert_data_type(CellType.FLOAT32).to_numpy_rdd().groupByKey()
+            numpy_rdd = layer.to_spatial_layer().convert_data_type(CellType.FLOAT32).to_numpy_rdd()
 
-            composite = grouped_numpy_rdd.mapValues(reducer)
-            aggregated_layer = TiledRasterLayer.from_numpy_rdd(gps.LayerType.SPATIAL, composite, layer.layer_metadata)
+            composite = aggregator.aggregate_by_key(numpy_rdd)
+            aggregated_layer = TiledRasterLayer.from_numpy_rdd(gps.LayerType.SPATIAL, composite,
+                                                               aggregator.result_metadata(layer.layer_metadata))
             return aggregated_layer
 
         return self.apply_to_levels(aggregate_temporally)
@@ -389,14 +697,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
 
     @classmethod
     def __reproject_polygon(cls, polygon: Union[Polygon, MultiPolygon], srs, dest_srs):
-        from shapely.ops import transform
-
-        project = functools.partial(
-            pyproj.transform,
-            pyproj.Proj(srs),  # source coordinate system
-            pyproj.Proj(dest_srs))  # destination coordinate system
-
-        return transform(project, polygon)  # apply projection
+        return projections.reproject_geometry(polygon, srs, dest_srs)
 
     def merge(self,other:'GeotrellisTimeSeriesImageCollection',overlaps_resolver:str=None):
         #we may need to align datacubes automatically?
@@ -415,7 +716,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             merged_data = self._apply_to_levels_geotrellis_rdd(
                 lambda rdd, level:
                 pysc._jvm.org.openeo.geotrellis.OpenEOProcesses().mergeCubes_SpaceTime_Spatial(
-                    other.pyramid.levels[level].srdd.rdd(),
+                    other._level(level).srdd.rdd(),
                     rdd,
                     overlaps_resolver,
                     True
@@ -426,7 +727,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
                 lambda rdd, level:
                 pysc._jvm.org.openeo.geotrellis.OpenEOProcesses().mergeCubes_SpaceTime_Spatial(
                     rdd,
-                    other.pyramid.levels[level].srdd.rdd(),
+                    other._level(level).srdd.rdd(),
                     overlaps_resolver,
                     False
                 )
@@ -436,7 +737,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
                 lambda rdd, level:
                     pysc._jvm.org.openeo.geotrellis.OpenEOProcesses().mergeCubes(
                         rdd,
-                        other.pyramid.levels[level].srdd.rdd(),
+                        other._level(level).srdd.rdd(),
                         overlaps_resolver
                     )
             )
@@ -450,7 +751,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
 
     def mask_polygon(self, mask: Union[Polygon, MultiPolygon], srs="EPSG:4326",
                      replacement=None, inside=False) -> 'GeotrellisTimeSeriesImageCollection':
-        max_level = self.pyramid.levels[self.pyramid.max_zoom]
+        max_level = self._max_level()
         layer_crs = max_level.layer_metadata.crs
         reprojected_polygon = self.__reproject_polygon(mask, "+init=" + srs, layer_crs)
         # TODO should we warn when masking generates an empty collection?
@@ -464,13 +765,12 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
     def mask(self, mask: 'GeotrellisTimeSeriesImageCollection',
              replacement=None) -> 'GeotrellisTimeSeriesImageCollection':
         # mask needs to be the same layout as this layer
-        mask_pyramid_levels = {
-            k: l.tile_to_layout(layout=self.pyramid.levels[k])
-            for k, l in mask.pyramid.levels.items()
-        }
+        def mask_level(level):
+            return mask._level(level).tile_to_layout(layout=self._level(level))
+
         rasterMask = gps.get_spark_context()._jvm.org.openeo.geotrellis.OpenEOProcesses().rasterMask
         return self._apply_to_levels_geotrellis_rdd(
-            lambda rdd, level: rasterMask(rdd, mask_pyramid_levels[level].srdd.rdd(), replacement)
+            lambda rdd, level: rasterMask(rdd, mask_level(level).srdd.rdd(), replacement)
         )
 
     def apply_kernel(self, kernel: np.ndarray, factor=1, border = 0, replace_invalid=0):
@@ -493,7 +793,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         geopyspark_layer = TiledRasterLayer.from_numpy_rdd(gps.LayerType.SPATIAL, rdd, metadata)
         geotrellis_tile = geopyspark_layer.srdd.rdd().collect()[0]._2().band(0)
 
-        if self.pyramid.layer_type == gps.LayerType.SPACETIME:
+        if self._max_level().layer_type == gps.LayerType.SPACETIME:
             result_collection = self._apply_to_levels_geotrellis_rdd(
                 lambda rdd, level: pysc._jvm.org.openeo.geotrellis.OpenEOProcesses().apply_kernel_spacetime(rdd, geotrellis_tile))
         else:
@@ -502,7 +802,14 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         return result_collection
 
     def apply_neighborhood(self, process:Dict, size:List,overlap:List) -> 'ImageCollection':
+        """
+        Applies a process to windows of `size` pixels (and optionally dates), extended with `overlap` on each side.
 
+        Windows are laid out on the pixel grid of the layer, independently of its tiles (see `neighborhood`): a window
+        that spans k tiles is evaluated k times, once per tile, of which only the part within that tile is kept. So a
+        UDF is called (at least) k times as often as there are such windows: prefer window sizes that divide the tile
+        size (or equal it) to have every window evaluated once.
+        """
         spatial_dims = self.metadata.spatial_dimensions
         if len(spatial_dims) != 2:
             raise OpenEOApiException(message="Unexpected spatial dimensions in apply_neighborhood,"
@@ -517,19 +824,18 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
                                              " This was provided: %s" % str(size))
         sizeX = int(size_dict[x.name]['value'])
         sizeY = int(size_dict[y.name]['value'])
-        if sizeX < 32 or sizeY < 32:
-            raise OpenEOApiException(message="apply_neighborhood: window sizes smaller then 32 are not yet supported.")
+        if sizeX < 1 or sizeY < 1:
+            raise OpenEOApiException(message="apply_neighborhood: window sizes should be at least 1 pixel.")
         overlap_x = overlap_dict.get(x.name,{'value': 0, 'unit': 'px'})
         overlap_y = overlap_dict.get(y.name,{'value': 0, 'unit': 'px'})
         if overlap_x.get('unit', None) != 'px' or overlap_y.get('unit', None) != 'px':
             raise OpenEOApiException(message="apply_neighborhood: overlap sizes for the spatial dimensions"
                                              " of this datacube should be specified, in pixels."
                                              " This was provided: %s" % str(overlap))
-        jvm = self._get_jvm()
         overlap_x_value = int(overlap_x['value'])
         overlap_y_value = int(overlap_y['value'])
-        retiled_collection = self._apply_to_levels_geotrellis_rdd(
-            lambda rdd, level: jvm.org.openeo.geotrellis.OpenEOProcesses().retile(rdd, sizeX, sizeY, overlap_x_value, overlap_y_value))
+        if overlap_x_value < 0 or overlap_y_value < 0:
+            raise OpenEOApiException(message="apply_neighborhood: overlap sizes should not be negative.")
 
         from openeogeotrellis.backend import SingleNodeUDFProcessGraphVisitor, GeoPySparkBackendImplementation
 
@@ -548,32 +854,197 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
                     "The 'run_udf' process requires at least a 'udf' string argument, but got: '%s'." % udf)
             if temporal_size is None or temporal_size.get('value',None) is None:
                 #full time dimension has to be provided
-                result_collection = retiled_collection.apply_tiles_spatiotemporal(udf,context=context)
+                result_collection = self._apply_neighborhood_udf(udf, context, sizeX, sizeY, overlap_x_value,
+                                                                 overlap_y_value, per_date=False)
             elif temporal_size.get('value',None) == 'P1D' and temporal_overlap is None:
-                result_collection = retiled_collection.apply_tiles(udf,context=context)
+                result_collection = self._apply_neighborhood_udf(udf, context, sizeX, sizeY, overlap_x_value,
+                                                                 overlap_y_value, per_date=True)
             else:
-                raise OpenEOApiException(
-                    message="apply_neighborhood: for temporal dimension,"
-                            " either process all values, or only single date is supported for now!")
+                # sliding temporal windows
+                temporal_size_value = self._parse_duration(temporal_size)
+                if temporal_size_value <= pd.Timedelta(0):
+                    raise OpenEOApiException(message="apply_neighborhood: the temporal window size should be"
+                                                     " positive, but got %s" % str(temporal_size))
+                result_collection = self._apply_neighborhood_udf(
+                    udf, context, sizeX, sizeY, overlap_x_value, overlap_y_value, per_date=False,
+                    temporal_size=temporal_size_value,
+                    temporal_overlap=self._parse_duration(temporal_overlap or {'value': 'P0D'}))
 
         elif isinstance(process, GeotrellisTileProcessGraphVisitor):
             if temporal_size is None or temporal_size.get('value', None) is None:
                 raise OpenEOApiException(message="apply_neighborhood: only supporting complex callbacks on bands")
             elif temporal_size.get('value', None) == 'P1D' and temporal_overlap is None:
+                # a callback on bands works per pixel, so neither the windows nor their overlap matter
                 result_collection = self.reduce_bands(process)
             else:
                 raise OpenEOApiException(message="apply_neighborhood: only supporting complex callbacks on bands")
         else:
             raise OpenEOApiException(message="apply_neighborhood: only supporting callbacks with a single UDF.")
 
-        if overlap_x_value > 0 or overlap_y_value > 0:
+        return result_collection
+
+    def _apply_neighborhood_udf(self, function: str, context: dict, size_x: int, size_y: int,
+                                overlap_x: int, overlap_y: int, per_date: bool,
+                                temporal_size: pd.Timedelta = None,
+                                temporal_overlap: pd.Timedelta = pd.Timedelta(0)) -> 'ImageCollection':
+        """
+        Run a UDF on windows of `size_x` by `size_y` pixels, laid out from the first tile of the layer and extended
+        with `overlap_x`/`overlap_y` pixels of the surrounding windows, and keep the core of every resulting window
+        (see `neighborhood`).
+
+        With `per_date`, the UDF gets a (bands, x, y) window of a single date, otherwise a (t, bands, x, y) window
+        with all dates, or, with a `temporal_size`, with the dates of a temporal window extended with
+        `temporal_overlap` on both sides (see `_temporal_windows`). Of a UDF result that keeps the temporal
+        dimension, the dates in the core of the temporal window are kept; a result without temporal dimension is
+        labelled with the start of the window.
+
+        A UDF that defines an `apply_datacube_batch` function receives up to `batch_size` (a context key, default 64)
+        windows of a tile at once, stacked along an extra leading 'tiles' dimension.
+        """
+        #early compile to detect syntax errors
+        compile(function, 'UDF.py', mode='exec')
+        input_cell_type, output_cell_type = self._udf_cell_types(context)
+        result_tile = functools.partial(self._udf_result_tile, cell_type=output_cell_type)
+        band_dimension = self.metadata.band_dimension if self.metadata.has_band_dimension() else None
+
+        batch_size = int(context.get("batch_size", DEFAULT_UDF_BATCH_SIZE))
+
+        def run_udf(udf: UdfExecutor, windows: List[np.ndarray], dates=None) -> List[xr.DataArray]:
+            # the windows of a tile all have the same shape and coordinates, so a batched UDF gets them at once
+            datacubes = [GeotrellisTimeSeriesImageCollection._tile_to_datacube(
+                window, extent=None, band_dimension=band_dimension, start_times=dates) for window in windows]
+            if udf.batched:
+                return [cube.array for cube in udf.apply_batch(datacubes, context)]
+            result_arrays = []
+            for datacube in datacubes:
+                data = UdfData({"EPSG": 900913}, [datacube])
+                data.user_context = context
+                cubes = udf(data).get_datacube_list()
+                if len(cubes) != 1:
+                    raise ValueError("The provided UDF should return one datacube, but got: " + str(cubes))
+                result_arrays.append(cubes[0].array)
+            return result_arrays
+
+        def per_date_partition(apply_windows: Callable, partition):
+            udf = UdfExecutor(function)
+            try:
+                for key, tile in partition:
+                    values = apply_windows(udf, tile.cells,
+                                           lambda windows: [array.values for array in run_udf(udf, windows)], key)
+                    yield key, result_tile(values, tile)
+            finally:
+                udf.log_stats()
+
+        def spatiotemporal_partition(apply_windows: Callable, origin: pd.Timestamp, partition):
+            udf = UdfExecutor(function)
+            try:
+                for spatial_key, tiles in partition:
+                    # sorted and stacked once, the temporal windows are views on this stack
+                    tiles = sorted(tiles, key=lambda t: t[0].instant)
+                    dates = pd.DatetimeIndex([key.instant for key, _ in tiles])
+                    if dates.tz is not None:
+                        # as the (naive, UTC) dates of the UDF result
+                        dates = dates.tz_convert(None)
+                    stack = np.array([tile.cells for _, tile in tiles])
+
+                    if temporal_size is None:
+                        windows = [(slice(None), dates[0], None)]
+                    else:
+                        windows = GeotrellisTimeSeriesImageCollection._temporal_windows(
+                            dates, origin, temporal_size, temporal_overlap)
+                    for window, start, end in windows:
+                        window_dates = dates[window]
+                        result_dates = []
+
+                        def udf_windows(windows: List[np.ndarray]) -> List[np.ndarray]:
+                            values = []
+                            for result_array in run_udf(udf, windows, window_dates):
+                                if 't' not in result_array.dims:
+                                    result_dates[:] = [start]
+                                    values.append(result_array.values[np.newaxis])
+                                else:
+                                    result_dates[:] = pd.DatetimeIndex(result_array.coords['t'].values)
+                                    values.append(
+                                        result_array.transpose('t', *[d for d in result_array.dims if d != 't']).values)
+                            return values
+
+                        values = apply_windows(udf, stack[window], udf_windows, spatial_key)
+                        for i, timestamp in enumerate(result_dates):
+                            if end is not None and not (start <= timestamp < end):
+                                continue
+                            yield (SpaceTimeKey(col=spatial_key.col, row=spatial_key.row,
+                                                instant=pd.Timestamp(timestamp)),
+                                   result_tile(values[i], tiles[0][1]))
+            finally:
+                udf.log_stats()
+
+        def rdd_function(rdd: TiledRasterLayer) -> TiledRasterLayer:
+            if input_cell_type is not None:
+                rdd = rdd.convert_data_type(input_cell_type)
+            tile_layout = rdd.layer_metadata.layout_definition.tileLayout
+            tile_cols, tile_rows = tile_layout.tileCols, tile_layout.tileRows
+            min_col, min_row = rdd.layer_metadata.bounds.minKey.col, rdd.layer_metadata.bounds.minKey.row
+            halo_x = neighborhood.halo_size(size_x, overlap_x, tile_cols)
+            halo_y = neighborhood.halo_size(size_y, overlap_y, tile_rows)
+
+            def apply_windows(udf: UdfExecutor, cells: np.ndarray, udf_windows: Callable, key) -> np.ndarray:
+                # spatial windows are aligned on the first tile of the layer
+                return neighborhood.apply_window_batches(cells, udf_windows, batch_size if udf.batched else 1,
+                                                         size_x, size_y, overlap_x, overlap_y, halo_x, halo_y,
+                                                         offset_x=(key.col - min_col) * tile_cols,
+                                                         offset_y=(key.row - min_row) * tile_rows)
+
+            tiles = neighborhood.halo_exchange(rdd.to_numpy_rdd(), halo_x, halo_y)
+            metadata = self._with_cell_type(rdd.layer_metadata, output_cell_type)
+            if per_date or rdd.layer_type == gps.LayerType.SPATIAL:
+                return gps.TiledRasterLayer.from_numpy_rdd(rdd.layer_type,
+                                                           tiles.mapPartitions(log_memory(
+                                                               functools.partial(per_date_partition, apply_windows))),
+                                                           metadata)
+            # temporal windows are aligned on the first date of the layer, for all spatial keys
+            origin = pd.Timestamp(rdd.layer_metadata.bounds.minKey.instant)
+            grouped_by_spatial_key = tiles.map(lambda t: (gps.SpatialKey(t[0].col, t[0].row), t)).groupByKey()
+            return gps.TiledRasterLayer.from_numpy_rdd(gps.LayerType.SPACETIME,
+                                                       grouped_by_spatial_key.mapPartitions(
+                                                           log_memory(functools.partial(spatiotemporal_partition,
+                                                                                        apply_windows, origin))),
+                                                       metadata)
+
+        return self.apply_to_levels(rdd_function)
 
-            result_collection = result_collection._apply_to_levels_geotrellis_rdd(
-                lambda rdd, level: jvm.org.openeo.geotrellis.OpenEOProcesses().remove_overlap(rdd, sizeX, sizeY,
-                                                                                      overlap_x_value,
-                                                                                      overlap_y_value))
+    @staticmethod
+    def _temporal_windows(dates: pd.DatetimeIndex, origin: pd.Timestamp, size: pd.Timedelta,
+                          overlap: pd.Timedelta) -> List[Tuple[slice, pd.Timestamp, pd.Timestamp]]:
+        """
+        Sliding temporal windows over sorted dates: consecutive cores [start, end) of `size`, the first one starting
+        at `origin`, extended with `overlap` on both sides.
 
-        return result_collection
+        :return: (slice of the dates in the extended window, start, end) for every core that contains dates
+        """
+        if origin.tzinfo is None and dates.tz is not None:
+            origin = origin.tz_localize(dates.tz)
+        elif origin.tzinfo is not None and dates.tz is None:
+            origin = origin.tz_convert(None)
+        windows = []
+        for i in range((dates[0] - origin) // size, (dates[-1] - origin) // size + 1):
+            start = origin + i * size
+            end = start + size
+            if dates.searchsorted(start) == dates.searchsorted(end):
+                continue
+            windows.append((slice(dates.searchsorted(start - overlap), dates.searchsorted(end + overlap)), start, end))
+        return windows
+
+    @staticmethod
+    def _parse_duration(size: dict) -> pd.Timedelta:
+        """Duration of a temporal window size or overlap, in days, weeks or a time (ISO 8601, e.g. "P30D")."""
+        value = size.get('value', None)
+        match = re.match(r"^P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$", str(value))
+        if not match or value in ("P", "PT"):
+            raise OpenEOApiException(message="apply_neighborhood: unsupported temporal window size or overlap"
+                                             " {v!r}, expected an ISO 8601 duration in weeks, days or hours,"
+                                             " minutes and seconds, e.g. 'P30D'.".format(v=value))
+        weeks, days, hours, minutes, seconds = (int(g or 0) for g in match.groups())
+        return pd.Timedelta(weeks=weeks, days=days, hours=hours, minutes=minutes, seconds=seconds)
 
 
     def resample_cube_spatial(self, target:'ImageCollection', method:str='near')-> 'ImageCollection':
@@ -588,16 +1059,16 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
 
         """
         resample_method = ResampleMethod(self._get_resample_method(method))
-        if len(self.pyramid.levels)!=1 or len(target.pyramid.levels)!=1:
+        if len(self._pyramid.levels)!=1 or len(target._pyramid.levels)!=1:
             raise FeatureUnsupportedException(message='This backend does not support resampling between full '
                                                       'pyramids, for instance used by viewing services. Batch jobs '
                                                       'should work.')
-        max_level:TiledRasterLayer = self.pyramid.levels[self.pyramid.max_zoom]
-        target_max_level:TiledRasterLayer = target.pyramid.levels[target.pyramid.max_zoom]
+        max_level:TiledRasterLayer = self._max_level()
+        target_max_level:TiledRasterLayer = target._max_level()
         level_rdd_tuple = self._get_jvm().org.openeo.geotrellis.OpenEOProcesses().resampleCubeSpatial(max_level.srdd.rdd(),target_max_level.srdd.rdd(),resample_method)
 
-        layer = self._create_tilelayer(level_rdd_tuple._2(),max_level.layer_type,target.pyramid.max_zoom)
-        pyramid = Pyramid({target.pyramid.max_zoom:layer})
+        layer = self._create_tilelayer(level_rdd_tuple._2(),max_level.layer_type,target._pyramid.max_zoom)
+        pyramid = Pyramid({target._pyramid.max_zoom:layer})
         return GeotrellisTimeSeriesImageCollection(pyramid, self._service_registry, metadata=self.metadata)
 
 
@@ -631,7 +1102,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             return reprojected
         elif resolution != 0.0:
 
-            max_level = self.pyramid.levels[self.pyramid.max_zoom]
+            max_level = self._max_level()
             extent = max_level.layer_metadata.layout_definition.extent
 
             if projection is not None:
@@ -687,18 +1158,18 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             :param output_max: Maximum output value
             :return An ImageCollection instance
         """
-        rescaled = self.apply_to_levels(lambda layer: layer.normalize(output_min, output_max, input_min, input_max))
+        rescaled = self._with_operation(lambda layer, zoom: layer.normalize(output_min, output_max, input_min, input_max))
         output_range = output_max - output_min
         if output_range >1 and type(output_min) == int and type(output_max) == int:
             if output_range < 254 and output_min >= 0:
-                rescaled = rescaled.apply_to_levels(lambda layer: layer.convert_data_type(gps.CellType.UINT8,255))
+                rescaled = rescaled._with_operation(lambda layer, zoom: layer.convert_data_type(gps.CellType.UINT8,255))
             elif output_range < 65535 and output_min >= 0:
-                rescaled = rescaled.apply_to_levels(lambda layer: layer.convert_data_type(gps.CellType.UINT16))
+                rescaled = rescaled._with_operation(lambda layer, zoom: layer.convert_data_type(gps.CellType.UINT16))
         return rescaled
 
     def timeseries(self, x, y, srs="EPSG:4326") -> Dict:
-        max_level = self.pyramid.levels[self.pyramid.max_zoom]
-        (x_layer,y_layer) = pyproj.transform(pyproj.Proj(init=srs),pyproj.Proj(max_level.layer_metadata.crs),x,y)
+        max_level = self._max_level()
+        (x_layer,y_layer) = projections.transform(srs, max_level.layer_metadata.crs, x, y)
         points = [
             Point(x_layer, y_layer),
         ]
@@ -719,12 +1190,24 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
 
         return result
 
+    def timeseries_points(self, x, y, srs="EPSG:4326") -> xr.DataArray:
+        """
+        Values at many points at once, as a (point, t, bands) DataArray (or (point, bands) without time dimension),
+        NaN where a point has no data.
+
+        :param x: x coordinates of the points, in `srs`
+        :param y: y coordinates of the points, in `srs`
+        """
+        max_level = self._max_level()
+        band_names = self.metadata.band_names if self.metadata.has_band_dimension() else None
+        return point_timeseries.point_timeseries(max_level, x, y, srs=srs, band_names=band_names)
+
     def raster_to_vector(self):
         """
         Outputs polygons, where polygons are formed from homogeneous zones of four-connected neighbors
         @return:
         """
-        max_level = self.pyramid.levels[self.pyramid.max_zoom]
+        max_level = self._max_level()
         with tempfile.NamedTemporaryFile(suffix=".json.tmp",delete=False) as temp_file:
             gps.get_spark_context()._jvm.org.openeo.geotrellis.OpenEOProcesses().vectorize(max_level.srdd.rdd(),temp_file.name)
             #postpone turning into an actual collection upon usage
@@ -733,77 +1216,74 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
 
     def zonal_statistics(self, regions: Union[str, GeometryCollection, Polygon, MultiPolygon], func) -> AggregatePolygonResult:
         # TODO: rename to aggregate_polygon?
-        # TODO eliminate code duplication
         _log.info("zonal_statistics with {f!r}, {r}".format(f=func, r=type(regions)))
 
-        def insert_timezone(instant):
-            return instant.replace(tzinfo=pytz.UTC) if instant.tzinfo is None else instant
-
         from_vector_file = isinstance(regions, str)
         multiple_geometries = from_vector_file or isinstance(regions, GeometryCollection)
 
-        if func in ['histogram', 'sd', 'median']:
-            highest_level = self.pyramid.levels[self.pyramid.max_zoom]
-            layer_metadata = highest_level.layer_metadata
-            scala_data_cube = highest_level.srdd.rdd()
-            polygons = to_projected_polygons(self._get_jvm(), regions)
-            from_date = insert_timezone(layer_metadata.bounds.minKey.instant)
-            to_date = insert_timezone(layer_metadata.bounds.maxKey.instant)
-
-            # TODO also add dumping results first to temp json file like with "mean"
-            if func == 'histogram':
-                stats = self._compute_stats_geotrellis().compute_histograms_time_series_from_datacube(
-                    scala_data_cube, polygons, from_date.isoformat(), to_date.isoformat(), 0
-                )
-            elif func == 'sd':
-                stats = self._compute_stats_geotrellis().compute_sd_time_series_from_datacube(
-                    scala_data_cube, polygons, from_date.isoformat(), to_date.isoformat(), 0
-                )
-            elif func == 'median':
-                stats = self._compute_stats_geotrellis().compute_median_time_series_from_datacube(
-                    scala_data_cube, polygons, from_date.isoformat(), to_date.isoformat(), 0
-                )
-            else:
-                raise ValueError(func)
+        if ConfigParams().zonal_statistics_engine == "geotrellis" and func in ['mean', 'histogram', 'sd', 'median']:
+            return self._zonal_statistics_geotrellis(regions, func, multiple_geometries)
+
+        highest_level = self._max_level()
+        polygons = zonal_statistics.read_regions(regions, highest_level.layer_metadata.crs)
+        return zonal_statistics.ZonalStatisticsResult(
+            # like the GeoTrellis implementation, the mean of a single polygon has dates without "Z"
+            zonal_statistics.ZonalStatistics(highest_level, polygons, func,
+                                             utc_designator=multiple_geometries or func != "mean"),
+            # TODO: regions can also be a string (path to vector file) instead of geometry object
+            regions=regions if multiple_geometries else GeometryCollection([regions]),
+        )
 
+    def _zonal_statistics_geotrellis(self, regions, func, multiple_geometries: bool) -> AggregatePolygonResult:
+        def insert_timezone(instant):
+            return instant.replace(tzinfo=pytz.UTC) if instant.tzinfo is None else instant
+
+        if func == "mean" and not multiple_geometries:
             return AggregatePolygonResult(
-                timeseries=self._as_python(stats),
-                # TODO: regions can also be a string (path to vector file) instead of geometry object
-                regions=regions if multiple_geometries else GeometryCollection([regions]),
+                timeseries=self.polygonal_mean_timeseries(regions),
+                regions=GeometryCollection([regions]),
             )
-        elif func == "mean":
-            if multiple_geometries:
-                highest_level = self.pyramid.levels[self.pyramid.max_zoom]
-                layer_metadata = highest_level.layer_metadata
-                scala_data_cube = highest_level.srdd.rdd()
-                polygons = to_projected_polygons(self._get_jvm(), regions)
-                from_date = insert_timezone(layer_metadata.bounds.minKey.instant)
-                to_date = insert_timezone(layer_metadata.bounds.maxKey.instant)
-
-                with tempfile.NamedTemporaryFile(suffix=".json.tmp") as temp_file:
-                    self._compute_stats_geotrellis().compute_average_timeseries_from_datacube(
-                        scala_data_cube,
-                        polygons,
-                        from_date.isoformat(),
-                        to_date.isoformat(),
-                        0,
-                        temp_file.name
-                    )
-                    with open(temp_file.name, encoding='utf-8') as f:
-                        timeseries = json.load(f)
-                return AggregatePolygonResult(
-                    timeseries=timeseries,
-                    # TODO: regions can also be a string (path to vector file) instead of geometry object
-                    regions=regions,
-                )
-            else:
-                return AggregatePolygonResult(
-                    timeseries=self.polygonal_mean_timeseries(regions),
-                    regions=GeometryCollection([regions]),
+
+        highest_level = self._max_level()
+        layer_metadata = highest_level.layer_metadata
+        scala_data_cube = highest_level.srdd.rdd()
+        polygons = to_projected_polygons(self._get_jvm(), regions)
+        from_date = insert_timezone(layer_metadata.bounds.minKey.instant)
+        to_date = insert_timezone(layer_metadata.bounds.maxKey.instant)
+
+        if func == 'mean':
+            with tempfile.NamedTemporaryFile(suffix=".json.tmp") as temp_file:
+                self._compute_stats_geotrellis().compute_average_timeseries_from_datacube(
+                    scala_data_cube,
+                    polygons,
+                    from_date.isoformat(),
+                    to_date.isoformat(),
+                    0,
+                    temp_file.name
                 )
+                with open(temp_file.name, encoding='utf-8') as f:
+                    timeseries = json.load(f)
+        elif func == 'histogram':
+            timeseries = self._as_python(self._compute_stats_geotrellis().compute_histograms_time_series_from_datacube(
+                scala_data_cube, polygons, from_date.isoformat(), to_date.isoformat(), 0
+            ))
+        elif func == 'sd':
+            timeseries = self._as_python(self._compute_stats_geotrellis().compute_sd_time_series_from_datacube(
+                scala_data_cube, polygons, from_date.isoformat(), to_date.isoformat(), 0
+            ))
+        elif func == 'median':
+            timeseries = self._as_python(self._compute_stats_geotrellis().compute_median_time_series_from_datacube(
+                scala_data_cube, polygons, from_date.isoformat(), to_date.isoformat(), 0
+            ))
         else:
             raise ValueError(func)
 
+        return AggregatePolygonResult(
+            timeseries=timeseries,
+            # TODO: regions can also be a string (path to vector file) instead of geometry object
+            regions=regions if multiple_geometries else GeometryCollection([regions]),
+        )
+
     def _compute_stats_geotrellis(self):
         accumulo_instance_name = 'hdp-accumulo-instance'
         return self._get_jvm().org.openeo.geotrellis.ComputeStatsGeotrellisAdapter(self._zookeepers(), accumulo_instance_name)
@@ -830,53 +1310,25 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         return java_object
 
     def polygonal_mean_timeseries(self, polygon: Union[Polygon, MultiPolygon]) -> Dict:
-        max_level = self.pyramid.levels[self.pyramid.max_zoom]
+        max_level = self._max_level()
         layer_crs = max_level.layer_metadata.crs
         reprojected_polygon = GeotrellisTimeSeriesImageCollection.__reproject_polygon(polygon, "+init=EPSG:4326" ,layer_crs)
 
         #TODO somehow mask function was masking everything, while the approach with direct timeseries computation did not have issues...
         masked_layer = max_level.mask(reprojected_polygon)
 
-        no_data = masked_layer.layer_metadata.no_data_value
-
-        def combine_cells(acc: List[Tuple[int, int]], tile) -> List[Tuple[int, int]]:  # [(sum, count)]
-            n_bands = len(tile.cells)
-
-            if not acc:
-                acc = [(0, 0)] * n_bands
-
-            for i in range(n_bands):
-                grid = tile.cells[i]
-
-                # special treatment for a UDF layer (NO_DATA is nan so every value, including nan, is not equal to nan)
-                without_no_data = (~np.isnan(grid)) & (grid != no_data)
-
-                sum = grid[without_no_data].sum()
-                count = without_no_data.sum()
-
-                acc[i] = acc[i][0] + sum, acc[i][1] + count
-
-            return acc
-
-        def combine_values(l1: List[Tuple[int, int]], l2: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
-            for i in range(len(l2)):
-                l1[i] = l1[i][0] + l2[i][0], l1[i][1] + l2[i][1]
+        band_means = BandMeans(masked_layer.layer_metadata.no_data_value)
 
-            return l1
-
-        polygon_mean_by_timestamp = masked_layer.to_numpy_rdd() \
+        polygon_mean_by_timestamp = arrow_tiles.to_numpy_rdd(masked_layer) \
             .map(lambda pair: (pair[0].instant, pair[1])) \
-            .aggregateByKey([], combine_cells, combine_values)
-
-        def to_mean(values: Tuple[int, int]) -> float:
-            sum, count = values
-            return sum / count
+            .aggregateByKey(None, band_means.add, band_means.merge) \
+            .mapValues(band_means.finish)
 
         collected = polygon_mean_by_timestamp.collect()
-        return {timestamp.isoformat(): [[to_mean(v) for v in values]] for timestamp, values in collected}
+        return {timestamp.isoformat(): [means] for timestamp, means in collected}
 
     def _to_xarray(self):
-        spatial_rdd = self.pyramid.levels[self.pyramid.max_zoom]
+        spatial_rdd = self._max_level()
         return self._collect_as_xarray(spatial_rdd)
 
     def download(self,outputfile:str, **format_options) -> str:
@@ -884,9 +1336,16 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         Extracts into various formats from this image collection.
         
         Supported formats:
-        * GeoTIFF: raster with the limitation that it only export bands at a single (random) date 
-        * NetCDF: raster, currently using h5NetCDF
-        * JSON: the json serialization of the underlying xarray, with extra attributes such as value/coord dtypes, crs, nodata value
+        * GeoTIFF: raster with the limitation that it only export bands at a single (random) date;
+          the "overviews" parameter adds overviews (the tiles are streamed to the driver);
+          with the "multi_date" parameter, the executors write a GeoTIFF per date and the output file is a STAC-like
+          GeoJSON index of these files
+        * NetCDF: raster, currently using h5NetCDF; with the "distributed" parameter, the executors write the data
+          as part files in a "<outputfile>.parts" directory that is referred to by the (small) output file
+        * Zarr: directory with a chunk per tile, date and band, written by the executors; a synchronous download
+          (no outputfile) is that directory as a zip file (a Zarr ZipStore)
+        * JSON: the json serialization of the underlying xarray, with extra attributes such as value/coord dtypes, crs, nodata value;
+          the "data_encoding" parameter selects nested lists ("list", default), "base64" or a separate .npy file ("npy")
         """
         #geotiffs = self.rdd.merge().to_geotiff_rdd(compression=gps.Compression.DEFLATE_COMPRESSION).collect()
         format=format_options.get("format", "GTiff").upper()
@@ -898,7 +1357,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             filename = outputfile
 
         # get the data at highest resolution
-        spatial_rdd = self.pyramid.levels[self.pyramid.max_zoom]
+        spatial_rdd = self._max_level()
 
         # spatial bounds        
         xmin, ymin, xmax, ymax = format_options.get('left'), format_options.get('bottom'),\
@@ -925,13 +1384,20 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         tiled = format_options.get("tiled", False)          
         catalog = format_options.get("parameters", {}).get("catalog", False)
 
-        if format == "GTIFF":
+        if format == "GTIFF" and format_options.get("parameters", {}).get("multi_date", False) \
+                and spatial_rdd.layer_type == gps.LayerType.SPACETIME:
+            self._save_per_date(spatial_rdd, filename, crop_bounds if not tiled else None,
+                                crop_dates if not tiled else None, zlevel=format_options.get("ZLEVEL", 6))
+
+        elif format == "GTIFF":
             if spatial_rdd.layer_type != gps.LayerType.SPATIAL:
                 spatial_rdd = spatial_rdd.to_spatial_layer()
 
             zlevel = format_options.get("ZLEVEL",6)
             if catalog:
-                self._save_on_executors(spatial_rdd, filename)
+                self._save_on_executors(spatial_rdd, filename, zlevel=zlevel)
+            elif format_options.get("parameters", {}).get("overviews", False):
+                self._save_stitched_tiled(spatial_rdd, filename)
             elif tiled:
                 band_count = 1
                 if self.metadata.has_band_dimension():
@@ -940,6 +1406,10 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             else:
                 self._save_stitched(spatial_rdd, filename, crop_bounds,zlevel=zlevel)
 
+        elif format == "NETCDF" and format_options.get("parameters", {}).get("distributed", False):
+            self._save_netcdf_on_executors(spatial_rdd, filename, crop_bounds if not tiled else None,
+                                           crop_dates if not tiled else None)
+
         elif format == "NETCDF":
             if not tiled:
                 result=self._collect_as_xarray(spatial_rdd, crop_bounds, crop_dates)
@@ -956,38 +1426,30 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             # TODO: NETCDF4 is broken. look into
             result.to_netcdf(filename, engine='h5netcdf') # engine='scipy')
 
+        elif format == "ZARR":
+            band_names = self.metadata.band_names if self.metadata.has_band_dimension() else ['band_0']
+            attrs = dict(nodata=spatial_rdd.layer_metadata.no_data_value, crs=spatial_rdd.layer_metadata.crs)
+            # a synchronous download is a single file: the store is zipped into it
+            store = filename if outputfile is not None else filename + ".zarr"
+            zarr_writer.write_zarr(spatial_rdd, store, band_names, attrs,
+                                   crop_bounds=crop_bounds if not tiled else None,
+                                   crop_dates=crop_dates if not tiled else None)
+            if outputfile is None:
+                zarr_writer.zip_store(store, filename)
+                shutil.rmtree(store)
+
         elif format == "JSON":
-            # saving to json, this is potentially big in memory
-            # get result as xarray
+            data_encoding = format_options.get("parameters", {}).get("data_encoding", "list")
+            if data_encoding not in json_writer.DATA_ENCODINGS:
+                raise OpenEOApiException(
+                    message="Invalid data_encoding {e!r}, should be one of {s!r}".format(
+                        e=data_encoding, s=json_writer.DATA_ENCODINGS),
+                    status_code=400
+                )
             if not tiled:
-                result=self._collect_as_xarray(spatial_rdd, crop_bounds, crop_dates)
+                self._save_json(spatial_rdd, filename, data_encoding, crop_bounds, crop_dates)
             else:
-                result=self._collect_as_xarray(spatial_rdd)
-            jsonresult=result.to_dict()
-            # add attributes that needed for re-creating xarray from json
-            jsonresult['attrs']['dtype']=str(result.values.dtype)
-            jsonresult['attrs']['shape']=list(result.values.shape)
-            for i in result.coords.values():
-                jsonresult['coords'][i.name]['attrs']['dtype']=str(i.dtype)
-                jsonresult['coords'][i.name]['attrs']['shape']=list(i.shape)
-            result=None
-            # custom print so resulting json is easy to read humanly
-            with open(filename,'w') as f:
-                def custom_print(data_structure, indent=1):
-                    f.write("{\n")
-                    needs_comma=False
-                    for key, value in data_structure.items():
-                        if needs_comma: 
-                            f.write(',\n')
-                        needs_comma=True
-                        f.write('  '*indent+json.dumps(key)+':')
-                        if isinstance(value, dict): 
-                            custom_print(value, indent+1)
-                        else: 
-                            json.dump(value,f,default=str,separators=(',',':'))
-                    f.write('\n'+'  '*(indent-1)+"}")
-                    
-                custom_print(jsonresult)
+                self._save_json(spatial_rdd, filename, data_encoding)
 
         else:
             raise OpenEOApiException(
@@ -996,8 +1458,12 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             )
         return filename
 
-    def _collect_as_xarray(self, rdd, crop_bounds=None, crop_dates=None):
-            
+    def _xarray_layout(self, rdd, crop_bounds=None):
+        """
+        Pixel windows and xarray dimensions/coordinates (except for time) of the (cropped) layer.
+
+        :return: tuple of crop window, layout window, dims and coords
+        """
         # windows/dims are tuples of (xmin/mincol,ymin/minrow,width/cols,height/rows)
         layout_pix=rdd.layer_metadata.layout_definition.tileLayout
         layout_win=(0, 0, layout_pix.layoutCols*layout_pix.tileCols, layout_pix.layoutRows*layout_pix.tileRows)
@@ -1035,66 +1501,38 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
         coords['x']=np.linspace(crop_dim[0]+0.5*xres, crop_dim[0]+crop_dim[2]-0.5*xres, crop_win[2])
         dims.append('y')
         coords['y']=np.linspace(crop_dim[1]+0.5*yres, crop_dim[1]+crop_dim[3]-0.5*yres, crop_win[3])
-        
-        def stitch_at_time(crop_win, layout_win, items):
-            
-            # value expected to be another tuple with the original spacetime key and the array
-            subarrs=list(items[1])
-                        
-            # get block sizes
-            bw,bh=subarrs[0][1].cells.shape[-2:]
-            bbands=sum(subarrs[0][1].cells.shape[:-2]) if len(subarrs[0][1].cells.shape)>2 else 1
-            wbind=np.arange(0,bbands)
-            dtype=subarrs[0][1].cells.dtype
-            nodata=subarrs[0][1].no_data_value
-            
-            # allocate collector ndarray
-            if nodata:
-                window=np.full((bbands,crop_win[2],crop_win[3]), nodata, dtype)
-            else:
-                window=np.empty((bbands,crop_win[2],crop_win[3]), dtype)
-            wxind=np.arange(crop_win[0],crop_win[0]+crop_win[2])
-            wyind=np.arange(crop_win[1],crop_win[1]+crop_win[3])
-
-            # override classic bottom-left corner coord system to top-left
-            # note that possible key types are SpatialKey and SpaceTimeKey, but since at this level only col/row is used, casting down to SpatialKey
-            switch_topleft=True
-            tp=(0,1,2)
-            if switch_topleft:
-                nyblk=int(layout_win[3]/bh)-1
-                subarrs=list(map(
-                    lambda t: ( SpatialKey(t[0].col,nyblk-t[0].row), t[1] ),
-                    subarrs
-                ))
-                tp=(0,2,1)
-            
-            # loop over blocks and merge into
-            for iblk in subarrs:
-                iwin=(iblk[0].col*bw, iblk[0].row*bh, bw, bh)
-                iarr=iblk[1].cells
-                iarr=iarr.reshape((-1,bh,bw)).transpose(tp)
-                ixind=np.arange(iwin[0],iwin[0]+iwin[2])
-                iyind=np.arange(iwin[1],iwin[1]+iwin[3])
-                if switch_topleft:
-                    iyind=iyind[::-1]
-                xoverlap= np.intersect1d(wxind,ixind,True,True)
-                yoverlap= np.intersect1d(wyind,iyind,True,True)
-                if len(xoverlap[1])>0 and len(yoverlap[1]>0):
-                    window[np.ix_(wbind,xoverlap[1],yoverlap[1])]=iarr[np.ix_(wbind,xoverlap[2],yoverlap[2])]
-                    
-            # return date (or None) - window tuple
-            return (items[0],window)
+        return crop_win, layout_win, dims, coords
 
-        # at every date stitch together the layer, still on the workers   
+    @staticmethod
+    def _stitch_at_time(crop_win, layout_win, items):
+        """Stitch the (key, tile) items of a date into a single (bands, x, y) window."""
+        # value expected to be another tuple with the original spacetime key and the array
+        # return date (or None) - window tuple
+        return (items[0], stitching.stitch(items[1], crop_win, layout_win[3]))
+
+    def _dated_tiles(self, rdd, crop_dates=None):
+        """RDD of (date or None, (key, tile)) tuples."""
+        has_time=self.metadata.has_temporal_dimension()
         #mapped=list(map(lambda t: (t[0].row,t[0].col),rdd.to_numpy_rdd().collect())); min(mapped); max(mapped)
-        from functools import partial
-        collection=rdd\
+        return rdd\
             .to_numpy_rdd()\
             .filter(lambda t: (t[0].instant>=crop_dates[0] and t[0].instant<=crop_dates[1]) if has_time and crop_dates != None else True)\
-            .map(lambda t: (t[0].instant if has_time else None, (t[0], t[1])))\
+            .map(lambda t: (t[0].instant if has_time else None, (t[0], t[1])))
+
+    def _stitched_windows(self, rdd, crop_win, layout_win, crop_dates=None):
+        """RDD of (date or None, stitched (bands, x, y) window) tuples: one per date."""
+        # at every date stitch together the layer, still on the workers   
+        from functools import partial
+        return self._dated_tiles(rdd, crop_dates)\
             .groupByKey()\
-            .map(partial(stitch_at_time, crop_win, layout_win))\
-            .collect()
+            .map(partial(GeotrellisTimeSeriesImageCollection._stitch_at_time, crop_win, layout_win))
+
+    def _collect_as_xarray(self, rdd, crop_bounds=None, crop_dates=None):
+        crop_win, layout_win, dims, coords = self._xarray_layout(rdd, crop_bounds)
+        has_time=self.metadata.has_temporal_dimension()
+        has_bands=self.metadata.has_band_dimension()
+
+        collection=self._stitched_windows(rdd, crop_win, layout_win, crop_dates).collect()
 #         collection=rdd\
 #             .to_numpy_rdd()\
 #             .filter(lambda t: (t[0].instant>=crop_dates[0] and t[0].instant<=crop_dates[1]) if has_time else True)\
@@ -1138,24 +1576,56 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
 
         
 
-    def _reproject_extent(self, src_crs, dst_crs, xmin, ymin, xmax, ymax):
-        src_proj = pyproj.Proj(src_crs)
-        dst_proj = pyproj.Proj(dst_crs)
-
-        def reproject_point(x, y):
-            return pyproj.transform(
-                src_proj,
-                dst_proj,
-                x, y
-            )
+    def _save_json(self, rdd, filename, data_encoding="list", crop_bounds=None, crop_dates=None):
+        """Stream the stitched windows to the driver one date at a time, and write them as JSON."""
+        crop_win, layout_win, dims, coords = self._xarray_layout(rdd, crop_bounds)
+        attrs = dict(nodata=rdd.layer_metadata.no_data_value, crs=rdd.layer_metadata.crs)
+        if not self.metadata.has_temporal_dimension():
+            windows = self._stitched_windows(rdd, crop_win, layout_win, crop_dates)
+            return json_writer.write_json(filename, windows.toLocalIterator(), dims, coords, attrs, data_encoding)
+
+        # the tiles are only computed once: to find the dates, then to stitch them
+        tiles = self._dated_tiles(rdd, crop_dates).persist(StorageLevel.MEMORY_AND_DISK)
+        try:
+            date_index = {date: i for i, date in enumerate(sorted(tiles.keys().distinct().collect()))}
+            # a partition per date, in order: toLocalIterator fetches a single window at a time
+            windows = tiles \
+                .groupByKey(numPartitions=max(1, len(date_index)), partitionFunc=date_index.get) \
+                .map(functools.partial(GeotrellisTimeSeriesImageCollection._stitch_at_time, crop_win, layout_win))
+            return json_writer.write_json(filename, windows.toLocalIterator(), dims, coords, attrs, data_encoding)
+        finally:
+            tiles.unpersist()
+
+    def _save_netcdf_on_executors(self, rdd, filename, crop_bounds=None, crop_dates=None):
+        crop_win, layout_win, dims, coords = self._xarray_layout(rdd, crop_bounds)
+        band_names = coords['bands'] if 'bands' in coords else ['band_0']
+        attrs = dict(nodata=rdd.layer_metadata.no_data_value, crs=rdd.layer_metadata.crs)
+        windows = self._stitched_windows(rdd, crop_win, layout_win, crop_dates)
+        return netcdf_writer.write_netcdf(windows, filename, band_names, x=coords['x'], y=coords['y'],
+                                          has_time=self.metadata.has_temporal_dimension(), attrs=attrs)
+
+    def _save_per_date(self, rdd, filename, crop_bounds=None, crop_dates=None, zlevel=6):
+        crop_win, layout_win, dims, coords = self._xarray_layout(rdd, crop_bounds)
+        band_names = coords['bands'] if 'bands' in coords else ['band_0']
+        windows = self._stitched_windows(rdd, crop_win, layout_win, crop_dates)
+        return geotiff_writer.write_geotiffs_per_date(windows, filename, x=coords['x'], y=coords['y'],
+                                                      crs=rdd.layer_metadata.crs,
+                                                      nodata=rdd.layer_metadata.no_data_value,
+                                                      band_names=band_names, zlevel=zlevel)
 
-        reprojected_xmin, reprojected_ymin = reproject_point(xmin, ymin)
-        reprojected_xmax, reprojected_ymax = reproject_point(xmax, ymax)
+    def _reproject_extent(self, src_crs, dst_crs, xmin, ymin, xmax, ymax):
+        reprojected_xmin, reprojected_ymin, reprojected_xmax, reprojected_ymax = \
+            projections.transform_bounds(src_crs, dst_crs, xmin, ymin, xmax, ymax)
         crop_bounds = \
             Extent(xmin=reprojected_xmin, ymin=reprojected_ymin, xmax=reprojected_xmax, ymax=reprojected_ymax)
         return crop_bounds
 
     def _save_on_executors(self, spatial_rdd: gps.TiledRasterLayer, path,zlevel=6):
+        if geotiff_writer.is_supported(spatial_rdd):
+            geotiff_writer.write_geotiff(spatial_rdd, path, zlevel=zlevel)
+            return
+
+        # fall back to a TIFF per spatial key, merged on the driver
         geotiff_rdd = spatial_rdd.to_geotiff_rdd(
             storage_method=gps.StorageMethod.TILED,
             compression=gps.Compression.DEFLATE_COMPRESSION
@@ -1193,57 +1663,75 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             jvm.org.openeo.geotrellis.geotiff.package.saveStitched(spatial_rdd.srdd.rdd(), path, max_compression)
 
     def _save_stitched_tiled(self, spatial_rdd, filename):
+        """
+        Write a spatial layer as a single tiled GeoTIFF with overviews, streaming the tiles to the driver:
+        only a partition of (at most STREAMING_TILES_PER_PARTITION) tiles is in memory at a time.
+        """
         import rasterio as rstr
         from affine import Affine
+        from rasterio.windows import Window
         import rasterio._warp as rwarp
 
-        max_level = self.pyramid.levels[self.pyramid.max_zoom]
-
-        spatial_rdd = spatial_rdd.persist()
-
-        sorted_keys = sorted(spatial_rdd.collect_keys())
+        keys = spatial_rdd.collect_keys()
+        if not keys:
+            raise OpenEOApiException(message="Can not write an empty layer to GeoTIFF", status_code=400)
+        min_col, max_col = min(k.col for k in keys), max(k.col for k in keys)
+        min_row, max_row = min(k.row for k in keys), max(k.row for k in keys)
 
-        upper_left_coords = GeotrellisTimeSeriesImageCollection._mapTransform(max_level.layer_metadata.layout_definition, sorted_keys[0])
-        lower_right_coords = GeotrellisTimeSeriesImageCollection._mapTransform(max_level.layer_metadata.layout_definition, sorted_keys[-1])
+        layout_definition = spatial_rdd.layer_metadata.layout_definition
+        upper_left_coords = GeotrellisTimeSeriesImageCollection._mapTransform(layout_definition, SpatialKey(min_col, min_row))
+        lower_right_coords = GeotrellisTimeSeriesImageCollection._mapTransform(layout_definition, SpatialKey(max_col, max_row))
 
-        data = spatial_rdd.stitch()
-
-        bands, w, h = data.cells.shape
-        nodata = max_level.layer_metadata.no_data_value
-        dtype = data.cells.dtype
+        tile_cols, tile_rows = layout_definition.tileLayout.tileCols, layout_definition.tileLayout.tileRows
+        w, h = (max_col - min_col + 1) * tile_cols, (max_row - min_row + 1) * tile_rows
+        nodata = spatial_rdd.layer_metadata.no_data_value
         ex = Extent(xmin=upper_left_coords.left, ymin=lower_right_coords.bottom, xmax=lower_right_coords.right, ymax=upper_left_coords.top)
         cw, ch = (ex.xmax - ex.xmin) / w, (ex.ymax - ex.ymin) / h
         overview_level = int(math.log(w) / math.log(2) - 8)
 
-        with rstr.io.MemoryFile() as memfile, open(filename, 'wb') as f:
-            with memfile.open(driver='GTiff',
-                              count=bands,
-                              width=w,
-                              height=h,
-                              transform=Affine(cw, 0.0, ex.xmin,
-                                               0.0, -ch, ex.ymax),
-                              crs=rstr.crs.CRS.from_proj4(spatial_rdd.layer_metadata.crs),
-                              nodata=nodata,
-                              dtype=dtype,
-                              compress='lzw',
-                              tiled=True) as mem:
-                windows = list(mem.block_windows(1))
-                for _, w in windows:
-                    segment = data.cells[:, w.row_off:(w.row_off + w.height), w.col_off:(w.col_off + w.width)]
-                    mem.write(segment, window=w)
-                    mask_value = np.all(segment != nodata, axis=0).astype(np.uint8) * 255
-                    mem.write_mask(mask_value, window=w)
-
-                    overviews = [2 ** j for j in range(1, overview_level + 1)]
-                    mem.build_overviews(overviews, rwarp.Resampling.nearest)
-                    mem.update_tags(ns='rio_oveview', resampling=rwarp.Resampling.nearest.value)
-
-            while True:
-                chunk = memfile.read(8192)
-                if not chunk:
-                    break
-
-                f.write(chunk)
+        tiles = spatial_rdd.to_numpy_rdd()
+        partitions = math.ceil(len(keys) / self.STREAMING_TILES_PER_PARTITION)
+        if tiles.getNumPartitions() < partitions:
+            tiles = tiles.repartition(partitions)
+
+        block_size = {}
+        if tile_cols % 16 == 0 and tile_rows % 16 == 0:
+            block_size = dict(blockxsize=tile_cols, blockysize=tile_rows)
+
+        dst = None
+        try:
+            for key, tile in tiles.toLocalIterator():
+                cells = tile.cells.reshape((-1, tile_rows, tile_cols))
+                if dst is None:
+                    # band count and dtype are only known once the first tile is there
+                    dst = rstr.open(filename, 'w',
+                                    driver='GTiff',
+                                    count=cells.shape[0],
+                                    width=w,
+                                    height=h,
+                                    transform=Affine(cw, 0.0, ex.xmin,
+                                                     0.0, -ch, ex.ymax),
+                                    crs=rstr.crs.CRS.from_proj4(spatial_rdd.layer_metadata.crs),
+                                    nodata=nodata,
+                                    dtype=cells.dtype,
+                                    compress='lzw',
+                                    tiled=True,
+                                    **block_size)
+                window = Window(col_off=(key.col - min_col) * tile_cols, row_off=(key.row - min_row) * tile_rows,
+                                width=tile_cols, height=tile_rows)
+                dst.write(cells, window=window)
+                if nodata is not None:
+                    mask_value = np.all(cells != nodata, axis=0).astype(np.uint8) * 255
+                    dst.write_mask(mask_value, window=window)
+
+            # overviews are built once, from the full resolution image on disk
+            overviews = [2 ** j for j in range(1, overview_level + 1)]
+            if overviews:
+                dst.build_overviews(overviews, rwarp.Resampling.nearest)
+                dst.update_tags(ns='rio_overview', resampling=rwarp.Resampling.nearest.value)
+        finally:
+            if dst is not None:
+                dst.close()
 
     def _proxy_tms(self,tms):
         if ConfigParams().is_ci_context:
@@ -1290,11 +1778,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             .reduce_dimension("bands") \
             .add_dimension(type="bands", name="bands", label=name or 'ndvi')
 
-        return GeotrellisTimeSeriesImageCollection(
-            ndvi_collection.pyramid,
-            self._service_registry,
-            ndvi_metadata
-        )
+        return ndvi_collection._with_metadata(ndvi_metadata)
 
     def _ndvi_v10(self, nir: str = None, red: str = None, target_band: str = None) -> 'GeotrellisTimeSeriesImageCollection':
         """1.0-style of ndvi process"""
@@ -1357,11 +1841,7 @@ class GeotrellisTimeSeriesImageCollection(ImageCollection):
             result_collection = ndvi_collection
             result_metadata = self.metadata.reduce_dimension("bands")
 
-        return GeotrellisTimeSeriesImageCollection(
-            result_collection.pyramid,
-            self._service_registry,
-            result_metadata
-        )
+        return result_collection._with_metadata(result_metadata)
 
     def _ndvi_collection(self, red_index: int, nir_index: int) -> 'GeotrellisTimeSeriesImageCollection':
         reduce_graph = {
@@ -2,8 +2,7 @@
 
 import math
 
-import pyproj
-import shapely.ops
+from openeogeotrellis import projections
 
 
 def auto_utm_epsg(lon, lat):
@@ -36,9 +35,7 @@ def auto_utm_epsg_for_geometry(geometry, crs):
     crs_wgs = 'epsg:4326'
 
     if crs != crs_wgs:
-        x, y = pyproj.transform(pyproj.Proj(crs),
-                                pyproj.Proj(crs_wgs),
-                                x, y, always_xy=True)
+        x, y = projections.transform(crs, crs_wgs, x, y)
 
     # And derive the EPSG code
 
@@ -54,20 +51,8 @@ def auto_utm_crs_for_geometry(geometry, crs):
 
 def geometry_to_crs(geometry, crs_from, crs_to):
 
-    # Skip if CRS definitions are exactly the same
+    # Skip if CRS definitions are the same, otherwise transform all coordinates in the geometry
+    # (with a cached transformer)
 
-    if crs_from == crs_to:
-        return geometry
-
-    # Construct a function for projecting coordinates
-
-    proj_from = pyproj.Proj(crs_from)
-    proj_to   = pyproj.Proj(crs_to)
-
-    def project(x, y, z=0):
-        return pyproj.transform(proj_from, proj_to, x, y, always_xy=True)
-
-    # And apply to all coordinates in the geometry
-
-    return shapely.ops.transform(project, geometry)
+    return projections.reproject_geometry(geometry, crs_from, crs_to)
 
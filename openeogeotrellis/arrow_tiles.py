@@ -0,0 +1,159 @@
+"""
+Arrow transport of tiles between the JVM and the Python workers.
+
+With geopyspark's `to_numpy_rdd`/`from_numpy_rdd`, every tile is encoded as a protobuf message that is decoded (and
+copied) on the other side. With the Arrow transport, the JVM encodes the tiles of a partition as Arrow IPC streams of
+record batches (see `SCHEMA`): on the Python side, the cells of a tile are a single copy of its slice of the Arrow
+buffer, so that they are writable like the geopyspark ones. Tiles are sent back to the JVM the same way.
+
+The JVM side is `org.openeo.geotrellis.arrow.ArrowTileTransport` of the geotrellis extensions:
+- `schemaVersion()`: the version of `SCHEMA` it encodes/decodes
+- `toArrowRDD(srdd, tilesPerBatch)`: JavaRDD of Arrow IPC streams (byte arrays) of the tiles of a layer
+- `fromArrowRDD(jrdd, layerType, metadataJson)`: tiled raster layer (as wrapped by `TiledRasterLayer`) of such an RDD
+
+Whether it is available, with the same schema version, is negotiated once per Spark context. Otherwise,
+the geopyspark (protobuf) encoding is used, so `to_numpy_rdd`/`from_numpy_rdd` of this module can always be used
+instead of the `TiledRasterLayer` ones.
+"""
+import functools
+import itertools
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Iterable, Iterator, Tuple, Union
+
+import numpy as np
+import pyarrow as pa
+from geopyspark import TiledRasterLayer, LayerType, Metadata, SpaceTimeKey, SpatialKey, Tile
+from py4j.java_gateway import JavaClass
+from pyspark import RDD, SparkContext
+from pyspark.serializers import NoOpSerializer
+
+logger = logging.getLogger("openeo")
+
+SCHEMA_VERSION = 1
+
+SCHEMA = pa.schema([
+    ("col", pa.int32()),
+    ("row", pa.int32()),
+    ("instant", pa.int64()),  # milliseconds since epoch (UTC), null for a SpatialKey
+    ("shape", pa.list_(pa.int32())),  # (bands, rows, cols)
+    ("dtype", pa.string()),  # numpy dtype name of the cells, e.g. "float32"
+    ("cell_type", pa.string()),
+    ("no_data_value", pa.float64()),  # null: no no-data value
+    ("cells", pa.binary()),  # little endian, C order
+], metadata={"version": str(SCHEMA_VERSION)})
+
+TILES_PER_BATCH = 16
+
+JVM_TRANSPORT_CLASS = "org.openeo.geotrellis.arrow.ArrowTileTransport"
+
+
+def to_numpy_rdd(layer: TiledRasterLayer) -> RDD:
+    """(key, Tile) RDD of a layer, like `layer.to_numpy_rdd()`, but through Arrow if the JVM supports it."""
+    transport = jvm_transport(layer.pysc)
+    if transport is None:
+        return layer.to_numpy_rdd()
+    encoded = RDD(transport.toArrowRDD(layer.srdd, TILES_PER_BATCH), layer.pysc, NoOpSerializer())
+    return encoded.flatMap(decode)
+
+
+def from_numpy_rdd(layer_type: LayerType, numpy_rdd: RDD, metadata: Union[Metadata, dict]) -> TiledRasterLayer:
+    """Layer of a (key, Tile) RDD, like `TiledRasterLayer.from_numpy_rdd`, but through Arrow if the JVM supports it."""
+    transport = jvm_transport(numpy_rdd.context)
+    if transport is None:
+        return TiledRasterLayer.from_numpy_rdd(layer_type, numpy_rdd, metadata)
+    if isinstance(metadata, Metadata):
+        metadata = metadata.to_dict()
+    encoded = numpy_rdd.mapPartitions(encode)._reserialize(NoOpSerializer())
+    srdd = transport.fromArrowRDD(encoded._jrdd, LayerType(layer_type).value, json.dumps(metadata))
+    return TiledRasterLayer(layer_type, srdd)
+
+
+def jvm_transport(sc: SparkContext):
+    """The JVM side of the Arrow transport, or None if it is not available or encodes another schema version."""
+    return _negotiate(sc)
+
+
+@functools.lru_cache(maxsize=1)
+def _negotiate(sc: SparkContext):
+    transport = sc._jvm
+    for name in JVM_TRANSPORT_CLASS.split("."):
+        transport = getattr(transport, name)
+    if not isinstance(transport, JavaClass):
+        logger.info("No Arrow tile transport on the JVM ({c}): using the geopyspark tile encoding".format(
+            c=JVM_TRANSPORT_CLASS))
+        return None
+    version = transport.schemaVersion()
+    if version != SCHEMA_VERSION:
+        logger.warning("Arrow tile schema version {j} of the JVM differs from {p}: using the geopyspark tile encoding"
+                       .format(j=version, p=SCHEMA_VERSION))
+        return None
+    return transport
+
+
+def encode(items: Iterable[Tuple[Union[SpatialKey, SpaceTimeKey], Tile]],
+           tiles_per_batch: int = TILES_PER_BATCH) -> Iterator[pa.Buffer]:
+    """Arrow IPC streams of a record batch of (at most) `tiles_per_batch` (key, Tile) items each."""
+    items = iter(items)
+    while True:
+        batch = list(itertools.islice(items, tiles_per_batch))
+        if not batch:
+            return
+        sink = pa.BufferOutputStream()
+        writer = pa.ipc.new_stream(sink, SCHEMA)
+        writer.write_batch(record_batch(batch))
+        writer.close()
+        yield sink.getvalue()
+
+
+def decode(stream) -> Iterator[Tuple[Union[SpatialKey, SpaceTimeKey], Tile]]:
+    """(key, Tile) items of an Arrow IPC stream (e.g. bytes)."""
+    for batch in pa.ipc.open_stream(pa.py_buffer(stream)):
+        yield from batch_tiles(batch)
+
+
+def record_batch(items: Iterable[Tuple[Union[SpatialKey, SpaceTimeKey], Tile]]) -> pa.RecordBatch:
+    keys, tiles = zip(*items)
+    cells = [np.ascontiguousarray(tile.cells, dtype=tile.cells.dtype.newbyteorder("<")) for tile in tiles]
+    offsets = np.zeros(len(cells) + 1, dtype=np.int32)
+    np.cumsum([c.nbytes for c in cells], out=offsets[1:])
+    data = np.concatenate([c.reshape(-1).view(np.uint8) for c in cells])
+
+    return pa.RecordBatch.from_arrays([
+        pa.array([key.col for key in keys], pa.int32()),
+        pa.array([key.row for key in keys], pa.int32()),
+        pa.array([_epoch_millis(key.instant) if isinstance(key, SpaceTimeKey) else None for key in keys], pa.int64()),
+        pa.array([c.shape for c in cells], pa.list_(pa.int32())),
+        pa.array([c.dtype.name for c in cells], pa.string()),
+        pa.array([getattr(tile.cell_type, "value", tile.cell_type) for tile in tiles], pa.string()),
+        pa.array([tile.no_data_value for tile in tiles], pa.float64()),
+        pa.Array.from_buffers(pa.binary(), len(cells), [None, pa.py_buffer(offsets), pa.py_buffer(data)]),
+    ], schema=SCHEMA)
+
+
+def batch_tiles(batch: pa.RecordBatch) -> Iterator[Tuple[Union[SpatialKey, SpaceTimeKey], Tile]]:
+    """(key, Tile) items of a record batch, with writable cells (copied once out of the Arrow buffer)."""
+    columns = dict(zip(batch.schema.names, batch.columns))
+    cells = columns["cells"]
+    _, offsets, data = cells.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int32, count=len(cells) + 1, offset=cells.offset * 4)
+    data = np.frombuffer(data, dtype=np.uint8)
+
+    rows = zip(*(columns[name].to_pylist() for name in ["col", "row", "instant", "shape", "dtype", "cell_type",
+                                                          "no_data_value"]))
+    for i, (col, row, instant, shape, dtype, cell_type, no_data_value) in enumerate(rows):
+        values = data[offsets[i]:offsets[i + 1]].view(np.dtype(dtype).newbyteorder("<")).reshape(shape).copy()
+        key = SpatialKey(col, row) if instant is None else SpaceTimeKey(col, row, _from_epoch_millis(instant))
+        yield key, Tile(values, cell_type, no_data_value)
+
+
+def _epoch_millis(instant: datetime) -> int:
+    if instant.tzinfo is None:
+        instant = instant.replace(tzinfo=timezone.utc)
+    return int(round(instant.timestamp() * 1000))
+
+
+def _from_epoch_millis(millis: int) -> datetime:
+    # naive UTC, like the geopyspark decoding of a SpaceTimeKey
+    return datetime.utcfromtimestamp(millis / 1000)
@@ -27,6 +27,7 @@ from py4j.java_gateway import JavaGateway
 from py4j.protocol import Py4JJavaError
 
 from openeogeotrellis.GeotrellisImageCollection import GeotrellisTimeSeriesImageCollection
+from openeogeotrellis import geotiff_writer, json_writer, netcdf_writer
 from openeogeotrellis.configparams import ConfigParams
 from openeogeotrellis.geotrellis_tile_processgraph_visitor import GeotrellisTileProcessGraphVisitor
 from openeogeotrellis.job_registry import JobRegistry
@@ -276,6 +277,11 @@ class GeoPySparkBackendImplementation(backend.OpenEoBackendImplementation):
                     "gis_data_types": ["other","raster"],  # TODO: also "raster", "vector", "table"?
                     "parameters": {},
                 },
+                "ZARR": {
+                    "title": "Zarr",
+                    "gis_data_types": ["raster"],
+                    "parameters": {},
+                },
                 "JSON": {
                     "gis_data_types": ["raster"],
                     "parameters": {},
@@ -500,9 +506,30 @@ class GpsBatchJobs(backend.BatchJobs):
         job_info = self.get_job_info(job_id=job_id, user_id=user_id)
         if job_info.status != 'finished':
             raise JobNotFinishedException
-        return {
-            "out": str(self._get_job_output_dir(job_id=job_id))
-        }
+        return self._job_result_files(self._get_job_output_dir(job_id=job_id))
+
+    @staticmethod
+    def _job_result_files(job_dir: Path) -> Dict[str, str]:
+        """Result file names (relative to the job directory) mapped to the job directory."""
+        output = job_dir / "out"
+        if output.is_dir():
+            # a Zarr store: a directory of metadata and chunk files
+            results = {"{o}/{f}".format(o=output.name, f=file.relative_to(output).as_posix()): str(job_dir)
+                       for file in sorted(output.rglob("*")) if file.is_file()}
+        else:
+            results = {"out": str(job_dir)}
+        # the data of a JSON output with the "npy" data encoding is referred to by "out"
+        npy = json_writer.npy_filename(output)
+        if npy.is_file():
+            results[npy.name] = str(job_dir)
+        # the GeoTIFFs per date are referred to by the "out" index
+        results.update({tif.name: str(job_dir) for tif in geotiff_writer.date_files(output)})
+        # the part files of a distributed NetCDF output are referred to by "out": they have to be downloaded with it
+        parts = netcdf_writer.parts_directory(output)
+        if parts.is_dir():
+            results.update({"{d}/{f}".format(d=parts.name, f=part.name): str(job_dir)
+                            for part in sorted(parts.iterdir())})
+        return results
 
     def get_results_metadata(self, job_id: str, user_id: str) -> dict:
         metadata_file = self._get_job_output_dir(job_id) / "metadata"
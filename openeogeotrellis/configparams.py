@@ -14,3 +14,6 @@ class ConfigParams:
 
         # TODO: can we avoid using env variables?
         self.layer_catalog_metadata_files = env.get("OPENEO_CATALOG_FILES", "layercatalog.json").split(",")
+
+        # "python" (openeogeotrellis.zonal_statistics) or "geotrellis" (ComputeStatsGeotrellisAdapter, as a fallback)
+        self.zonal_statistics_engine = env.get("OPENEO_ZONAL_STATISTICS_ENGINE", "python")
@@ -16,7 +16,9 @@ from openeo_driver.save_result import ImageCollectionResult, JSONResult, Multipl
 from pyspark import SparkContext
 
 from openeogeotrellis.deploy import load_custom_processes
+from openeogeotrellis.evaluation_cache import reuse_results
 from openeogeotrellis.utils import kerberos, describe_path
+from openeogeotrellis.zonal_statistics import ZonalStatisticsResult
 
 LOG_FORMAT = '%(asctime)s:P%(process)s:%(levelname)s:%(name)s:%(message)s'
 
@@ -138,7 +140,7 @@ def main(argv: List[str]) -> None:
 
         load_custom_processes(logger)
 
-        with SparkContext.getOrCreate():
+        with SparkContext.getOrCreate(), reuse_results():
             kerberos()
             result = ProcessGraphDeserializer.evaluate(process_graph, viewing_parameters)
             logger.info("Evaluated process graph result of type {t}: {r!r}".format(t=type(result), r=result))
@@ -159,6 +161,10 @@ def main(argv: List[str]) -> None:
                 result.imagecollection.download(output_file, bbox="", time="", format=result.format, **result.options)
                 _add_permissions(output_file, stat.S_IWGRP)
                 logger.info("wrote image collection to %s" % output_file)
+            elif isinstance(result, ZonalStatisticsResult) and result.is_csv():
+                result.write_csv(output_file)
+                _add_permissions(output_file, stat.S_IWGRP)
+                logger.info("wrote CSV result to %s" % output_file)
             elif isinstance(result, JSONResult):
                 with open(output_file, 'w') as f:
                     json.dump(result.prepare_for_json(), f)
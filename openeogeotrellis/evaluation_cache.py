@@ -0,0 +1,124 @@
+"""
+Reuse of evaluated nodes of a process graph.
+
+A process graph often refers to the same node more than once, e.g. the same filtered load_collection for an NDVI
+and for merging the NDVI back into its source cube. Process graphs are evaluated node by node by
+`openeo_driver.ProcessGraphDeserializer.convert_node`, which evaluates such a node again for every reference to it.
+Within `reuse_results`, every node is evaluated only once per set of viewing parameters that it is evaluated with.
+
+Nodes are identified by a key that is computed once per node, bottom-up: from its node id, its process and its own
+arguments, with the keys of the nodes that it refers to instead of these nodes (see `_Evaluation.node_key`).
+
+Every consumer of a node gets its own GeotrellisTimeSeriesImageCollection (see `_Result`), as consumers can change
+the collection that they get in place (e.g. its metadata), but they all build on the same layers. Once a node has a
+second consumer, the highest zoom level of its collection is persisted: the sinks of a batch job only need that
+level. Other levels are not persisted, so they are computed again for every consumer that needs them. The persisted
+layers are unpersisted when leaving `reuse_results`, so the results of the evaluation have to be written within it.
+"""
+import contextlib
+import hashlib
+import json
+import logging
+from typing import Dict, List, Tuple
+
+from geopyspark import TiledRasterLayer
+from pyspark import StorageLevel
+
+from openeogeotrellis.GeotrellisImageCollection import GeotrellisTimeSeriesImageCollection
+
+logger = logging.getLogger(__name__)
+
+
+class _Result:
+    """An evaluated node and its consumers."""
+
+    def __init__(self, collection: GeotrellisTimeSeriesImageCollection):
+        self.collection = collection
+        self.consumers = 0
+        self.persisted = []  # type: List[TiledRasterLayer]
+
+    def consumer(self) -> GeotrellisTimeSeriesImageCollection:
+        """A new collection for a consumer of this node, with the (cached) levels of the evaluated one."""
+        self.consumers += 1
+        if self.consumers == 2:
+            layer = self.collection._max_level()
+            layer.persist(StorageLevel.MEMORY_AND_DISK)
+            self.persisted.append(layer)
+        return self.collection._with_metadata(self.collection.metadata)
+
+
+class _Evaluation:
+    """The evaluated nodes of a process graph evaluation."""
+
+    def __init__(self):
+        self.results = {}  # type: Dict[Tuple[str, str], _Result]
+        # keys of the (dereferenced) nodes by their `id`; the nodes are kept, so that their ids are not reused
+        self._keys = {}  # type: Dict[int, str]
+        self._nodes = []  # type: List[dict]
+
+    def node_key(self, node: dict, node_id: str = None) -> str:
+        """
+        Key of a dereferenced process graph node, computed on its first use (for the nodes that it refers to too).
+
+        The nodes that it refers to have the key of their first use, which is with their node id as the nodes
+        are evaluated from the result node on.
+        """
+        key = self._keys.get(id(node))
+        if key is None:
+            arguments = self._with_node_keys(node.get("arguments", {}))
+            # geometries and dates have a stable string representation, other objects (their address) never match
+            content = json.dumps([node_id, node.get("process_id"), arguments], sort_keys=True, default=str)
+            key = self._keys[id(node)] = hashlib.sha1(content.encode()).hexdigest()
+            self._nodes.append(node)
+        return key
+
+    def _with_node_keys(self, value):
+        """An argument value with the keys of the nodes that it refers to instead of these nodes."""
+        if isinstance(value, dict):
+            if "from_node" in value and "node" in value:
+                return {"from_node": self.node_key(value["node"], value["from_node"])}
+            return {k: self._with_node_keys(v) for k, v in value.items()}
+        if isinstance(value, list):
+            return [self._with_node_keys(v) for v in value]
+        return value
+
+    def unpersist(self):
+        for result in self.results.values():
+            for layer in result.persisted:
+                layer.unpersist()
+
+
+@contextlib.contextmanager
+def reuse_results():
+    """
+    Evaluate every process graph node only once within this context (see the module documentation), and unpersist
+    the layers that were persisted for nodes with more than one consumer when leaving it.
+    """
+    from openeo_driver import ProcessGraphDeserializer
+
+    convert_node = ProcessGraphDeserializer.convert_node
+    evaluation = _Evaluation()
+
+    def reusing_convert_node(process_graph, viewing_parameters=None):
+        if not (isinstance(process_graph, dict) and "process_id" in process_graph):
+            return convert_node(process_graph, viewing_parameters)
+
+        key = (evaluation.node_key(process_graph), json.dumps(viewing_parameters, sort_keys=True, default=str))
+        result = evaluation.results.get(key)
+        if result is None:
+            collection = convert_node(process_graph, viewing_parameters)
+            if not isinstance(collection, GeotrellisTimeSeriesImageCollection):
+                return collection
+            result = evaluation.results[key] = _Result(collection)
+        elif result.consumers == 1:
+            logger.info("Reusing the evaluated {p!r} process with viewingParameters {v}".format(
+                p=process_graph["process_id"], v=viewing_parameters))
+        return result.consumer()
+
+    # convert_node refers to itself through the module, so the nodes that it evaluates go through the wrapper too
+    ProcessGraphDeserializer.convert_node = reusing_convert_node
+    try:
+        yield
+    finally:
+        ProcessGraphDeserializer.convert_node = convert_node
+        evaluation.unpersist()
@@ -0,0 +1,270 @@
+"""
+Parallel tiled GeoTIFF writer: the executors compress the tiles of a spatial layer, the driver writes the TIFF header
+and image file directory (IFD) with the offsets of all tiles, and the executors then write their compressed tiles
+directly at those offsets in the output file.
+
+The result is a (Big)TIFF with a TIFF tile per GeoTrellis tile (deflate, pixel interleaved) and the IFD in front of
+the tile data, i.e. a Cloud Optimized GeoTIFF without overviews. Missing tiles are left sparse (offset and byte
+count 0), GDAL reads them as no data.
+
+Only layers in a CRS with an EPSG code and with tile sizes that are a multiple of 16 (required by TIFF) are
+supported, see `is_supported`.
+
+For spacetime layers, `write_geotiffs_per_date` writes a GeoTIFF per date on the executors, with a STAC-like index.
+"""
+import glob
+import json
+import logging
+import os
+import pathlib
+import struct
+import zlib
+from datetime import datetime
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from geopyspark import TiledRasterLayer
+from pyspark import StorageLevel
+
+from openeogeotrellis import projections
+
+logger = logging.getLogger("openeo")
+
+# TIFF field types
+_ASCII, _SHORT, _LONG, _DOUBLE, _LONG8 = 2, 3, 4, 12, 16
+_TYPE_FORMATS = {_ASCII: 's', _SHORT: 'H', _LONG: 'I', _DOUBLE: 'd', _LONG8: 'Q'}
+_TYPE_SIZES = {_ASCII: 1, _SHORT: 2, _LONG: 4, _DOUBLE: 8, _LONG8: 8}
+
+# TIFF tags
+IMAGE_WIDTH, IMAGE_LENGTH, BITS_PER_SAMPLE, COMPRESSION, PHOTOMETRIC = 256, 257, 258, 259, 262
+SAMPLES_PER_PIXEL, PLANAR_CONFIGURATION, TILE_WIDTH, TILE_LENGTH, TILE_OFFSETS, TILE_BYTE_COUNTS = \
+    277, 284, 322, 323, 324, 325
+EXTRA_SAMPLES, SAMPLE_FORMAT = 338, 339
+MODEL_PIXEL_SCALE, MODEL_TIEPOINT, GEO_KEY_DIRECTORY, GDAL_NODATA = 33550, 33922, 34735, 42113
+
+COMPRESSION_DEFLATE = 8
+SAMPLE_FORMATS = {'u': 1, 'i': 2, 'f': 3}
+
+STAC_VERSION = "0.9.0"
+
+
+def _epsg(crs: str) -> Union[int, None]:
+    import pyproj
+    try:
+        return pyproj.CRS(crs).to_epsg()
+    except pyproj.exceptions.CRSError:
+        return None
+
+
+def is_supported(layer: TiledRasterLayer) -> bool:
+    tile_layout = layer.layer_metadata.layout_definition.tileLayout
+    return tile_layout.tileCols % 16 == 0 and tile_layout.tileRows % 16 == 0 \
+           and _epsg(layer.layer_metadata.crs) is not None
+
+
+def compress_tile(zlevel: int, item) -> Tuple[Tuple[int, int], bytes, str, int]:
+    """Deflate a (bands, rows, cols) tile, pixel interleaved: returns ((col, row), data, dtype, band count)."""
+    key, tile = item
+    cells = tile.cells
+    if cells.ndim == 2:
+        cells = cells[np.newaxis]
+    if cells.dtype == np.bool_:
+        cells = cells.astype(np.uint8)
+    interleaved = np.ascontiguousarray(cells.transpose(1, 2, 0), dtype=cells.dtype.newbyteorder('<'))
+    return (key.col, key.row), zlib.compress(interleaved.data, zlevel), cells.dtype.str, cells.shape[0]
+
+
+def _geo_keys(epsg: int, geographic: bool) -> List[int]:
+    keys = [
+        (1024, 0, 1, 2 if geographic else 1),  # GTModelType: geographic or projected
+        (1025, 0, 1, 1),  # GTRasterType: PixelIsArea
+        (2048 if geographic else 3072, 0, 1, epsg),  # GeographicType or ProjectedCSType
+    ]
+    return [1, 1, 0, len(keys)] + [v for key in keys for v in key]
+
+
+def _header_and_ifd(entries: Dict[int, Tuple[int, list]]) -> Tuple[bytes, int]:
+    """BigTIFF header and single IFD, with the out-of-line values right after it: returns bytes and data offset."""
+    ifd_offset = 16
+    data_offset = ifd_offset + 8 + 20 * len(entries) + 8
+    ifd = struct.pack('<Q', len(entries))
+    values = b''
+    for tag in sorted(entries):
+        field_type, value = entries[tag]
+        if field_type == _ASCII:
+            packed = value.encode('ascii') + b'\0'
+        else:
+            packed = struct.pack('<%d%s' % (len(value), _TYPE_FORMATS[field_type]), *value)
+        count = len(packed) // _TYPE_SIZES[field_type]
+        if len(packed) <= 8:
+            ifd += struct.pack('<HHQ', tag, field_type, count) + packed.ljust(8, b'\0')
+        else:
+            ifd += struct.pack('<HHQQ', tag, field_type, count, data_offset + len(values))
+            values += packed
+            values += b'\0' * (-len(values) % 8)
+    ifd += struct.pack('<Q', 0)
+    header = b'II' + struct.pack('<HHHQ', 43, 8, 0, ifd_offset)
+    data = header + ifd + values
+    return data, len(data)
+
+
+def write_geotiff(layer: TiledRasterLayer, path: Union[str, pathlib.Path], zlevel: int = 6) -> str:
+    """Write a spatial layer as a single tiled GeoTIFF, see the module documentation."""
+    path = pathlib.Path(path)
+    metadata = layer.layer_metadata
+    layout = metadata.layout_definition
+    tile_cols, tile_rows = layout.tileLayout.tileCols, layout.tileLayout.tileRows
+    xres = (layout.extent.xmax - layout.extent.xmin) / (layout.tileLayout.layoutCols * tile_cols)
+    yres = (layout.extent.ymax - layout.extent.ymin) / (layout.tileLayout.layoutRows * tile_rows)
+    min_col, max_col = metadata.bounds.minKey.col, metadata.bounds.maxKey.col
+    min_row, max_row = metadata.bounds.minKey.row, metadata.bounds.maxKey.row
+    tiles_across, tiles_down = max_col - min_col + 1, max_row - min_row + 1
+
+    from functools import partial
+    compressed = layer.to_numpy_rdd().map(partial(compress_tile, zlevel)).persist(StorageLevel.MEMORY_AND_DISK)
+    try:
+        sizes = compressed.map(lambda t: (t[0], len(t[1]), t[2], t[3])).collect()
+        if not sizes:
+            raise ValueError("Can not write an empty layer to {p}".format(p=path))
+        dtype, band_count = np.dtype(sizes[0][2]), sizes[0][3]
+
+        import pyproj
+        crs = pyproj.CRS(metadata.crs)
+        tile_count = tiles_across * tiles_down
+        entries = {
+            IMAGE_WIDTH: (_LONG, [tiles_across * tile_cols]),
+            IMAGE_LENGTH: (_LONG, [tiles_down * tile_rows]),
+            BITS_PER_SAMPLE: (_SHORT, [dtype.itemsize * 8] * band_count),
+            COMPRESSION: (_SHORT, [COMPRESSION_DEFLATE]),
+            PHOTOMETRIC: (_SHORT, [1]),  # min-is-black
+            SAMPLES_PER_PIXEL: (_SHORT, [band_count]),
+            PLANAR_CONFIGURATION: (_SHORT, [1]),  # pixel interleaved
+            TILE_WIDTH: (_SHORT, [tile_cols]),
+            TILE_LENGTH: (_SHORT, [tile_rows]),
+            TILE_OFFSETS: (_LONG8, [0] * tile_count),
+            TILE_BYTE_COUNTS: (_LONG8, [0] * tile_count),
+            SAMPLE_FORMAT: (_SHORT, [SAMPLE_FORMATS[dtype.kind]] * band_count),
+            MODEL_PIXEL_SCALE: (_DOUBLE, [xres, yres, 0.0]),
+            MODEL_TIEPOINT: (_DOUBLE, [0.0, 0.0, 0.0, layout.extent.xmin + min_col * tile_cols * xres,
+                                       layout.extent.ymax - min_row * tile_rows * yres, 0.0]),
+            GEO_KEY_DIRECTORY: (_SHORT, _geo_keys(crs.to_epsg(), crs.is_geographic)),
+        }
+        if band_count > 1:
+            entries[EXTRA_SAMPLES] = (_SHORT, [0] * (band_count - 1))
+        if metadata.no_data_value is not None:
+            entries[GDAL_NODATA] = (_ASCII, str(metadata.no_data_value))
+
+        # the size of the header does not depend on the offsets, so they can be filled in afterwards
+        _, offset = _header_and_ifd(entries)
+        offsets, byte_counts = [0] * tile_count, [0] * tile_count
+        tile_offsets = {}
+        for (col, row), size, _, _ in sorted(sizes, key=lambda s: (s[0][1], s[0][0])):
+            index = (row - min_row) * tiles_across + (col - min_col)
+            offsets[index], byte_counts[index] = offset, size
+            tile_offsets[(col, row)] = offset
+            offset += size
+        entries[TILE_OFFSETS] = (_LONG8, offsets)
+        entries[TILE_BYTE_COUNTS] = (_LONG8, byte_counts)
+        header, _ = _header_and_ifd(entries)
+
+        with path.open('wb') as f:
+            f.write(header)
+            f.truncate(offset)
+        logger.info("Wrote GeoTIFF header of {p}: {n} tile(s), {s} bytes".format(p=path, n=len(sizes), s=offset))
+
+        def write_partition(tiles):
+            fd = os.open(str(path), os.O_WRONLY)
+            try:
+                for key, data, _, _ in tiles:
+                    os.pwrite(fd, data, tile_offsets[key])
+            finally:
+                os.close(fd)
+
+        compressed.foreachPartition(write_partition)
+    finally:
+        compressed.unpersist()
+
+    return str(path)
+
+
+def date_filename(path: pathlib.Path, date: datetime) -> str:
+    return "{s}_{d}.tif".format(s=path.stem, d=date.strftime("%Y%m%dT%H%M%SZ"))
+
+
+def date_files(path: Union[str, pathlib.Path]) -> List[pathlib.Path]:
+    """The GeoTIFFs that `write_geotiffs_per_date` wrote next to `path`."""
+    path = pathlib.Path(path)
+    date_pattern = "[0-9]" * 8 + "T" + "[0-9]" * 6 + "Z"  # see date_filename
+    return sorted(path.parent.glob("{s}_{d}.tif".format(s=glob.escape(path.stem), d=date_pattern)))
+
+
+def write_date(path: pathlib.Path, georeference: Dict, zlevel: int, item: Tuple[datetime, np.ndarray]) -> Dict:
+    """Write the (bands, x, y) window of a date as a tiled GeoTIFF next to `path`: returns the item of the index."""
+    import rasterio
+
+    date, window = item
+    # (bands, x, y) with y counted from the bottom => (bands, rows, cols) north-up
+    cells = np.ascontiguousarray(window.reshape((-1,) + window.shape[-2:]).transpose(0, 2, 1)[:, ::-1, :])
+    band_names = georeference["band_names"]
+    if len(band_names) != cells.shape[0]:
+        band_names = ['band_' + str(i) for i in range(cells.shape[0])]
+
+    filename = date_filename(path, date)
+    with rasterio.open(str(path.parent / filename), 'w', driver='GTiff', count=cells.shape[0], width=cells.shape[2],
+                       height=cells.shape[1], transform=georeference["transform"], crs=georeference["crs"],
+                       nodata=georeference["nodata"], dtype=cells.dtype, compress='deflate', zlevel=zlevel,
+                       tiled=True) as dst:
+        dst.write(cells)
+        for i, band_name in enumerate(band_names):
+            dst.set_band_description(i + 1, band_name)
+
+    return {
+        "type": "Feature",
+        "stac_version": STAC_VERSION,
+        "id": filename[:-len(".tif")],
+        "bbox": georeference["bbox"],
+        "geometry": georeference["geometry"],
+        "properties": {"datetime": date.strftime("%Y-%m-%dT%H:%M:%SZ"), "proj:epsg": georeference["epsg"]},
+        "assets": {
+            "image": {"href": filename, "type": "image/tiff; application=geotiff", "roles": ["data"],
+                      "eo:bands": [{"name": name} for name in band_names]}
+        },
+    }
+
+
+def write_geotiffs_per_date(windows_rdd, path: Union[str, pathlib.Path], x: np.ndarray, y: np.ndarray, crs: str,
+                            nodata, band_names: List[str], zlevel: int = 6) -> str:
+    """
+    Write an RDD of (date, (bands, x, y) window) tuples as a GeoTIFF per date, on the executors.
+
+    The GeoTIFFs are named "<stem of path>_<date>.tif" and written next to `path`, which becomes a (STAC-like)
+    GeoJSON FeatureCollection with an item per date.
+
+    :param x: pixel center coordinates along x
+    :param y: pixel center coordinates along y (ascending)
+    """
+    from affine import Affine
+
+    path = pathlib.Path(path)
+    xres, yres = (x[1] - x[0]) if len(x) > 1 else 1.0, (y[1] - y[0]) if len(y) > 1 else 1.0
+    xmin, xmax, ymin, ymax = x[0] - xres / 2, x[-1] + xres / 2, y[0] - yres / 2, y[-1] + yres / 2
+
+    lons, lats = projections.transform(crs, "EPSG:4326", [xmin, xmax, xmax, xmin], [ymin, ymin, ymax, ymax])
+    georeference = {
+        "transform": Affine(xres, 0.0, xmin, 0.0, -yres, ymax),
+        "crs": crs,
+        "nodata": nodata,
+        "band_names": list(band_names),
+        "epsg": _epsg(crs),
+        "bbox": [min(lons), min(lats), max(lons), max(lats)],
+        "geometry": {"type": "Polygon", "coordinates": [[list(c) for c in zip(lons + lons[:1], lats + lats[:1])]]},
+    }
+
+    from functools import partial
+    items = windows_rdd.map(partial(write_date, path, georeference, zlevel)).collect()
+    items.sort(key=lambda item: item["properties"]["datetime"])
+
+    with path.open('w') as f:
+        json.dump({"type": "FeatureCollection", "stac_version": STAC_VERSION, "features": items}, f, indent=2)
+    logger.info("Wrote {n} GeoTIFF(s) and index {p}".format(n=len(items), p=path))
+    return str(path)
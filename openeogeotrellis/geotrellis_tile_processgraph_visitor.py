@@ -1,5 +1,7 @@
+import copy
 import numbers
 from collections import OrderedDict
+from typing import List, Union
 
 from openeo.internal.process_graph_visitor import ProcessGraphVisitor
 
@@ -13,6 +15,13 @@ class GeotrellisTileProcessGraphVisitor(ProcessGraphVisitor):
         self.builder = jvm.org.openeo.geotrellis.OpenEOProcessScriptBuilder()
         #process list to keep track of processes, so this class has a double function
         self.processes = OrderedDict()
+        # the (flat) process graph that was visited, see `fuse_process_graphs`
+        self.process_graph = None
+
+    def accept_process_graph(self, graph: dict) -> 'GeotrellisTileProcessGraphVisitor':
+        # keep a copy: visiting resolves the "from_node" references in place
+        self.process_graph = copy.deepcopy(graph)
+        return super().accept_process_graph(graph)
 
     def enterProcess(self, process_id: str, arguments: dict):
         self.builder.expressionStart(process_id, arguments)
@@ -49,3 +58,57 @@ class GeotrellisTileProcessGraphVisitor(ProcessGraphVisitor):
 
     def leaveArray(self, argument_id: str):
         self.builder.arrayEnd()
+
+
+# parameters through which a per-pixel process graph gets its input bands
+_DATA_PARAMETERS = {"data", "x", "dimension_data"}
+
+
+def fuse_process_graphs(graphs: List[dict]) -> Union[dict, None]:
+    """
+    Single (flat) process graph that applies the given per-pixel process graphs one after the other: references to
+    the data parameter of a graph (its input bands) are replaced by references to the result of the previous graph.
+
+    :return: the fused process graph, None if a graph has a nested callback, as its parameters can't be told apart,
+        or refers to another parameter (e.g. "context"), as that would refer to the parameter of the fused graph
+    """
+    fused = {}
+    previous_result = None
+    for i, graph in enumerate(graphs):
+        prefix = "{i}_".format(i=i)
+
+        def rewrite(value):
+            if isinstance(value, dict):
+                if "from_node" in value:
+                    return {"from_node": prefix + value["from_node"]}
+                if _parameter(value) is not None and previous_result is not None:
+                    return {"from_node": previous_result}
+            return value
+
+        result = None
+        for node_id, node in graph.items():
+            arguments = {}
+            for name, value in node.get("arguments", {}).items():
+                if isinstance(value, dict) and ("process_graph" in value or "callback" in value):
+                    return None
+                values = value if isinstance(value, list) else [value]
+                if any(_parameter(v) not in _DATA_PARAMETERS for v in values if _parameter(v) is not None):
+                    return None
+                arguments[name] = [rewrite(v) for v in value] if isinstance(value, list) else rewrite(value)
+            fused[prefix + node_id] = dict(node, arguments=arguments)
+            if node.get("result", False):
+                result = prefix + node_id
+                fused[result].pop("result")
+        if result is None:
+            raise ValueError("The provided process graph does not contain a result node.")
+        previous_result = result
+
+    fused[previous_result]["result"] = True
+    return fused
+
+
+def _parameter(value) -> Union[str, None]:
+    """Name of the parameter that an argument value refers to, if any."""
+    if isinstance(value, dict):
+        return value.get("from_parameter", value.get("from_argument"))
+    return None
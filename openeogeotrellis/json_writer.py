@@ -0,0 +1,156 @@
+"""
+Streaming JSON output of a raster layer, in the structure of `xarray.DataArray.to_dict()` (with extra "dtype" and
+"shape" attributes to re-create the array), written one date window and band at a time so memory usage does not
+depend on the number of dates.
+
+The data can be encoded as:
+- "list": nested lists of numbers, like `to_dict()`
+- "base64": base64 of the raw (C order) array bytes, a string per date (or a single string without time dimension)
+- "npy": the data goes to a separate "<filename>.npy" file, "data" is the name of that file
+"""
+import base64
+import json
+import pathlib
+from typing import Dict, Iterable, List, Tuple, Union
+
+import numpy as np
+
+DATA_ENCODINGS = ["list", "base64", "npy"]
+
+
+def write_json(filename: Union[str, pathlib.Path], windows: Iterable[Tuple[object, np.ndarray]], dims: List[str],
+               coords: Dict[str, Union[list, np.ndarray]], attrs: Dict, data_encoding: str = "list") -> str:
+    """
+    :param windows: (date or None, (bands, x, y) window) tuples, sorted by date
+    :param dims: dimension names, a subset of ('t', 'bands', 'x', 'y')
+    :param coords: coordinates of the dimensions, except time: these are the dates of the windows
+    """
+    if data_encoding not in DATA_ENCODINGS:
+        raise ValueError("Unsupported data encoding {e!r}, should be one of {s!r}".format(e=data_encoding, s=DATA_ENCODINGS))
+
+    filename = pathlib.Path(filename)
+    has_time = 't' in dims
+    has_bands = 'bands' in dims
+    coords = dict(coords)
+    dates = []
+    dtype = None
+    window_shape = None
+    npy = None
+
+    with filename.open('w') as f:
+        f.write('{\n')
+        f.write('  "dims":' + json.dumps(dims, separators=(',', ':')) + ',\n')
+        f.write('  "data":')
+        in_file = data_encoding == "npy"
+        if has_time and not in_file:
+            f.write('[')
+
+        for date, window in windows:
+            if not has_bands:
+                window = window.reshape(window.shape[-2:])
+            if dtype is None:
+                dtype, window_shape = window.dtype, window.shape
+            elif window.shape != window_shape:
+                raise ValueError("Window at {d} has shape {s}, expected {e}".format(d=date, s=window.shape, e=window_shape))
+            if dates and not in_file:
+                f.write(',')
+            dates.append(date)
+
+            if in_file:
+                if npy is None:
+                    npy = _NpyWriter(npy_filename(filename), window.dtype, window.shape)
+                npy.write(window)
+            elif data_encoding == "base64":
+                f.write('"' + base64.b64encode(np.ascontiguousarray(window).data).decode('ascii') + '"')
+            else:
+                _write_list(f, window)
+
+            if not has_time:
+                break
+
+        if in_file:
+            if npy is not None:
+                npy.close(len(dates) if has_time else None)
+            f.write(json.dumps(npy_filename(filename).name if npy is not None else None))
+        elif has_time:
+            f.write(']')
+        elif not dates:
+            f.write('[]')
+        f.write(',\n')
+
+        if has_bands and window_shape is not None and len(coords['bands']) != window_shape[0]:
+            # TODO: this is a workaround if metadata goes out of sync, fix upstream process nodes to update metdata
+            coords['bands'] = ['band_' + str(i) for i in range(window_shape[0])]
+        if has_time:
+            coords['t'] = dates
+
+        if window_shape is not None:
+            shape = ([len(dates)] if has_time else []) + list(window_shape)
+        else:
+            shape = [0] * len(dims)
+        attrs = dict(attrs, dtype=str(dtype if dtype is not None else np.dtype(int)), shape=shape)
+        if data_encoding != "list":
+            attrs['encoding'] = data_encoding
+        f.write('  "attrs":' + json.dumps(attrs, default=str, separators=(',', ':')) + ',\n')
+
+        f.write('  "coords":{')
+        for i, dim in enumerate(d for d in dims if d in coords):
+            if dim == 't':
+                coord_dtype, data = 'datetime64[ns]', [str(d) for d in coords[dim]]
+            else:
+                values = np.asarray(coords[dim])
+                coord_dtype, data = str(values.dtype), values.tolist()
+            coord = {"dims": [dim], "attrs": {"dtype": coord_dtype, "shape": [len(data)]}, "data": data}
+            f.write((',' if i > 0 else '') + '\n    ' + json.dumps(dim) + ':' +
+                    json.dumps(coord, default=str, separators=(',', ':')))
+        f.write('\n  },\n')
+        f.write('  "name":null\n}')
+
+    return str(filename)
+
+
+def npy_filename(filename: Union[str, pathlib.Path]) -> pathlib.Path:
+    filename = pathlib.Path(filename)
+    return filename.parent / (filename.name + ".npy")
+
+
+def _write_list(f, window: np.ndarray):
+    """Nested lists of a window, one band at a time."""
+    if window.ndim == 2:
+        json.dump(window.tolist(), f, separators=(',', ':'))
+        return
+    f.write('[')
+    for i, band in enumerate(window):
+        if i > 0:
+            f.write(',')
+        json.dump(band.tolist(), f, separators=(',', ':'))
+    f.write(']')
+
+
+class _NpyWriter:
+    """
+    Appends windows to a .npy file: the number of windows (dates) is only known at the end, so the header is
+    written with room to spare and rewritten when closing.
+    """
+
+    HEADER_SIZE = 256
+
+    def __init__(self, path: pathlib.Path, dtype: np.dtype, window_shape: Tuple[int, ...]):
+        self._dtype = dtype
+        self._window_shape = window_shape
+        self._file = path.open('wb')
+        self._file.write(b' ' * self.HEADER_SIZE)
+
+    def write(self, window: np.ndarray):
+        self._file.write(np.ascontiguousarray(window, dtype=self._dtype).data)
+
+    def close(self, count: Union[int, None]):
+        shape = ((count,) if count is not None else ()) + tuple(self._window_shape)
+        header = {'descr': np.lib.format.dtype_to_descr(self._dtype), 'fortran_order': False, 'shape': shape}
+        header_text = repr(header).encode('latin1')
+        prefix = np.lib.format.MAGIC_PREFIX + bytes([1, 0])
+        padding = self.HEADER_SIZE - len(prefix) - 2 - len(header_text) - 1
+        self._file.seek(0)
+        self._file.write(prefix + (self.HEADER_SIZE - len(prefix) - 2).to_bytes(2, 'little') +
+                         header_text + b' ' * padding + b'\n')
+        self._file.close()
@@ -0,0 +1,182 @@
+"""
+Neighbourhood operations on the tiles of a layer, without retiling it.
+
+Windows are laid out on the pixel grid of the layer, starting at its first tile, independently of the tile size:
+a window can cover part of a tile, or span several tiles. Every tile is extended with a halo that is wide enough for
+all windows that intersect it, including their overlap (see `halo_size`): the parts of its neighbours (as many tiles
+away as the halo reaches) that fall within the halo. The tiles are partitioned by key, and these parts are shuffled to
+the partition of the tile that needs them with the same partitioner. A function is then applied to every window that
+intersects a tile, and only the part of the core of the window (the window without its overlap) that falls within
+the tile is kept, so the result has the layout of the input layer again. A window that spans k tiles is therefore
+evaluated k times, once for each of these tiles.
+
+Pixel indices are (row, col), rows counted from the top of a tile, as in the cells of a Tile.
+"""
+import functools
+import math
+from collections import defaultdict
+from typing import Callable, Iterable, List, Tuple
+
+import numpy as np
+from geopyspark import Tile
+from pyspark import RDD
+from pyspark.rdd import portable_hash
+
+
+def halo_size(size: int, overlap: int, tile_size: int) -> int:
+    """
+    Number of pixels a tile has to be extended with on each side to contain every window of `size` pixels that
+    intersects it, including `overlap` pixels on each side of the window.
+
+    Relative to the windows, the tiles start at multiples of the greatest common divisor of the window and tile size,
+    so a window sticks out of a tile by at most `size - gcd(size, tile_size)` pixels: no more than the overlap if the
+    tile size is a multiple of the window size.
+    """
+    return overlap + size - math.gcd(size, tile_size)
+
+
+def border_strips(halo_x: int, halo_y: int, item: Tuple[object, Tile]) -> Iterable[Tuple[object, tuple]]:
+    """
+    Parts of a tile that its neighbours need for a halo of `halo_x` columns and `halo_y` rows.
+
+    :return: (key of the neighbour, (row, col, cells)) pairs, with the position of the cells in the extended tile of
+        the neighbour (see `with_halo`)
+    """
+    key, tile = item
+    cells = tile.cells
+    rows, cols = cells.shape[-2:]
+    reach_x = -(-halo_x // cols)
+    reach_y = -(-halo_y // rows)
+
+    for drow in range(-reach_y, reach_y + 1):
+        # rows of this tile in the extended tile of the neighbour `drow` tiles further
+        row_start, row_end = max(0, drow * rows - halo_y), min(rows, (drow + 1) * rows + halo_y)
+        for dcol in range(-reach_x, reach_x + 1):
+            col_start, col_end = max(0, dcol * cols - halo_x), min(cols, (dcol + 1) * cols + halo_x)
+            if (drow == 0 and dcol == 0) or row_start >= row_end or col_start >= col_end:
+                continue
+            strip = cells[..., row_start:row_end, col_start:col_end]
+            yield key._replace(col=key.col + dcol, row=key.row + drow), \
+                (row_start - drow * rows + halo_y, col_start - dcol * cols + halo_x, strip)
+
+
+def with_halo(halo_x: int, halo_y: int, tile: Tile, strips: Iterable[tuple]) -> Tile:
+    """
+    Tile extended with `halo_y` rows and `halo_x` columns on every side, taken from the border strips of its
+    neighbours (see `border_strips`); no data where there is no neighbour.
+    """
+    cells = tile.cells
+    rows, cols = cells.shape[-2:]
+    halo = np.full(cells.shape[:-2] + (rows + 2 * halo_y, cols + 2 * halo_x),
+                   _fill_value(cells.dtype, tile.no_data_value), dtype=cells.dtype)
+
+    halo[..., halo_y:halo_y + rows, halo_x:halo_x + cols] = cells
+    for row, col, strip in strips:
+        halo[..., row:row + strip.shape[-2], col:col + strip.shape[-1]] = strip
+    return Tile(halo, tile.cell_type, tile.no_data_value)
+
+
+def halo_exchange(tiles: RDD, halo_x: int, halo_y: int) -> RDD:
+    """
+    Extend every tile of a (key, Tile) RDD with the halo of its neighbours (see `with_halo`).
+
+    The tiles are partitioned by key, and the strips with the same partitioner, so that the strips for a tile end up
+    in the partition of that tile: a partition of the union of both is the partition of the strips followed by the
+    one of the tiles, so only the strips of a partition are kept in memory while its tiles are streamed. Strips for
+    keys without a tile (e.g. beyond the edges of the layer) are dropped before they are shuffled.
+    """
+    if halo_x == 0 and halo_y == 0:
+        return tiles
+
+    partition_count = tiles.getNumPartitions()
+    # the keys, the strips and the tiles are all read from the output of this shuffle: the tiles are computed once,
+    # without persisting them
+    tiles = tiles.partitionBy(partition_count, portable_hash)
+    # (pyspark broadcasts the closure of the filter if these keys are large)
+    keys = frozenset(tiles.keys().collect())
+    strips = tiles \
+        .flatMap(functools.partial(border_strips, halo_x, halo_y)) \
+        .filter(lambda strip: strip[0] in keys) \
+        .partitionBy(partition_count, portable_hash)
+
+    def extend_partition(items):
+        strips_by_key = defaultdict(list)
+        for key, value in items:
+            if isinstance(value, Tile):
+                yield key, with_halo(halo_x, halo_y, value, strips_by_key.pop(key, []))
+            else:
+                strips_by_key[key].append(value)
+
+    # same partitioner, so Spark unions the partitions pairwise instead of appending them (and this is no shuffle)
+    return strips.union(tiles).partitionBy(partition_count, portable_hash) \
+        .mapPartitions(extend_partition, preservesPartitioning=True)
+
+
+def apply_windows(cells: np.ndarray, function: Callable[[np.ndarray], np.ndarray],
+                  size_x: int, size_y: int, overlap_x: int, overlap_y: int, halo_x: int, halo_y: int,
+                  offset_x: int = 0, offset_y: int = 0) -> np.ndarray:
+    """
+    Apply a function to the windows that intersect a tile extended with a halo (see `with_halo` and `halo_size`).
+
+    The windows of `size_x` by `size_y` pixels are laid out on a grid that starts `offset_x` columns and `offset_y`
+    rows before the tile. The function gets every window with `overlap_x`/`overlap_y` extra pixels on each side,
+    so always (..., size_y + 2 * overlap_y, size_x + 2 * overlap_x) cells, and should return an array with the same
+    number of rows and columns; the part of its core that falls within the tile is written to the result.
+
+    :param cells: (..., rows, cols) cells, including a halo of `halo_x` columns and `halo_y` rows
+    :param offset_x: column of the tile (without its halo) on the grid of the windows
+    :param offset_y: row of the tile (without its halo) on the grid of the windows
+    :return: (..., rows, cols) cells of the tile without its halo, with the leading dimensions and dtype that the
+        function returns
+    """
+    return apply_window_batches(cells, lambda windows: [function(windows[0])], 1, size_x, size_y,
+                                overlap_x, overlap_y, halo_x, halo_y, offset_x, offset_y)
+
+
+def apply_window_batches(cells: np.ndarray, function: Callable[[List[np.ndarray]], List[np.ndarray]],
+                         batch_size: int, size_x: int, size_y: int, overlap_x: int, overlap_y: int,
+                         halo_x: int, halo_y: int, offset_x: int = 0, offset_y: int = 0) -> np.ndarray:
+    """
+    As `apply_windows`, but the function gets lists of up to `batch_size` windows (all with the same shape) at once,
+    and should return a list with the result of every window.
+    """
+    rows = cells.shape[-2] - 2 * halo_y
+    cols = cells.shape[-1] - 2 * halo_x
+    windows = []
+    for top in _window_origins(offset_y, rows, size_y):
+        for left in _window_origins(offset_x, cols, size_x):
+            row, col = halo_y + top - overlap_y, halo_x + left - overlap_x
+            window = cells[..., max(row, 0):row + size_y + 2 * overlap_y, max(col, 0):col + size_x + 2 * overlap_x]
+            if window.shape[-2:] != (size_y + 2 * overlap_y, size_x + 2 * overlap_x):
+                raise ValueError("A halo of ({x}, {y}) pixels is too small for windows of ({w}, {h}) pixels".format(
+                    x=halo_x, y=halo_y, w=size_x, h=size_y))
+            windows.append((top, left, window))
+
+    result = None
+    for batch_start in range(0, len(windows), batch_size):
+        batch = windows[batch_start:batch_start + batch_size]
+        for (top, left, window), values in zip(batch, function([window for _, _, window in batch])):
+            values = np.asarray(values)
+            if values.shape[-2:] != window.shape[-2:]:
+                raise ValueError("Expected a window of {e} pixels, but got {s}".format(
+                    e=window.shape[-2:], s=values.shape[-2:]))
+            if result is None:
+                result = np.empty(values.shape[:-2] + (rows, cols), dtype=values.dtype)
+            # the core of the window, as far as it falls within the tile
+            row_start, row_end = max(top, 0), min(top + size_y, rows)
+            col_start, col_end = max(left, 0), min(left + size_x, cols)
+            result[..., row_start:row_end, col_start:col_end] = \
+                values[..., overlap_y + row_start - top:overlap_y + row_end - top,
+                       overlap_x + col_start - left:overlap_x + col_end - left]
+    return result
+
+
+def _window_origins(offset: int, length: int, size: int) -> List[int]:
+    """Starts of the windows that intersect a tile of `length` pixels at `offset`, relative to the tile."""
+    return [start - offset for start in range(offset // size * size, offset + length, size)]
+
+
+def _fill_value(dtype: np.dtype, no_data_value):
+    if no_data_value is not None and not (np.issubdtype(dtype, np.integer) and np.isnan(no_data_value)):
+        return no_data_value
+    return np.nan if np.issubdtype(dtype, np.floating) else 0
@@ -0,0 +1,126 @@
+"""
+Distributed NetCDF output: the executors each write the stitched window of a date to their own
+NetCDF (HDF5) part file, the driver then only writes a small aggregate file that refers to the
+parts through HDF5 virtual datasets. The driver never holds raster data, so its memory usage
+does not depend on the size of the output.
+
+The aggregate file has the same layout as the one written through xarray: a variable per band,
+with dimensions (t, y, x) (or (y, x) without time dimension). It is readable with xarray
+(h5netcdf engine) and netCDF/HDF5 >= 1.10 based tools.
+
+The virtual datasets refer to the parts relative to the aggregate file: the "<filename>.parts"
+directory has to travel with it (e.g. batch job results list the part files too). Without it,
+HDF5 silently reads fill values, so readers should check that the directory named by the
+"parts_directory" attribute of the file is next to it.
+"""
+import logging
+import pathlib
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger("openeo")
+
+TIME_UNITS = "seconds since 1970-01-01 00:00:00"
+CHUNK_SIZE = 256
+
+
+def parts_directory(filename: Union[str, pathlib.Path]) -> pathlib.Path:
+    filename = pathlib.Path(filename)
+    return filename.parent / (filename.name + ".parts")
+
+
+def write_part(directory: pathlib.Path, band_names: List[str], nodata, item: Tuple[datetime, np.ndarray]) -> Dict:
+    """
+    Write the (bands, x, y) window of a date as a part file (one (y, x) variable per band).
+
+    :return: description of the part for the aggregate file
+    """
+    import h5py
+
+    date, window = item
+    if window.ndim == 2:
+        window = window[np.newaxis]
+    if len(band_names) != window.shape[0]:
+        # same workaround as in `_collect_as_xarray` for metadata that is out of sync
+        band_names = ['band_' + str(i) for i in range(window.shape[0])]
+
+    name = (date.strftime("%Y%m%dT%H%M%S") if date is not None else "part") + ".h5"
+    shape = (window.shape[2], window.shape[1])
+    chunks = tuple(min(CHUNK_SIZE, n) for n in shape)
+    with h5py.File(str(directory / name), "w") as f:
+        for band_name, band in zip(band_names, window):
+            f.create_dataset(band_name, data=band.T, chunks=chunks, compression="gzip",
+                             fillvalue=nodata if nodata is not None else 0)
+    return {"date": date, "file": name, "bands": band_names, "dtype": str(window.dtype), "shape": shape}
+
+
+def write_aggregate(filename: Union[str, pathlib.Path], parts: List[Dict], x: np.ndarray, y: np.ndarray,
+                    has_time: bool, attrs: Dict) -> str:
+    """Write the aggregate file: coordinates, metadata and a virtual dataset per band referring to the parts."""
+    import h5py
+
+    filename = pathlib.Path(filename)
+    directory = parts_directory(filename).name
+    parts = sorted(parts, key=lambda p: _epoch_seconds(p["date"])) if has_time else parts[:1]
+    nodata = attrs.get("nodata")
+
+    with h5py.File(str(filename), "w") as f:
+        f.attrs["parts_directory"] = directory
+        scales = []
+        if has_time:
+            t = f.create_dataset("t", data=np.array([_epoch_seconds(p["date"]) for p in parts], dtype=np.int64))
+            t.attrs["units"] = TIME_UNITS
+            t.attrs["calendar"] = "standard"
+            scales.append(t)
+        scales.append(f.create_dataset("y", data=y))
+        scales.append(f.create_dataset("x", data=x))
+        for scale in scales:
+            scale.make_scale(scale.name[1:])
+
+        if not parts:
+            return str(filename)
+
+        shape = parts[0]["shape"]
+        dtype = np.dtype(parts[0]["dtype"])
+        for band_name in parts[0]["bands"]:
+            layout = h5py.VirtualLayout(shape=((len(parts),) if has_time else ()) + shape, dtype=dtype)
+            for i, part in enumerate(parts):
+                source = h5py.VirtualSource(directory + "/" + part["file"], band_name, shape=shape, dtype=dtype)
+                if has_time:
+                    layout[i] = source
+                else:
+                    layout[...] = source
+            variable = f.create_virtual_dataset(band_name, layout, fillvalue=nodata if nodata is not None else 0)
+            for dim, scale in zip(variable.dims, scales):
+                dim.attach_scale(scale)
+            for key, value in attrs.items():
+                if value is not None:
+                    variable.attrs[key] = value
+
+    logger.info("Wrote NetCDF {f} referring to {n} part(s) in {d}".format(f=filename, n=len(parts), d=directory))
+    return str(filename)
+
+
+def _epoch_seconds(date: datetime) -> int:
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return int(np.datetime64(date, 's').astype(np.int64))
+
+
+def write_netcdf(windows_rdd, filename: Union[str, pathlib.Path], band_names: List[str], x: np.ndarray, y: np.ndarray,
+                 has_time: bool, attrs: Dict) -> str:
+    """
+    Write an RDD of (date, (bands, x, y) window) tuples as NetCDF, with the raster data written by the executors.
+
+    :param filename: the aggregate file; the part files are written in a "<filename>.parts" directory next to it,
+        which has to be on a file system that is shared between the driver and executors, and has to be kept next to
+        the aggregate file
+    """
+    directory = parts_directory(filename)
+    directory.mkdir(parents=True, exist_ok=True)
+
+    from functools import partial
+    parts = windows_rdd.map(partial(write_part, directory, list(band_names), attrs.get("nodata"))).collect()
+    return write_aggregate(filename, parts, x, y, has_time, attrs)
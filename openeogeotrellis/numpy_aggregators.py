@@ -1,41 +1,361 @@
+import warnings
+from abc import ABC, abstractmethod
+
 import geopyspark as gps
-from typing import Iterable
+from geopyspark.geotrellis.constants import CellType
+from typing import Iterable, Tuple
 import numpy as np
 
 
-def max_composite(tiles: Iterable[gps.Tile]):
-    return composite(np.fmax, tiles)  # ignores NaNs (<=> maximum)
+class TemporalAggregator(ABC):
+    """
+    Streaming reduction of a series of tiles (e.g. all dates of a spatial key) to a single tile.
+
+    Tiles are folded one at a time into a preallocated accumulator (the "state"),
+    so memory usage per key is O(1 tile) instead of O(number of tiles).
+    Cells that are NaN or equal to the tile's no-data value are ignored.
+
+    States are mergeable, so an aggregator can be used as a map-side combiner:
+    `rdd.combineByKey(aggregator.create, aggregator.add, aggregator.merge).mapValues(aggregator.finish)`
+
+    Results that are not values of the input (e.g. a mean or a percentile) are float32 tiles, counts are int32 tiles
+    (see `cell_type`), other results keep the cell type of the input.
+    """
+
+    # whether the result is a float32 tile, regardless of the input cell type
+    float_result = False
+
+    # cell type of the result if it doesn't depend on the input, see `result_metadata`
+    cell_type = None
+
+    def create(self, tile: gps.Tile) -> dict:
+        """Create a new accumulator state from a first tile."""
+        values, valid = _valid_values(tile)
+        state = {"cell_type": tile.cell_type, "no_data_value": tile.no_data_value, "dtype": tile.cells.dtype}
+        self._init(state, values, valid)
+        return state
+
+    def add(self, state: dict, tile: gps.Tile) -> dict:
+        """Fold an additional tile into the accumulator state (in place)."""
+        values, valid = _valid_values(tile)
+        self._update(state, values, valid)
+        return state
+
+    def merge(self, state: dict, other: dict) -> dict:
+        """Merge two partial accumulator states (the first one in place)."""
+        self._merge(state, other)
+        return state
+
+    def finish(self, state: dict) -> gps.Tile:
+        """Convert accumulator state to the resulting tile."""
+        return _to_tile(self._result(state), state, np.float32 if self.float_result else None)
+
+    def result_metadata(self, metadata: gps.Metadata) -> gps.Metadata:
+        """Layer metadata of the results of this aggregator, for a layer with `metadata`."""
+        if self.cell_type is None:
+            return metadata
+        return gps.Metadata.from_dict(dict(metadata.to_dict(), cellType=self.cell_type.value))
+
+    def aggregate_by_key(self, numpy_rdd):
+        """Reduce all tiles with the same key of a (key, Tile) RDD, combining partial aggregates map-side."""
+        return numpy_rdd.combineByKey(self.create, self.add, self.merge).mapValues(self.finish)
+
+    def __call__(self, tiles: Iterable[gps.Tile]) -> gps.Tile:
+        iterator = iter(tiles)
+        state = self.create(next(iterator))
+        for tile in iterator:
+            state = self.add(state, tile)
+        return self.finish(state)
+
+    @abstractmethod
+    def _init(self, state: dict, values: np.ndarray, valid: np.ndarray):
+        pass
+
+    @abstractmethod
+    def _update(self, state: dict, values: np.ndarray, valid: np.ndarray):
+        pass
+
+    @abstractmethod
+    def _merge(self, state: dict, other: dict):
+        pass
+
+    @abstractmethod
+    def _result(self, state: dict) -> np.ndarray:
+        pass
+
+
+class _ExtremeAggregator(TemporalAggregator):
+    """Running minimum/maximum (`np.fmin`/`np.fmax` ignore NaN)."""
+
+    def __init__(self, func):
+        self._func = func
+
+    def _init(self, state, values, valid):
+        state["value"] = np.where(valid, values, np.nan)
+
+    def _update(self, state, values, valid):
+        self._func(state["value"], np.where(valid, values, np.nan), out=state["value"])
+
+    def _merge(self, state, other):
+        self._func(state["value"], other["value"], out=state["value"])
+
+    def _result(self, state):
+        return state["value"]
+
+
+class _SumAggregator(TemporalAggregator):
+    """Running sum and count of valid observations."""
+
+    def _init(self, state, values, valid):
+        state["sum"] = np.where(valid, values, 0.0)
+        state["count"] = valid.astype(np.int32)
+
+    def _update(self, state, values, valid):
+        state["sum"] += np.where(valid, values, 0.0)
+        state["count"] += valid
+
+    def _merge(self, state, other):
+        state["sum"] += other["sum"]
+        state["count"] += other["count"]
+
+    def _result(self, state):
+        return state["sum"]  # 0 without valid observations, like np.nansum
+
+
+class _CountAggregator(TemporalAggregator):
+    """
+    Number of valid observations, as int32 cells with the int32 default no-data value (the minimum): a count of 0 is
+    a valid count, and the cell type of the input could overflow.
+    """
+
+    cell_type = CellType.INT32
+
+    def _init(self, state, values, valid):
+        state["count"] = valid.astype(np.int32)
+
+    def _update(self, state, values, valid):
+        state["count"] += valid
+
+    def _merge(self, state, other):
+        state["count"] += other["count"]
+
+    def _result(self, state):
+        return state["count"]
+
+    def finish(self, state):
+        return gps.Tile(cells=self._result(state), cell_type=self.cell_type.value,
+                        no_data_value=int(np.iinfo(np.int32).min))
+
+
+class _MomentsAggregator(TemporalAggregator):
+    """Running count, mean and sum of squared deviations (Welford's online algorithm)."""
+
+    float_result = True
 
+    def __init__(self, statistic: str):
+        self._statistic = statistic
 
-def min_composite(tiles: Iterable[gps.Tile]):
-    return composite(np.fmin, tiles)  # ignores NaN (<=> minimum)
+    def _init(self, state, values, valid):
+        state["count"] = valid.astype(np.int32)
+        state["mean"] = np.where(valid, values, 0.0)
+        state["m2"] = np.zeros(values.shape, dtype=np.float64)
 
+    def _update(self, state, values, valid):
+        count, mean, m2 = state["count"], state["mean"], state["m2"]
+        count += valid
+        delta = np.where(valid, values - mean, 0.0)
+        mean += np.divide(delta, count, out=np.zeros_like(delta), where=valid)
+        m2 += np.where(valid, delta * (values - mean), 0.0)
 
-def sum_composite(tiles: Iterable[gps.Tile]):
-    def fadd(a_cells, b_cells):
-        return np.add(np.nan_to_num(a_cells), np.nan_to_num(b_cells))
+    def _merge(self, state, other):
+        # parallel variant of Welford's algorithm (Chan et al.)
+        count_a, count_b = state["count"], other["count"]
+        count = count_a + count_b
+        delta = other["mean"] - state["mean"]
+        weight_b = np.divide(count_b, count, out=np.zeros(count.shape), where=count > 0)
+        state["mean"] += delta * weight_b
+        state["m2"] += other["m2"] + delta * delta * count_a * weight_b
+        state["count"] = count
 
-    return composite(fadd, tiles)  # ignores NaN (<=> add)
+    def _result(self, state):
+        count = state["count"]
+        if self._statistic == "mean":
+            result = state["mean"]
+        else:
+            # population variance (<=> np.nanvar)
+            result = np.divide(state["m2"], count, out=np.zeros_like(state["m2"]), where=count > 0)
+            if self._statistic == "std":
+                result = np.sqrt(result)
+        return np.where(count > 0, result, np.nan)
+
+
+class _PercentileAggregator(TemporalAggregator):
+    """
+    Percentile along the time axis (ignoring NaN, <=> np.nanpercentile with linear interpolation).
+
+    The state holds the (float32) observations of all dates. The result is computed with `np.nanpercentile` on blocks
+    of `rows_per_block` pixel rows at a time: only such a block of the observations is stacked and sorted along the
+    time axis, so the temporary arrays are bounded by the block size instead of the size of the whole tile.
+    """
+
+    float_result = True
+
+    # number of pixel rows that are sorted along the time axis at once
+    ROWS_PER_BLOCK = 16
+
+    def __init__(self, q: float, rows_per_block: int = ROWS_PER_BLOCK):
+        if not 0 <= q <= 100:
+            raise ValueError("Percentile should be in range [0, 100], but got: {q!r}".format(q=q))
+        self._q = q
+        self._rows_per_block = rows_per_block
+
+    def _init(self, state, values, valid):
+        state["observations"] = [np.where(valid, values, np.nan).astype(np.float32)]
+
+    def _update(self, state, values, valid):
+        state["observations"].append(np.where(valid, values, np.nan).astype(np.float32))
+
+    def _merge(self, state, other):
+        state["observations"].extend(other["observations"])
+
+    def _result(self, state):
+        observations = state["observations"]
+        result = np.empty(observations[0].shape, dtype=np.float64)
+        for start in range(0, result.shape[-2], self._rows_per_block):
+            block = np.stack([cells[..., start:start + self._rows_per_block, :] for cells in observations])
+            with warnings.catch_warnings():
+                # no valid observations: NaN (no data)
+                warnings.simplefilter("ignore", RuntimeWarning)
+                result[..., start:start + self._rows_per_block, :] = np.nanpercentile(block, self._q, axis=0)
+        return result
+
+
+class BandMeans:
+    """
+    Mean per band of all cells of a series of (bands, rows, cols) tiles, e.g. all tiles of a date within a polygon.
+    Cells that are NaN or equal to `no_data` are ignored.
+
+    The state is a (2, bands) float64 array of sums and counts: a tile is folded into it with a single mask and a
+    single reduction over its rows and columns, for all bands at once.
+
+    `rdd.aggregateByKey(None, means.add, means.merge).mapValues(means.finish)`
+    """
+
+    def __init__(self, no_data):
+        self._no_data = no_data
+
+    def add(self, state: np.ndarray, tile: gps.Tile) -> np.ndarray:
+        """Fold a tile into the state (in place, if not None)."""
+        # (bands, cells) view: reducing a single axis is cheaper than reducing (rows, cols)
+        cells = tile.cells.reshape((-1, tile.cells.shape[-2] * tile.cells.shape[-1]))
+        valid = self._valid(cells)
+        if state is None:
+            state = np.zeros((2, len(cells)), dtype=np.float64)
+        # summed in float64: with a mask, float32 cells are not guaranteed to be summed pairwise
+        state[0] += np.sum(cells, axis=1, where=valid, dtype=np.float64)
+        state[1] += np.add.reduce(valid, axis=1, dtype=np.int64)
+        return state
+
+    def merge(self, state: np.ndarray, other: np.ndarray) -> np.ndarray:
+        if state is None or other is None:
+            return other if state is None else state
+        state += other
+        return state
+
+    def finish(self, state: np.ndarray) -> list:
+        """Mean per band, NaN for bands without valid cells."""
+        sums, counts = state
+        return np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0).tolist()
+
+    def _valid(self, cells: np.ndarray) -> np.ndarray:
+        no_data = self._no_data
+        if cells.dtype.kind == 'f':
+            # special treatment for a UDF layer (NO_DATA is nan so every value, including nan, is not equal to nan);
+            # NaN is the only value that is not equal to itself
+            valid = cells == cells
+            if no_data is not None and not np.isnan(no_data):
+                valid &= cells != no_data
+            return valid
+        if no_data is None or np.isnan(no_data):
+            return np.ones(cells.shape, dtype=bool)
+        return cells != no_data
+
+
+def _valid_values(tile: gps.Tile) -> Tuple[np.ndarray, np.ndarray]:
+    """Cell values as float64 and mask of cells that are neither NaN nor no-data."""
+    values = np.asarray(tile.cells, dtype=np.float64)
+    valid = ~np.isnan(values)
+    no_data = tile.no_data_value
+    if no_data is not None and not np.isnan(no_data):
+        valid &= values != no_data
+    return values, valid
+
+
+def _to_tile(values: np.ndarray, state: dict, dtype=None) -> gps.Tile:
+    """Result tile with the cell type of the input, or with `dtype` cells (e.g. float32 for a mean of integers)."""
+    no_data = state["no_data_value"]
+    cell_type = state["cell_type"]
+    if dtype is None:
+        dtype = state["dtype"]
+    elif np.dtype(dtype) != state["dtype"]:
+        cell_type = np.dtype(dtype).name
+    if no_data is not None and not np.isnan(no_data):
+        values = np.where(np.isnan(values), no_data, values)
+    return gps.Tile(cells=values.astype(dtype), cell_type=cell_type, no_data_value=no_data)
+
+
+MIN = _ExtremeAggregator(np.fmin)
+MAX = _ExtremeAggregator(np.fmax)
+SUM = _SumAggregator()
+COUNT = _CountAggregator()
+MEAN = _MomentsAggregator("mean")
+VARIANCE = _MomentsAggregator("var")
+STANDARD_DEVIATION = _MomentsAggregator("std")
+MEDIAN = _PercentileAggregator(50)
+
+
+def percentile(q: float) -> TemporalAggregator:
+    """Aggregator for the q-th percentile (0 <= q <= 100) along time."""
+    return _PercentileAggregator(q)
+
+
+def max_composite(tiles: Iterable[gps.Tile]) -> gps.Tile:
+    return MAX(tiles)  # ignores NaNs (<=> maximum)
+
+
+def min_composite(tiles: Iterable[gps.Tile]) -> gps.Tile:
+    return MIN(tiles)  # ignores NaN (<=> minimum)
+
+
+def sum_composite(tiles: Iterable[gps.Tile]) -> gps.Tile:
+    return SUM(tiles)  # ignores NaN (<=> add)
+
+
+def count_composite(tiles: Iterable[gps.Tile]) -> gps.Tile:
+    return COUNT(tiles)  # number of non-NaN observations
+
+
+def mean_composite(tiles: Iterable[gps.Tile]) -> gps.Tile:
+    return MEAN(tiles)  # ignores NaN (<=> mean)
 
 
 def var_composite(tiles: Iterable[gps.Tile]) -> gps.Tile:
-    cube = np.array([tile.cells for tile in tiles])
-    reduced = np.nanvar(cube, axis=0)  # ignores NaN (<=> var)
-    first_tile = next(iter(tiles))
-    return gps.Tile(cells=reduced, cell_type=first_tile.cell_type, no_data_value=first_tile.no_data_value)
+    return VARIANCE(tiles)  # ignores NaN (<=> var)
 
 
 def std_composite(tiles: Iterable[gps.Tile]) -> gps.Tile:
-    cube = np.array([tile.cells for tile in tiles])
-    reduced = np.nanstd(cube, axis=0)  # ignores NaN (<=> std)
-    first_tile = next(iter(tiles))
-    return gps.Tile(cells=reduced, cell_type=first_tile.cell_type, no_data_value=first_tile.no_data_value)
+    return STANDARD_DEVIATION(tiles)  # ignores NaN (<=> std)
+
+
+def median_composite(tiles: Iterable[gps.Tile]) -> gps.Tile:
+    return MEDIAN(tiles)  # ignores NaN (<=> median)
 
 
-def composite(func, tiles: Iterable[gps.Tile]):
-    from functools import reduce
-    cells = [tile.cells for tile in tiles]
-    first_tile = next(iter(tiles))
-    reduced = reduce(func, cells)
-    print(reduced)
+def composite(func, tiles: Iterable[gps.Tile]) -> gps.Tile:
+    """Reduce tiles pairwise with a binary numpy function, e.g. `np.fmax`."""
+    iterator = iter(tiles)
+    first_tile = next(iterator)
+    reduced = first_tile.cells
+    for tile in iterator:
+        reduced = func(reduced, tile.cells)
     return gps.Tile(cells=reduced, cell_type=first_tile.cell_type, no_data_value=first_tile.no_data_value)
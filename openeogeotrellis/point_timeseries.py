@@ -0,0 +1,111 @@
+"""
+Values of a layer at many points at once: the points are reprojected with a single (cached) transformer, grouped
+by the spatial key of the tile that contains them, and every tile is then read once for all of its points.
+
+The result is columnar: an xarray DataArray with dimensions (point, t, bands), or (point, bands) for a spatial
+layer, NaN where a point has no data.
+"""
+import functools
+from datetime import datetime, timezone
+from typing import Dict, Sequence, Tuple
+
+import geopyspark as gps
+import numpy as np
+import xarray as xr
+from geopyspark import LayerType, TiledRasterLayer
+
+from openeogeotrellis import projections
+
+
+def pixels_by_key(layer: TiledRasterLayer, x: np.ndarray, y: np.ndarray) -> Dict[Tuple[int, int], Tuple[np.ndarray, ...]]:
+    """
+    Points (in the CRS of the layer) grouped by spatial key: {(col, row): (point indices, pixel rows, pixel cols)},
+    pixels counted from the top left of the tile. Points outside of the layout are left out.
+    """
+    layout = layer.layer_metadata.layout_definition
+    extent, tile_layout = layout.extent, layout.tileLayout
+    xres = (extent.xmax - extent.xmin) / (tile_layout.layoutCols * tile_layout.tileCols)
+    yres = (extent.ymax - extent.ymin) / (tile_layout.layoutRows * tile_layout.tileRows)
+
+    with np.errstate(invalid='ignore'):
+        pixel_cols = np.floor((x - extent.xmin) / xres)
+        pixel_rows = np.floor((extent.ymax - y) / yres)
+        inside = (pixel_cols >= 0) & (pixel_cols < tile_layout.layoutCols * tile_layout.tileCols) & \
+                 (pixel_rows >= 0) & (pixel_rows < tile_layout.layoutRows * tile_layout.tileRows)
+    indices = np.flatnonzero(inside)
+    if len(indices) == 0:
+        return {}
+    pixel_cols, pixel_rows = pixel_cols[inside].astype(np.int64), pixel_rows[inside].astype(np.int64)
+    cols, tile_cols = np.divmod(pixel_cols, tile_layout.tileCols)
+    rows, tile_rows = np.divmod(pixel_rows, tile_layout.tileRows)
+
+    # a single sort to split the points by key
+    order = np.lexsort((rows, cols))
+    cols, rows = cols[order], rows[order]
+    starts = np.flatnonzero(np.r_[True, (np.diff(cols) != 0) | (np.diff(rows) != 0)])
+    stops = np.r_[starts[1:], len(order)]
+    return {
+        (int(cols[start]), int(rows[start])):
+            (indices[order[start:stop]], tile_rows[order[start:stop]], tile_cols[order[start:stop]])
+        for start, stop in zip(starts, stops)
+    }
+
+
+def tile_values(pixels, item) -> Tuple[object, np.ndarray, np.ndarray]:
+    """(instant or None, point indices, (points, bands) values) of the points in a tile, NaN for no data."""
+    key, tile = item
+    indices, rows, cols = pixels.value[(key.col, key.row)]
+    cells = tile.cells.reshape((-1,) + tile.cells.shape[-2:])
+    values = cells[:, rows, cols].T.astype(np.float64)
+    no_data = tile.no_data_value
+    if no_data is not None and not np.isnan(no_data):
+        values[values == no_data] = np.nan
+    return getattr(key, 'instant', None), indices, values
+
+
+def point_timeseries(layer: TiledRasterLayer, x: Sequence[float], y: Sequence[float], srs: str = "EPSG:4326",
+                     band_names: Sequence[str] = None) -> xr.DataArray:
+    """
+    Values of a layer at points.
+
+    :param x: x coordinates of the points, in `srs`
+    :param y: y coordinates of the points, in `srs`
+    :param band_names: names of the bands, "band_<i>" by default
+    :return: (point, t, bands) DataArray, (point, bands) for a spatial layer
+    """
+    x, y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    if x.shape != y.shape or x.ndim != 1:
+        raise ValueError("Expected as many x as y coordinates, but got {x} and {y}".format(x=x.shape, y=y.shape))
+    has_time = layer.layer_type == LayerType.SPACETIME
+
+    x_layer, y_layer = projections.transform(srs, layer.layer_metadata.crs, x, y)
+    pixels = gps.get_spark_context().broadcast(pixels_by_key(layer, np.asarray(x_layer), np.asarray(y_layer)))
+    try:
+        values = layer.to_numpy_rdd() \
+            .filter(lambda item: (item[0].col, item[0].row) in pixels.value) \
+            .map(functools.partial(tile_values, pixels)) \
+            .collect()
+    finally:
+        pixels.unpersist()
+
+    band_count = max((v.shape[1] for _, _, v in values), default=len(band_names) if band_names else 0)
+    if band_names is None or len(band_names) != band_count:
+        band_names = ['band_' + str(i) for i in range(band_count)]
+
+    dates = sorted({instant for instant, _, _ in values}, key=_naive_utc) if has_time else [None]
+    date_index = {date: i for i, date in enumerate(dates)}
+    result = np.full((len(x), len(dates), band_count), np.nan)
+    for instant, indices, point_values in values:
+        result[indices, date_index[instant]] = point_values
+
+    coords = {'point': np.arange(len(x)), 'bands': list(band_names), 'x': ('point', x), 'y': ('point', y)}
+    if has_time:
+        coords['t'] = [np.datetime64(_naive_utc(d)) for d in dates]
+        return xr.DataArray(result, dims=['point', 't', 'bands'], coords=coords, attrs={'crs': srs})
+    return xr.DataArray(result[:, 0], dims=['point', 'bands'], coords=coords, attrs={'crs': srs})
+
+
+def _naive_utc(date: datetime) -> datetime:
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return date
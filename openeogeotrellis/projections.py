@@ -0,0 +1,65 @@
+"""
+Shared registry of pyproj Transformers: setting up a transformation between two CRSs is expensive compared to
+transforming a few coordinates, so Transformers are created once per (source, destination) pair and reused.
+
+All transformations use the traditional GIS axis order (x/easting/longitude first, `always_xy`), which is also
+what the "+init=<authority>:<code>" CRS definitions used across this code base imply, and work on arrays of
+coordinates at once.
+"""
+import functools
+import re
+from typing import Tuple, Union
+
+import numpy as np
+import pyproj
+import shapely.ops
+from shapely.geometry.base import BaseGeometry
+
+# anything pyproj.CRS accepts: a definition string, an EPSG code, a pyproj.CRS, ...
+CRS = Union[str, int, pyproj.CRS]
+
+_INIT = re.compile(r"^\+init=(\w+):(\w+)$", re.IGNORECASE)
+
+
+def normalize_crs(crs: CRS) -> str:
+    """
+    Normalized CRS definition, to share Transformers between equivalent definitions:
+    an EPSG code, "EPSG:4326", "epsg:4326", "+init=epsg:4326" and pyproj.CRS("EPSG:4326") all become "EPSG:4326".
+    """
+    if not isinstance(crs, str):
+        # EPSG code, pyproj.CRS, dict, ...
+        crs = pyproj.CRS(crs).to_string()
+    crs = crs.strip()
+    match = _INIT.match(crs) or re.match(r"^(\w+):(\w+)$", crs)
+    if match:
+        return "{a}:{c}".format(a=match.group(1).upper(), c=match.group(2))
+    return crs
+
+
+@functools.lru_cache(maxsize=64)
+def _transformer(src_crs: str, dst_crs: str) -> pyproj.Transformer:
+    return pyproj.Transformer.from_crs(pyproj.CRS(src_crs), pyproj.CRS(dst_crs), always_xy=True)
+
+
+def get_transformer(src_crs: CRS, dst_crs: CRS) -> pyproj.Transformer:
+    """Cached (always_xy) Transformer from `src_crs` to `dst_crs`."""
+    return _transformer(normalize_crs(src_crs), normalize_crs(dst_crs))
+
+
+def transform(src_crs: CRS, dst_crs: CRS, x, y) -> Tuple:
+    """Transform coordinates (scalars or arrays) from `src_crs` to `dst_crs`."""
+    return get_transformer(src_crs, dst_crs).transform(x, y)
+
+
+def transform_bounds(src_crs: CRS, dst_crs: CRS,
+                     xmin: float, ymin: float, xmax: float, ymax: float) -> Tuple[float, float, float, float]:
+    """Transform the lower left and upper right corners of a bounding box at once."""
+    x, y = transform(src_crs, dst_crs, np.array([xmin, xmax]), np.array([ymin, ymax]))
+    return float(x[0]), float(y[0]), float(x[1]), float(y[1])
+
+
+def reproject_geometry(geometry: BaseGeometry, src_crs: CRS, dst_crs: CRS) -> BaseGeometry:
+    """Reproject a shapely geometry, transforming all coordinates of a ring or line at once."""
+    if normalize_crs(src_crs) == normalize_crs(dst_crs):
+        return geometry
+    return shapely.ops.transform(get_transformer(src_crs, dst_crs).transform, geometry)
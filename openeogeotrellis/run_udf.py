@@ -1,4 +1,6 @@
 import functools
+import logging
+import time
 from pprint import pprint
 
 import xarray
@@ -8,7 +10,7 @@ import geopandas
 import shapely
 from copy import deepcopy
 import math
-from typing import Dict
+from typing import Dict, Tuple, Callable, List
 from inspect import signature
 
 from openeo_udf.api.feature_collection import FeatureCollection
@@ -29,6 +31,13 @@ __email__ = "soerengebbert@googlemail.com"
 This is a copy of run_code.py in the UDF api. It allows more easy experimentation inside this backend.
 """
 
+_log = logging.getLogger(__name__)
+
+# entrypoint of a UDF that accepts a batch of tiles, stacked along an extra (leading) dimension
+BATCH_ENTRYPOINT = 'apply_datacube_batch'
+BATCH_DIMENSION = 'tiles'
+DEFAULT_UDF_BATCH_SIZE = 64
+
 def _build_default_execution_context():
     context = {
         'numpy': numpy,
@@ -70,8 +79,15 @@ def load_module_from_string(code:str):
     exec(code, module)
     return module
 
-def run_user_code(code:str, data:UdfData) -> UdfData:
+@functools.lru_cache(maxsize=100)
+def load_entrypoint(code: str) -> Tuple[str, Callable[[UdfData], UdfData]]:
+    """
+    Load the UDF module and resolve its entrypoint once: inspecting the signatures of the module's callables
+    is only done the first time a given UDF is used in this (Python worker) process.
 
+    @param code: UDF source code
+    @return: tuple of entrypoint name and a function that applies the UDF to a UdfData object (in place)
+    """
     module = load_module_from_string(code)
 
     functions = {t[0]:t[1] for t in module.items() if callable(t[1])}
@@ -84,20 +100,98 @@ def run_user_code(code:str, data:UdfData) -> UdfData:
                 in str(params['series'].annotation) and 'pandas.core.series.Series' in str(sig.return_annotation) ):
             #this is a UDF that transforms pandas series
             from openeo_udf.api.udf_wrapper import apply_timeseries_generic
-            return apply_timeseries_generic(data, func[1])
-        elif( (func[0] == 'apply_hypercube' or func[0] == 'apply_datacube' )  and 'cube' in params and 'context' in params and 'openeo_udf.api.datacube.DataCube'
+            return func[0], functools.partial(apply_timeseries_generic, callback=func[1])
+        elif( (func[0] == 'apply_hypercube' or func[0] == 'apply_datacube' or func[0] == BATCH_ENTRYPOINT)  and 'cube' in params and 'context' in params and 'openeo_udf.api.datacube.DataCube'
               in str(params['cube'].annotation) and 'openeo_udf.api.datacube.DataCube' in str(sig.return_annotation) ):
             #found a datacube mapping function
-            if len(data.get_datacube_list()) != 1:
-                raise ValueError("The provided UDF expects exactly one datacube, but only: %s were provided." % len(data.get_datacube_list()))
-            result_cube = func[1](data.get_datacube_list()[0], data.user_context)
-            if not isinstance(result_cube,DataCube):
-                raise ValueError("The provided UDF did not return a DataCube, but got: %s" %result_cube)
-            data.set_datacube_list([result_cube])
-            break
+            return func[0], functools.partial(_run_datacube_function, func[1])
         elif len(params_list) == 1 and (params_list[0].annotation == 'openeo_udf.api.udf_data.UdfData' or params_list[0].annotation == UdfData) :
             #found a generic UDF function
-            func[1](data)
-            break
+            return func[0], functools.partial(_run_generic_function, func[1])
+
+    return None, lambda data: data
 
+
+def _run_datacube_function(function, data: UdfData) -> UdfData:
+    if len(data.get_datacube_list()) != 1:
+        raise ValueError("The provided UDF expects exactly one datacube, but only: %s were provided." % len(data.get_datacube_list()))
+    result_cube = function(data.get_datacube_list()[0], data.user_context)
+    if not isinstance(result_cube,DataCube):
+        raise ValueError("The provided UDF did not return a DataCube, but got: %s" %result_cube)
+    data.set_datacube_list([result_cube])
+    return data
+
+
+def _run_generic_function(function, data: UdfData) -> UdfData:
+    function(data)
     return data
+
+
+def run_user_code(code:str, data:UdfData) -> UdfData:
+    _, entrypoint = load_entrypoint(code)
+    return entrypoint(data)
+
+
+class UdfExecutor:
+    """
+    Executes a UDF on many UdfData objects, e.g. all tiles of a partition:
+    the UDF is compiled and its entrypoint is resolved once, and the invocations are timed.
+    """
+
+    def __init__(self, code: str):
+        start = time.perf_counter()
+        self.name, self._entrypoint = load_entrypoint(code)
+        self.setup_time = time.perf_counter() - start
+        self.calls = 0
+        self.run_time = 0.0
+
+    @property
+    def batched(self) -> bool:
+        """Whether the UDF wants to receive many tiles at once (see `apply_batch`)."""
+        return self.name == BATCH_ENTRYPOINT
+
+    def __call__(self, data: UdfData) -> UdfData:
+        start = time.perf_counter()
+        try:
+            return self._entrypoint(data)
+        finally:
+            self.calls += 1
+            self.run_time += time.perf_counter() - start
+
+    def log_stats(self):
+        _log.info("UDF {n!r}: {c} call(s) in {r:.3f}s ({a:.3f}s per call), setup {s:.3f}s".format(
+            n=self.name, c=self.calls, r=self.run_time, a=self.run_time / self.calls if self.calls else 0.0,
+            s=self.setup_time))
+
+    def apply_batch(self, cubes: List[DataCube], user_context: Dict) -> List[DataCube]:
+        """
+        Invoke the UDF once for a list of cubes with identical dimensions and shape:
+        the cubes are stacked along a new leading 'tiles' dimension, and the resulting cube
+        (which should keep that dimension) is split again in one cube per input cube.
+
+        Coordinates that differ between the cubes (e.g. x and y of tiles) are left out of the stacked cube,
+        and are assigned again to the resulting cubes.
+        """
+        first = cubes[0].array
+        shared = {name: coord for name, coord in first.coords.items()
+                  if all(name in cube.array.coords and cube.array.coords[name].equals(coord) for cube in cubes[1:])}
+        stacked = numpy.stack([cube.array.values for cube in cubes])
+        batch = xarray.DataArray(stacked, dims=(BATCH_DIMENSION,) + first.dims, coords=shared, name=first.name)
+
+        data = UdfData({"EPSG": 900913}, [DataCube(batch)])
+        data.user_context = user_context
+        result_cubes = self(data).get_datacube_list()
+        if len(result_cubes) != 1:
+            raise ValueError("The provided UDF should return one datacube, but got: " + str(result_cubes))
+
+        result = result_cubes[0].array
+        if result.dims[0] != BATCH_DIMENSION or result.shape[0] != len(cubes):
+            raise ValueError("The provided UDF should return a datacube with a leading '%s' dimension of size %d, "
+                             "but got dimensions: %s" % (BATCH_DIMENSION, len(cubes), dict(result.sizes)))
+        return [DataCube(self._with_own_coords(result[i], cube.array, shared)) for i, cube in enumerate(cubes)]
+
+    @staticmethod
+    def _with_own_coords(result: xarray.DataArray, cube: xarray.DataArray, shared: Dict) -> xarray.DataArray:
+        own = {name: coord for name, coord in cube.coords.items()
+               if name not in shared and name in result.dims and result.sizes[name] == coord.size}
+        return result.assign_coords(**own) if own else result
@@ -0,0 +1,63 @@
+"""
+Stitching of the tiles of a layer into a single (bands, x, y) window, as used for the xarray based output formats.
+
+Window pixel indices are counted from the left (x) and from the bottom (y) of the layout, tile rows from the top.
+"""
+import itertools
+from typing import Iterable, Tuple, Union
+
+import numpy as np
+from geopyspark import Tile
+
+
+def overlap(window_start: int, window_size: int, block_start: int, block_size: int) -> Union[Tuple[int, int], None]:
+    """Overlapping pixel range [start, stop) of a window and a block along one axis, None if they don't overlap."""
+    start = max(window_start, block_start)
+    stop = min(window_start + window_size, block_start + block_size)
+    return (start, stop) if start < stop else None
+
+
+def stitch(tiles: Iterable[Tuple[object, Tile]], crop_win: Tuple[int, int, int, int], layout_rows: int) -> np.ndarray:
+    """
+    Place the (key, tile) pairs (keys with a col and row) in a (bands, x, y) window.
+
+    :param crop_win: window in pixels: (xmin, ymin, width, height), with ymin counted from the bottom of the layout
+    :param layout_rows: number of pixel rows of the layout
+    :return: window, filled with the no data value where there are no tiles
+    """
+    tiles = iter(tiles)
+    first_key, first_tile = next(tiles)
+    tile_rows, tile_cols = first_tile.cells.shape[-2:]
+    nyblk = layout_rows // tile_rows - 1
+    window_x, window_y, width, height = crop_win
+
+    cells = first_tile.cells
+    nodata = first_tile.no_data_value
+    if nodata is not None:
+        window = np.full((_band_count(cells), width, height), nodata, cells.dtype)
+    else:
+        window = np.zeros((_band_count(cells), width, height), cells.dtype)
+
+    # (bands, y, x) view on the window, to assign (slices of) blocks without transposing them
+    window_yx = window.transpose(0, 2, 1)
+
+    for key, tile in itertools.chain([(first_key, first_tile)], tiles):
+        block_x = key.col * tile_cols
+        # block row counted from the bottom
+        block_y = (nyblk - key.row) * tile_rows
+        xs = overlap(window_x, width, block_x, tile_cols)
+        ys = overlap(window_y, height, block_y, tile_rows)
+        if xs is None or ys is None:
+            continue
+        block = tile.cells.reshape((-1, tile_rows, tile_cols))
+        # y runs bottom-up in the window but rows run top-down in the tile
+        top = block_y + tile_rows - ys[1]
+        bottom = block_y + tile_rows - ys[0]
+        window_yx[:, ys[0] - window_y:ys[1] - window_y, xs[0] - window_x:xs[1] - window_x] = \
+            block[:, top:bottom, xs[0] - block_x:xs[1] - block_x][:, ::-1, :]
+
+    return window
+
+
+def _band_count(cells: np.ndarray) -> int:
+    return int(np.prod(cells.shape[:-2])) if cells.ndim > 2 else 1
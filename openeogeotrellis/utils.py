@@ -1,5 +1,7 @@
 import collections
+import functools
 import grp
+import inspect
 import logging
 import os
 from pathlib import Path
@@ -20,20 +22,46 @@ from openeo_driver.delayed_vector import DelayedVector
 logger = logging.getLogger("openeo")
 
 def log_memory(function):
-    def memory_logging_wrapper(x):
+    """
+    Wrap a (e.g. `mapPartitions`) function to log the memory usage while it runs. For a generator function, that is
+    while the generator is being consumed, not just while it is being created.
+    """
+    def start_memory_logger():
         try:
             from spark_memlogger import memlogger
         except ImportError:
-            return function(x)
+            return None
         ml = memlogger.MemLogger(5)
+        ml.start()
+        return ml
+
+    if _is_generator_function(function):
+        def memory_logging_generator(x):
+            ml = start_memory_logger()
+            try:
+                yield from function(x)
+            finally:
+                if ml is not None:
+                    ml.stop()
+
+        return memory_logging_generator
+
+    def memory_logging_wrapper(x):
+        ml = start_memory_logger()
         try:
-            ml.start()
             return function(x)
         finally:
-            ml.stop()
+            if ml is not None:
+                ml.stop()
 
     return memory_logging_wrapper
 
+
+def _is_generator_function(function) -> bool:
+    while isinstance(function, functools.partial):
+        function = function.func
+    return inspect.isgeneratorfunction(function)
+
 def kerberos():
     import geopyspark as gps
 
@@ -0,0 +1,168 @@
+"""
+Zarr output: the driver only creates the Zarr group (array metadata and coordinates), the executors write the
+chunks of their tiles directly. A chunk is a single band of a single tile at a single date, so no two tasks ever
+write to the same chunk.
+
+The group follows the xarray conventions (`_ARRAY_DIMENSIONS`), so it can be opened with `xarray.open_zarr`:
+a variable per band with dimensions (t, y, x) (or (y, x) without time dimension), north-up.
+
+The group is a directory: to serve it as a single file, it can be zipped with `zip_store` (a zip file that
+`zarr.ZipStore` can open as well).
+"""
+import logging
+import math
+import pathlib
+import re
+import zipfile
+from datetime import datetime, timezone
+from typing import Dict, List, Union
+
+import numpy as np
+from geopyspark import TiledRasterLayer, LayerType
+from geopyspark.geotrellis import Extent
+from pyspark import StorageLevel
+
+logger = logging.getLogger("openeo")
+
+TIME_UNITS = "seconds since 1970-01-01 00:00:00"
+
+
+def cell_type_dtype(cell_type: str) -> np.dtype:
+    """Numpy dtype of a GeoTrellis cell type, e.g. "int16ud-1", "float32raw" or "uint8"."""
+    match = re.match(r"bool|u?int\d+|float\d+", cell_type)
+    if not match:
+        raise ValueError("Unsupported cell type: {c!r}".format(c=cell_type))
+    return np.dtype(match.group())
+
+
+def _epoch_seconds(date: datetime) -> int:
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return int(np.datetime64(date, 's').astype(np.int64))
+
+
+def _band_count(layer: TiledRasterLayer) -> Union[int, None]:
+    """Number of bands of the first tile of a layer, None for an empty layer."""
+    first = layer.to_numpy_rdd().take(1)
+    if not first:
+        return None
+    cells = first[0][1].cells
+    return cells.shape[0] if cells.ndim == 3 else 1
+
+
+def write_zarr(layer: TiledRasterLayer, path: Union[str, pathlib.Path], band_names: List[str], attrs: Dict,
+               crop_bounds: Extent = None, crop_dates=None) -> str:
+    """
+    Write a (spatial or spacetime) layer as a Zarr group.
+
+    :param path: directory of the Zarr group, on a file system that is shared between the driver and executors
+    :param crop_bounds: only tiles that intersect these bounds are written; the output is not cropped further,
+        to keep the chunks aligned with the tiles
+    :param crop_dates: (start, end) tuple of dates to write
+    """
+    import zarr
+
+    path = pathlib.Path(path)
+    metadata = layer.layer_metadata
+    has_time = layer.layer_type == LayerType.SPACETIME
+    layout = metadata.layout_definition
+    tile_cols, tile_rows = layout.tileLayout.tileCols, layout.tileLayout.tileRows
+    xres = (layout.extent.xmax - layout.extent.xmin) / (layout.tileLayout.layoutCols * tile_cols)
+    yres = (layout.extent.ymax - layout.extent.ymin) / (layout.tileLayout.layoutRows * tile_rows)
+
+    min_col, max_col = metadata.bounds.minKey.col, metadata.bounds.maxKey.col
+    min_row, max_row = metadata.bounds.minKey.row, metadata.bounds.maxKey.row
+    if crop_bounds:
+        # tile rows are counted from the top
+        min_col = max(min_col, math.floor((crop_bounds.xmin - layout.extent.xmin) / (xres * tile_cols)))
+        max_col = min(max_col, math.ceil((crop_bounds.xmax - layout.extent.xmin) / (xres * tile_cols)) - 1)
+        min_row = max(min_row, math.floor((layout.extent.ymax - crop_bounds.ymax) / (yres * tile_rows)))
+        max_row = min(max_row, math.ceil((layout.extent.ymax - crop_bounds.ymin) / (yres * tile_rows)) - 1)
+    if min_col > max_col or min_row > max_row:
+        raise ValueError("No tiles intersect {b!r}".format(b=crop_bounds))
+
+    # the dates, the band count and the chunks are all computed from the layer
+    persist = has_time and not layer.is_cached
+    if persist:
+        layer.persist(StorageLevel.MEMORY_AND_DISK)
+    try:
+        dates = []
+        if has_time:
+            def in_crop_dates(instant):
+                return crop_dates is None or crop_dates[0] <= instant <= crop_dates[1]
+
+            dates = sorted({key.instant for key in layer.collect_keys() if in_crop_dates(key.instant)},
+                           key=_epoch_seconds)
+
+        height, width = (max_row - min_row + 1) * tile_rows, (max_col - min_col + 1) * tile_cols
+        x0 = layout.extent.xmin + min_col * tile_cols * xres
+        y0 = layout.extent.ymax - min_row * tile_rows * yres
+        band_count = _band_count(layer)
+        if band_count is not None and len(band_names) != band_count:
+            # same workaround as json_writer for metadata that is out of sync, but checked on the driver, before
+            # the executors have computed the layer
+            logger.warning("Expected {e} bands but got {a}: writing them as band_<i>".format(e=len(band_names),
+                                                                                             a=band_count))
+            band_names = ['band_' + str(i) for i in range(band_count)]
+
+        dtype = cell_type_dtype(metadata.cell_type)
+        nodata = attrs.get("nodata")
+        fill_value = nodata if nodata is not None and np.can_cast(np.min_scalar_type(nodata), dtype) else None
+
+        group = zarr.open_group(str(path), mode="w")
+        group.attrs.update({key: value for key, value in attrs.items() if value is not None})
+        dims = (["t"] if has_time else []) + ["y", "x"]
+        if has_time:
+            t = group.create_dataset("t", data=np.array([_epoch_seconds(d) for d in dates], dtype=np.int64))
+            t.attrs.update({"_ARRAY_DIMENSIONS": ["t"], "units": TIME_UNITS, "calendar": "standard"})
+        y = group.create_dataset("y", data=y0 - (np.arange(height) + 0.5) * yres)
+        y.attrs["_ARRAY_DIMENSIONS"] = ["y"]
+        x = group.create_dataset("x", data=x0 + (np.arange(width) + 0.5) * xres)
+        x.attrs["_ARRAY_DIMENSIONS"] = ["x"]
+        for band_name in band_names:
+            band = group.create_dataset(
+                band_name, shape=((len(dates),) if has_time else ()) + (height, width),
+                chunks=((1,) if has_time else ()) + (tile_rows, tile_cols), dtype=dtype, fill_value=fill_value
+            )
+            band.attrs["_ARRAY_DIMENSIONS"] = dims
+
+        date_index = {date: i for i, date in enumerate(dates)}
+
+        def in_window(key) -> bool:
+            return min_col <= key.col <= max_col and min_row <= key.row <= max_row and \
+                   (not has_time or key.instant in date_index)
+
+        def write_partition(tiles):
+            arrays = [zarr.open_array(str(path / band_name), mode="r+") for band_name in band_names]
+            for key, tile in tiles:
+                cells = tile.cells.reshape((-1, tile_rows, tile_cols))
+                if len(cells) != len(arrays):
+                    raise ValueError("Expected {e} bands but got {a}: {b!r}".format(e=len(arrays), a=len(cells),
+                                                                                    b=band_names))
+                rows = slice((key.row - min_row) * tile_rows, (key.row - min_row + 1) * tile_rows)
+                cols = slice((key.col - min_col) * tile_cols, (key.col - min_col + 1) * tile_cols)
+                for array, band in zip(arrays, cells):
+                    if has_time:
+                        array[date_index[key.instant], rows, cols] = band
+                    else:
+                        array[rows, cols] = band
+
+        layer.to_numpy_rdd().filter(lambda t: in_window(t[0])).foreachPartition(write_partition)
+    finally:
+        if persist:
+            layer.unpersist()
+
+    zarr.consolidate_metadata(str(path))
+    logger.info("Wrote Zarr group {p}: {b} band(s), {d} date(s), {h}x{w} pixels".format(
+        p=path, b=len(band_names), d=len(dates), h=height, w=width))
+    return str(path)
+
+
+def zip_store(path: Union[str, pathlib.Path], zip_path: Union[str, pathlib.Path]) -> str:
+    """Zip a Zarr group directory (uncompressed: the chunks are compressed already), with its keys as names."""
+    path = pathlib.Path(path)
+    with zipfile.ZipFile(str(zip_path), mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as zip_file:
+        for file in sorted(path.rglob("*")):
+            if file.is_file():
+                zip_file.write(str(file), arcname=file.relative_to(path).as_posix())
+    return str(zip_path)
@@ -0,0 +1,443 @@
+"""
+Zonal statistics of a spacetime layer over any number of polygons in a single pass over the layer.
+
+The polygons are indexed by the spatial keys of the layout that they intersect (on the driver, broadcast to the
+executors), so a tile only deals with its own polygons. They are rasterized into a zone raster per spatial key:
+every pixel holds the index of the polygon it belongs to (-1 outside polygons); overlapping polygons get an extra
+zone raster "layer", so a pixel can belong to more than one polygon. The zone rasters are computed on the executors and cached per layout and spatial key, so
+they are shared between the dates (and requests) of a layer.
+
+Per tile, the count, mean, sum of squared deviations, min and max of every (zone, band) are computed at once
+with `np.bincount`; the value counts are only kept for the statistics that need the distribution (median and
+histogram). Partial statistics per (zone, date) are then merged with `reduceByKey`.
+
+The results are streamed to the driver (sorted by date), as a timeseries dict or as CSV chunks, rather than
+collected at once.
+"""
+import csv
+import functools
+import hashlib
+import io
+import json
+import math
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple, Union
+
+import geopyspark as gps
+import numpy as np
+from openeo_driver.save_result import AggregatePolygonResult
+from shapely.geometry import GeometryCollection, MultiPolygon, Polygon, box
+from shapely.geometry.base import BaseGeometry
+from shapely.prepared import prep
+
+from openeogeotrellis import projections
+
+FUNCS = ["mean", "sd", "median", "histogram", "min", "max", "sum", "count"]
+DISTRIBUTION_FUNCS = ["median", "histogram"]
+
+
+def read_regions(regions, crs: str) -> List[BaseGeometry]:
+    """
+    Polygons of the regions (a geometry, a collection of geometries or the path of a vector file), in `crs`.
+
+    Geometries are expected in EPSG:4326, vector files in their own CRS (EPSG:4326 if they don't have one).
+    """
+    if isinstance(regions, (str, Path)) or hasattr(regions, "path"):
+        import geopandas as gpd
+        df = gpd.read_file(str(getattr(regions, "path", regions)))
+        return _reproject(list(df.geometry), df.crs or "EPSG:4326", crs)
+    if isinstance(regions, GeometryCollection):
+        return _reproject(list(regions.geoms), "EPSG:4326", crs)
+    if isinstance(regions, (Polygon, MultiPolygon)):
+        return _reproject([regions], "EPSG:4326", crs)
+    raise ValueError("Unsupported regions: {r!r}".format(r=type(regions)))
+
+
+def _reproject(geometries: List[BaseGeometry], src_crs, dst_crs) -> List[BaseGeometry]:
+    return [projections.reproject_geometry(geometry, src_crs, dst_crs) for geometry in geometries]
+
+
+class ZoneRasterizer:
+    """
+    Zone rasters of polygons (already in the CRS of the layer) in a tile layout.
+
+    Instances are compared by layout and polygons, so that zone rasters can be cached across tasks on the executors.
+    """
+
+    def __init__(self, geometries: List[BaseGeometry], extent: Tuple[float, float, float, float],
+                 tile_layout: Tuple[int, int, int, int]):
+        """
+        :param extent: layout extent: (xmin, ymin, xmax, ymax)
+        :param tile_layout: (layoutCols, layoutRows, tileCols, tileRows)
+        """
+        self.geometries = geometries
+        self.extent = tuple(extent)
+        self.tile_layout = tuple(tile_layout)
+        self.token = hashlib.sha1(repr((self.extent, self.tile_layout)).encode()
+                                  + b"".join(g.wkb for g in geometries)).hexdigest()
+        self.zones_by_key = self._index()
+
+    @property
+    def tile_size(self) -> Tuple[float, float]:
+        xmin, ymin, xmax, ymax = self.extent
+        layout_cols, layout_rows = self.tile_layout[:2]
+        return (xmax - xmin) / layout_cols, (ymax - ymin) / layout_rows
+
+    def key_bounds(self, col: int, row: int) -> Tuple[float, float, float, float]:
+        """(xmin, ymin, xmax, ymax) of a spatial key."""
+        tile_width, tile_height = self.tile_size
+        xmin, ymax = self.extent[0] + col * tile_width, self.extent[3] - row * tile_height
+        return xmin, ymax - tile_height, xmin + tile_width, ymax
+
+    def _index(self) -> Dict[Tuple[int, int], List[int]]:
+        """
+        Indices of the polygons that intersect a spatial key (col, row): a bucket per key of the layout grid.
+
+        Polygons are assigned to the keys that their bounds intersect, and polygons that span more than one key
+        only to the keys that they actually intersect: a tile only rasterizes the polygons that it overlaps.
+        """
+        xmin, _, _, ymax = self.extent
+        layout_cols, layout_rows = self.tile_layout[:2]
+        tile_width, tile_height = self.tile_size
+        zones_by_key = {}
+        for zone, geometry in enumerate(self.geometries):
+            if geometry.is_empty:
+                continue
+            gxmin, gymin, gxmax, gymax = geometry.bounds
+            # tile rows are counted from the top
+            min_col = max(0, math.floor((gxmin - xmin) / tile_width))
+            max_col = min(layout_cols - 1, math.floor((gxmax - xmin) / tile_width))
+            min_row = max(0, math.floor((ymax - gymax) / tile_height))
+            max_row = min(layout_rows - 1, math.floor((ymax - gymin) / tile_height))
+            keys = [(col, row) for col in range(min_col, max_col + 1) for row in range(min_row, max_row + 1)]
+            if len(keys) > 1:
+                prepared = prep(geometry)
+                keys = [key for key in keys if prepared.intersects(box(*self.key_bounds(*key)))]
+            for key in keys:
+                zones_by_key.setdefault(key, []).append(zone)
+        return zones_by_key
+
+    def zones(self, col: int, row: int) -> Union[np.ndarray, None]:
+        """(layers, rows, cols) zone raster of a spatial key, None if no polygons intersect it."""
+        if (col, row) not in self.zones_by_key:
+            return None
+        return _cached_zones(self, col, row)
+
+    def rasterize(self, col: int, row: int) -> np.ndarray:
+        from affine import Affine
+        from rasterio.features import rasterize
+        from rasterio.enums import MergeAlg
+
+        tile_cols, tile_rows = self.tile_layout[2:]
+        xmin, ymin, xmax, ymax = self.key_bounds(col, row)
+        tile_transform = Affine((xmax - xmin) / tile_cols, 0.0, xmin, 0.0, -(ymax - ymin) / tile_rows, ymax)
+        shapes = [(zone, self.geometries[zone]) for zone in self.zones_by_key[(col, row)]]
+
+        def burn(values, **kwargs) -> np.ndarray:
+            # pixels are part of a polygon if their center is (like the GeoTrellis rasterizer)
+            return rasterize(values, out_shape=(tile_rows, tile_cols), transform=tile_transform, **kwargs)
+
+        zones = burn([(geometry, zone) for zone, geometry in shapes], fill=-1, dtype='int32')
+        coverage = burn([(geometry, 1) for _, geometry in shapes], fill=0, dtype='uint16', merge_alg=MergeAlg.add)
+        if coverage.max(initial=0) <= 1:
+            return zones[np.newaxis]
+
+        # overlapping polygons: add a layer whenever a polygon overlaps the ones in all existing layers
+        layers = []
+        for zone, geometry in shapes:
+            mask = burn([(geometry, 1)], fill=0, dtype='uint8').astype(bool)
+            layer = next((layer for layer in layers if (layer[mask] == -1).all()), None)
+            if layer is None:
+                layer = np.full((tile_rows, tile_cols), -1, dtype=np.int32)
+                layers.append(layer)
+            layer[mask] = zone
+        return np.stack(layers)
+
+    def __eq__(self, other):
+        return isinstance(other, ZoneRasterizer) and self.token == other.token
+
+    def __hash__(self):
+        return hash(self.token)
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_zones(rasterizer: ZoneRasterizer, col: int, row: int) -> np.ndarray:
+    return rasterizer.rasterize(col, row)
+
+
+def tile_statistics(rasterizer, distribution: bool, item) -> List[Tuple[Tuple[int, object], dict]]:
+    """
+    Partial statistics of a (SpaceTimeKey, Tile) for every zone in it: [((zone, instant), state)], preceded by a
+    ((-1, instant), None) marker so that dates without data for any zone are known as well.
+    """
+    key, tile = item
+    result = [((-1, key.instant), None)]
+    zones = rasterizer.value.zones(key.col, key.row)
+    if zones is None:
+        return result
+
+    cells = tile.cells.reshape((-1,) + tile.cells.shape[-2:])
+    bands = len(cells)
+    values = np.asarray(cells, dtype=np.float64).reshape((bands, -1))
+    valid = ~np.isnan(values)
+    no_data = tile.no_data_value
+    if no_data is not None and not np.isnan(no_data):
+        valid &= values != no_data
+    integer = bool(np.issubdtype(tile.cells.dtype, np.integer))
+
+    for layer in zones:
+        in_zone = layer.ravel() >= 0
+        zone_ids, local = np.unique(layer.ravel()[in_zone], return_inverse=True)
+        count = len(zone_ids)
+        if count == 0:
+            continue
+        ok = valid[:, in_zone]
+        # a bin per (band, zone)
+        bins = (np.arange(bands)[:, np.newaxis] * count + local.reshape(-1)[np.newaxis, :])[ok]
+        data = values[:, in_zone][ok]
+        states = _bin_statistics(bins, data, bands, count, distribution)
+        result.extend(((int(zone), key.instant), dict({name: stat[:, i] if name != "values" else stat[i]
+                                                       for name, stat in states.items()}, integer=integer))
+                      for i, zone in enumerate(zone_ids))
+    return result
+
+
+def _bin_statistics(bins: np.ndarray, data: np.ndarray, bands: int, zones: int, distribution: bool) -> dict:
+    size = bands * zones
+    count = np.bincount(bins, minlength=size)
+    total = np.bincount(bins, weights=data, minlength=size)
+    mean = np.divide(total, count, out=np.zeros(size), where=count > 0)
+    deviation = data - mean[bins]
+    m2 = np.bincount(bins, weights=deviation * deviation, minlength=size)
+    minimum = np.full(size, np.inf)
+    np.minimum.at(minimum, bins, data)
+    maximum = np.full(size, -np.inf)
+    np.maximum.at(maximum, bins, data)
+
+    def by_zone(stat: np.ndarray) -> np.ndarray:
+        # (bands, zones) so that a zone's state is a column
+        return stat.reshape((bands, zones))
+
+    states = {"count": by_zone(count), "mean": by_zone(mean), "m2": by_zone(m2),
+              "min": by_zone(minimum), "max": by_zone(maximum)}
+    if distribution:
+        # value counts per (band, zone): runs of equal (bin, value) pairs
+        order = np.lexsort((data, bins))
+        sorted_bins, sorted_data = bins[order], data[order]
+        starts = np.flatnonzero(np.r_[True, (np.diff(sorted_bins) != 0) | (np.diff(sorted_data) != 0)])
+        run_counts = np.diff(np.r_[starts, len(sorted_data)])
+        run_bins, run_values = sorted_bins[starts], sorted_data[starts]
+        bin_starts = np.searchsorted(run_bins, np.arange(size + 1))
+        states["values"] = [
+            [(run_values[bin_starts[b * zones + z]:bin_starts[b * zones + z + 1]],
+              run_counts[bin_starts[b * zones + z]:bin_starts[b * zones + z + 1]]) for b in range(bands)]
+            for z in range(zones)
+        ]
+    return states
+
+
+def merge(state: dict, other: dict) -> dict:
+    """Merge two partial statistics of a zone and date (the first one in place), or two markers (None)."""
+    if state is None:
+        return None
+    # parallel variant of Welford's algorithm (Chan et al.), see numpy_aggregators
+    count_a, count_b = state["count"], other["count"]
+    count = count_a + count_b
+    delta = other["mean"] - state["mean"]
+    weight_b = np.divide(count_b, count, out=np.zeros(count.shape), where=count > 0)
+    state["mean"] = state["mean"] + delta * weight_b
+    state["m2"] = state["m2"] + other["m2"] + delta * delta * count_a * weight_b
+    state["count"] = count
+    state["min"] = np.minimum(state["min"], other["min"])
+    state["max"] = np.maximum(state["max"], other["max"])
+    state["integer"] = state["integer"] and other["integer"]
+    if "values" in state:
+        state["values"] = [_merge_value_counts(a, b) for a, b in zip(state["values"], other["values"])]
+    return state
+
+
+def _merge_value_counts(a: Tuple[np.ndarray, np.ndarray], b: Tuple[np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+    values, inverse = np.unique(np.concatenate([a[0], b[0]]), return_inverse=True)
+    return values, np.bincount(inverse.reshape(-1), weights=np.concatenate([a[1], b[1]]),
+                               minlength=len(values)).astype(np.int64)
+
+
+def finish(func: str, state: dict) -> list:
+    """
+    Statistic per band: a float (NaN without valid pixels) or, for "histogram", a {value: count} dict (with int
+    values for integer tiles, like the GeoTrellis histograms).
+    """
+    count = state["count"]
+    has_data = count > 0
+    if func == "mean":
+        result = state["mean"]
+    elif func == "sd":
+        # population standard deviation (<=> np.nanstd)
+        result = np.sqrt(np.divide(state["m2"], count, out=np.zeros(count.shape), where=has_data))
+    elif func == "min":
+        result = state["min"]
+    elif func == "max":
+        result = state["max"]
+    elif func == "sum":
+        result = state["mean"] * count
+    elif func == "count":
+        return count.astype(float).tolist()
+    elif func == "histogram":
+        value_type = int if state["integer"] else float
+        return [{value_type(v): int(c) for v, c in zip(values, counts)} for values, counts in state["values"]]
+    elif func == "median":
+        result = np.array([_median(values, counts) for values, counts in state["values"]])
+    else:
+        raise ValueError(func)
+    return np.where(has_data, result, np.nan).tolist()
+
+
+def _median(values: np.ndarray, counts: np.ndarray) -> float:
+    """Median of values with repetition counts (<=> np.median of the repeated values)."""
+    total = counts.sum()
+    if total == 0:
+        return np.nan
+    cumulative = np.cumsum(counts)
+    lower = values[np.searchsorted(cumulative, (total - 1) // 2, side='right')]
+    upper = values[np.searchsorted(cumulative, total // 2, side='right')]
+    return (lower + upper) / 2
+
+
+def _isoformat(instant: datetime, utc_designator: bool = True) -> str:
+    if instant.tzinfo is not None:
+        instant = instant.astimezone(timezone.utc).replace(tzinfo=None)
+    return instant.isoformat() + ("Z" if utc_designator else "")
+
+
+def _row(func: str, utc_designator: bool, item) -> Tuple[Tuple[str, int], Union[list, None]]:
+    (zone, instant), state = item
+    return (_isoformat(instant, utc_designator), zone), None if state is None else finish(func, state)
+
+
+class ZonalStatistics:
+    """
+    Statistic per date, polygon and band of a spacetime layer: computed on the executors, and streamed to the
+    driver as rows sorted by date and polygon, a partition at a time.
+    """
+
+    def __init__(self, layer, geometries: List[BaseGeometry], func: str, utc_designator: bool = True):
+        """
+        :param layer: spacetime TiledRasterLayer
+        :param geometries: polygons, in the CRS of the layer
+        :param utc_designator: whether dates end with "Z"
+        """
+        if func not in FUNCS:
+            raise ValueError("Unsupported zonal statistic {f!r}, should be one of {s!r}".format(f=func, s=FUNCS))
+        self.layer = layer
+        self.geometries = geometries
+        self.func = func
+        self.utc_designator = utc_designator
+
+    def rows(self) -> Iterator[Tuple[str, int, list]]:
+        """(date, polygon index, statistic per band) tuples, dates as ISO 8601 (UTC) strings."""
+        return ((date, zone, values) for date, zone, values in self._rows() if zone >= 0)
+
+    def _rows(self) -> Iterator[Tuple[str, int, Union[list, None]]]:
+        """`rows`, with a (date, -1, None) row ahead of the rows of every date of the layer."""
+        layout = self.layer.layer_metadata.layout_definition
+        extent = (layout.extent.xmin, layout.extent.ymin, layout.extent.xmax, layout.extent.ymax)
+        tile_layout = (layout.tileLayout.layoutCols, layout.tileLayout.layoutRows,
+                       layout.tileLayout.tileCols, layout.tileLayout.tileRows)
+        # the index is built once and shipped once to every executor, where it is shared by all dates of a key
+        rasterizer = gps.get_spark_context().broadcast(ZoneRasterizer(self.geometries, extent, tile_layout))
+        distribution = self.func in DISTRIBUTION_FUNCS
+        try:
+            stats = self.layer.to_numpy_rdd() \
+                .flatMap(functools.partial(tile_statistics, rasterizer, distribution)) \
+                .reduceByKey(merge) \
+                .map(functools.partial(_row, self.func, self.utc_designator)) \
+                .sortByKey()
+            for (date, zone), values in stats.toLocalIterator():
+                yield date, zone, values
+        finally:
+            rasterizer.unpersist()
+
+    def timeseries(self) -> Dict[str, list]:
+        """
+        {date: [[statistic per band] per polygon]}, NaN (or an empty histogram) for polygons without data, and
+        no statistics ([]) for any polygon at dates without data for all of them.
+        """
+        empty = {} if self.func == "histogram" else np.nan
+        timeseries = {}
+        for date, zone, values in self._rows():
+            if zone < 0:
+                timeseries[date] = [[] for _ in self.geometries]
+                continue
+            by_zone = timeseries[date]
+            if not any(by_zone):
+                by_zone[:] = [[empty] * len(values) for _ in self.geometries]
+            by_zone[zone] = values
+        return timeseries
+
+    def csv_chunks(self, rows_per_chunk: int = 10000) -> Iterator[str]:
+        """
+        The rows as CSV (date, feature_index, band_0, band_1, ...), in chunks of text. Only polygons with data
+        at a date have a row, missing values are empty and histograms are JSON objects.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        header = False
+        for i, (date, zone, values) in enumerate(self.rows()):
+            if not header:
+                writer.writerow(["date", "feature_index"] + ["band_" + str(b) for b in range(len(values))])
+                header = True
+            writer.writerow([date, zone] + [_csv_value(v) for v in values])
+            if (i + 1) % rows_per_chunk == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if not header:
+            writer.writerow(["date", "feature_index"])
+        yield buffer.getvalue()
+
+    def write_csv(self, path: Union[str, Path]) -> str:
+        with open(str(path), 'w', newline='') as f:
+            for chunk in self.csv_chunks():
+                f.write(chunk)
+        return str(path)
+
+
+def _csv_value(value) -> str:
+    if isinstance(value, dict):
+        return json.dumps(value, separators=(',', ':'))
+    return "" if np.isnan(value) else repr(float(value))
+
+
+class ZonalStatisticsResult(AggregatePolygonResult):
+    """
+    AggregatePolygonResult that only computes (and keeps) its timeseries when they are needed: in CSV format,
+    they are streamed in chunks instead.
+    """
+
+    def __init__(self, statistics: ZonalStatistics, regions):
+        self._statistics = statistics
+        self._timeseries = None
+        super().__init__(timeseries=None, regions=regions)
+
+    @property
+    def data(self) -> Dict[str, list]:
+        if self._timeseries is None:
+            self._timeseries = self._statistics.timeseries()
+        return self._timeseries
+
+    @data.setter
+    def data(self, timeseries: Dict[str, list]):
+        self._timeseries = timeseries
+
+    def is_csv(self) -> bool:
+        return (getattr(self, "format", None) or "").lower() == "csv"
+
+    def write_csv(self, path: Union[str, Path]) -> str:
+        return self._statistics.write_csv(path)
+
+    def create_flask_response(self):
+        if self.is_csv():
+            from flask import Response
+            return Response(self._statistics.csv_chunks(), mimetype="text/csv")
+        return super().create_flask_response()
@@ -50,8 +50,12 @@ setup(
         'kazoo==2.4.0',
         'flask-cors',
         'rasterio==1.1.1',
+        'pyproj>=2.2.0',
         'pydantic',
-        'h5netcdf'
+        'h5netcdf',
+        'h5py>=2.9',
+        'zarr>=2.4.0,<3.0.0',
+        'pyarrow>=0.15.0'
     ],
     extras_require={
         "dev": tests_require,
@@ -4,6 +4,7 @@ from openeogeotrellis.geotrellis_tile_processgraph_visitor import GeotrellisTile
 from .data import get_test_data_file
 
 import numpy as np
+import pytest
 from numpy.testing import assert_array_almost_equal
 
 def test_apply_neighborhood_no_overlap(imagecollection_with_two_bands_and_three_dates):
@@ -38,4 +39,172 @@ def test_apply_neighborhood_overlap_udf(imagecollection_with_two_bands_and_three
     result_array = result.pyramid.levels[0].to_spatial_layer(datetime.datetime(2017, 9, 25, 11, 37)).stitch().cells
 
     subresult = result_array[:input.shape[0], :input.shape[1], :input.shape[2]]
-    assert_array_almost_equal(input,subresult)
\ No newline at end of file
+    assert_array_almost_equal(input,subresult)
+
+def test_apply_neighborhood_small_window_udf(imagecollection_with_two_bands_and_three_dates, udf_noop):
+    input = imagecollection_with_two_bands_and_three_dates.pyramid.levels[0].to_spatial_layer(datetime.datetime(2017, 9, 25, 11, 37)).stitch().cells
+    result = imagecollection_with_two_bands_and_three_dates.apply_neighborhood(process=udf_noop,size=[{'dimension':'x','unit':'px','value':5},{'dimension':'y','unit':'px','value':5}],overlap=[{'dimension':'x','unit':'px','value':3},{'dimension':'y','unit':'px','value':3}])
+    result_array = result.pyramid.levels[0].to_spatial_layer(datetime.datetime(2017, 9, 25, 11, 37)).stitch().cells
+    assert_array_almost_equal(input, result_array)
+
+
+def test_apply_neighborhood_batched_udf(imagecollection_with_two_bands_and_three_dates):
+    udf_code = """
+from typing import Dict
+from openeo_udf.api.datacube import DataCube
+
+def apply_datacube_batch(cube: DataCube, context: Dict) -> DataCube:
+    # all 4 windows of a tile at once
+    assert cube.get_array().shape == (4, 2, 2, 2)
+    return DataCube(cube.get_array() * 2)
+"""
+    udf_callback = {
+        "udf_process": {
+            "arguments": {"data": {"from_argument": "dimension_data"}, "udf": udf_code},
+            "process_id": "run_udf",
+            "result": True
+        }
+    }
+    input = imagecollection_with_two_bands_and_three_dates.pyramid.levels[0].to_spatial_layer(datetime.datetime(2017, 9, 25, 11, 37)).stitch().cells
+    result = imagecollection_with_two_bands_and_three_dates.apply_neighborhood(process=udf_callback,size=[{'dimension':'x','unit':'px','value':2},{'dimension':'y','unit':'px','value':2},{'dimension':'t','value':"P1D"}],overlap=[])
+    result_array = result.pyramid.levels[0].to_spatial_layer(datetime.datetime(2017, 9, 25, 11, 37)).stitch().cells
+    assert_array_almost_equal(input * 2, result_array)
+
+
+def _apply_windows_to_tiles(full, tile_size, function, size_x, size_y, overlap_x, overlap_y):
+    """Apply a function to the windows of an array, split in tiles that are extended with a halo first."""
+    from geopyspark import SpatialKey, Tile
+    from openeogeotrellis.neighborhood import apply_windows, border_strips, halo_size, with_halo
+
+    halo_x, halo_y = halo_size(size_x, overlap_x, tile_size), halo_size(size_y, overlap_y, tile_size)
+    rows, cols = full.shape[-2] // tile_size, full.shape[-1] // tile_size
+    tiles = {SpatialKey(col, row): Tile(full[:, row * tile_size:(row + 1) * tile_size,
+                                             col * tile_size:(col + 1) * tile_size], 'float64', None)
+             for row in range(rows) for col in range(cols)}
+    strips = {}
+    for item in tiles.items():
+        for key, strip in border_strips(halo_x, halo_y, item):
+            strips.setdefault(key, []).append(strip)
+
+    result = np.full(full.shape, np.nan)
+    for key, tile in tiles.items():
+        halo = with_halo(halo_x, halo_y, tile, strips.get(key, []))
+        assert halo.cells.shape == (full.shape[0], tile_size + 2 * halo_y, tile_size + 2 * halo_x)
+        result[:, key.row * tile_size:(key.row + 1) * tile_size, key.col * tile_size:(key.col + 1) * tile_size] = \
+            apply_windows(halo.cells, function, size_x, size_y, overlap_x, overlap_y, halo_x, halo_y,
+                          offset_x=key.col * tile_size, offset_y=key.row * tile_size)
+    return result
+
+
+def test_halo_exchange_sparse_layer():
+    from geopyspark import SpatialKey, Tile
+    from pyspark import SparkContext
+    from openeogeotrellis.neighborhood import halo_exchange, with_halo
+
+    full = np.arange(2 * 12 * 16, dtype=np.float64).reshape((2, 12, 16))
+    tiles = {SpatialKey(col, row): Tile(full[:, row * 4:(row + 1) * 4, col * 4:(col + 1) * 4], 'float64', None)
+             for row in range(3) for col in range(4) if (col, row) != (1, 1)}
+
+    halos = dict(halo_exchange(SparkContext.getOrCreate().parallelize(list(tiles.items()), 3), 2, 1).collect())
+
+    # only the tiles, no keys of the strips beyond the edges or of the missing tile
+    assert set(halos.keys()) == set(tiles.keys())
+    # the halo of the missing tile is no data (NaN)
+    padded = np.pad(full, ((0, 0), (1, 1), (2, 2)), constant_values=np.nan)
+    padded[:, 1 + 4:1 + 8, 2 + 4:2 + 8] = np.nan
+    for key, tile in tiles.items():
+        assert_array_almost_equal(padded[:, key.row * 4:key.row * 4 + 6, key.col * 4:key.col * 4 + 8],
+                                  halos[key].cells)
+
+
+def test_halo_windows_match_full_array():
+    full = np.arange(2 * 16 * 24, dtype=np.float64).reshape((2, 16, 24))
+
+    def box_sum(window):
+        # 5 (x) by 3 (y) sum, NaN for pixels that need data outside of the window
+        result = np.full(window.shape, np.nan)
+        for r in range(1, window.shape[-2] - 1):
+            for c in range(2, window.shape[-1] - 2):
+                result[:, r, c] = window[:, r - 1:r + 2, c - 2:c + 3].sum(axis=(-2, -1))
+        return result
+
+    expected = box_sum(np.pad(full, ((0, 0), (1, 1), (2, 2)), constant_values=np.nan))[:, 1:-1, 2:-2]
+    assert_array_almost_equal(expected, _apply_windows_to_tiles(full, 8, box_sum, size_x=3, size_y=5,
+                                                                overlap_x=2, overlap_y=1))
+
+
+@pytest.mark.parametrize(["size", "calls"], [
+    (8, 4),  # as large as the tiles: every window is evaluated once
+    (4, 16),
+    (16, 4),  # a single window spanning 4 tiles, evaluated once per tile
+    (12, 9),  # 4 windows: 1 within a tile, 2 spanning 2 tiles and 1 spanning 4 tiles
+])
+def test_windows_spanning_tiles_are_evaluated_per_tile(size, calls):
+    full = np.arange(16 * 16, dtype=np.float64).reshape((1, 16, 16))
+    windows = []
+
+    def record(window):
+        windows.append(window)
+        return window
+
+    assert_array_almost_equal(full, _apply_windows_to_tiles(full, 8, record, size, size, 0, 0))
+    assert len(windows) == calls
+
+
+@pytest.mark.parametrize(["size_x", "size_y", "overlap_x", "overlap_y"], [
+    (3, 5, 2, 1),  # not a divisor of the tile size
+    (12, 20, 1, 9),  # larger than the tile size, overlap too
+    (8, 4, 0, 0),
+])
+def test_windows_on_layer_grid(size_x, size_y, overlap_x, overlap_y):
+    full = np.arange(16 * 24, dtype=np.float64).reshape((1, 16, 24))
+    padded = np.pad(full, ((0, 0), (overlap_y, overlap_y + size_y), (overlap_x, overlap_x + size_x)),
+                    constant_values=np.nan)
+
+    def window_origin(window):
+        # every pixel of a window gets the value of the first pixel of its core
+        assert window.shape[-2:] == (size_y + 2 * overlap_y, size_x + 2 * overlap_x)
+        return np.full(window.shape, window[:, overlap_y, overlap_x])
+
+    def window_sum(window):
+        return np.full(window.shape, np.nansum(window))
+
+    rows, cols = np.indices(full.shape[-2:])
+    origins = full[:, rows // size_y * size_y, cols // size_x * size_x]
+    sums = np.array([[[np.nansum(padded[:, r:r + size_y + 2 * overlap_y, c:c + size_x + 2 * overlap_x])
+                      for c in cols[0] // size_x * size_x] for r in rows[:, 0] // size_y * size_y]])
+
+    assert_array_almost_equal(origins, _apply_windows_to_tiles(full, 8, window_origin, size_x, size_y,
+                                                               overlap_x, overlap_y))
+    assert_array_almost_equal(sums, _apply_windows_to_tiles(full, 8, window_sum, size_x, size_y,
+                                                            overlap_x, overlap_y))
+
+
+def test_apply_neighborhood_temporal_windows_udf(imagecollection_with_two_bands_and_three_dates, udf_noop):
+    input = imagecollection_with_two_bands_and_three_dates.pyramid.levels[0].to_spatial_layer(datetime.datetime(2017, 9, 25, 11, 37)).stitch().cells
+    result = imagecollection_with_two_bands_and_three_dates.apply_neighborhood(process=udf_noop,size=[{'dimension':'x','unit':'px','value':32},{'dimension':'y','unit':'px','value':32},{'dimension':'t','value':"P3D"}],overlap=[{'dimension':'t','value':"P5D"}])
+    result_array = result.pyramid.levels[0].to_spatial_layer(datetime.datetime(2017, 9, 25, 11, 37)).stitch().cells
+    assert_array_almost_equal(input, result_array)
+
+
+def test_temporal_windows():
+    import pandas as pd
+    from openeogeotrellis.GeotrellisImageCollection import GeotrellisTimeSeriesImageCollection
+
+    dates = pd.DatetimeIndex(["2020-01-01", "2020-01-05", "2020-01-12", "2020-02-20"])
+    windows = GeotrellisTimeSeriesImageCollection._temporal_windows(
+        dates, pd.Timestamp("2020-01-01"), pd.Timedelta(days=10), pd.Timedelta(days=3))
+
+    assert [(w.start, w.stop, str(start.date())) for w, start, _ in windows] == [
+        (0, 3, "2020-01-01"), (2, 3, "2020-01-11"), (3, 4, "2020-02-20")]
+
+
+def test_parse_duration():
+    import pandas as pd
+    from openeo_driver.errors import OpenEOApiException
+    from openeogeotrellis.GeotrellisImageCollection import GeotrellisTimeSeriesImageCollection
+
+    assert GeotrellisTimeSeriesImageCollection._parse_duration({'value': 'P30D'}) == pd.Timedelta(days=30)
+    assert GeotrellisTimeSeriesImageCollection._parse_duration({'value': 'P1WT12H'}) == pd.Timedelta(days=7, hours=12)
+    with pytest.raises(OpenEOApiException):
+        GeotrellisTimeSeriesImageCollection._parse_duration({'value': 'P1M'})
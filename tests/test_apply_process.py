@@ -161,6 +161,44 @@ class TestCustomFunctions(TestCase):
         np.testing.assert_array_almost_equal(data[0, 2:6, 2:6], np.cos(self.first[0]))
         np.testing.assert_array_almost_equal(data[1, 2:6, 2:6], np.cos(self.second[0]))
 
+    def test_apply_to_levels_only_builds_used_levels(self):
+        input = self.create_spacetime_layer()
+        cube = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: input, 1: input}), InMemoryServiceRegistry())
+        converted = []
+
+        def to_float(layer):
+            converted.append(layer)
+            return layer.convert_data_type("float32")
+
+        res = cube.apply_to_levels(to_float).apply("cos")
+        self.assertEqual(0, len(converted))
+
+        data = res._max_level().to_spatial_layer().stitch().cells
+        self.assertEqual(1, len(converted))
+        np.testing.assert_array_almost_equal(data[0, 2:6, 2:6], np.cos(self.first[0]))
+
+        self.assertEqual([0, 1], sorted(res.pyramid.levels))
+        self.assertEqual(2, len(converted))
+
+    def test_apply_to_levels_builds_shared_operations_once(self):
+        input = self.create_spacetime_layer()
+        cube = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: input}), InMemoryServiceRegistry())
+        converted = []
+
+        def to_float(layer):
+            converted.append(layer)
+            return layer.convert_data_type("float32")
+
+        floats = cube.apply_to_levels(to_float)
+        cos = floats.apply("cos")
+        sin = floats.apply("sin")
+
+        cos_data = cos._max_level().to_spatial_layer().stitch().cells
+        sin_data = sin._max_level().to_spatial_layer().stitch().cells
+        self.assertEqual(1, len(converted))
+        np.testing.assert_array_almost_equal(cos_data[0, 2:6, 2:6], np.cos(self.first[0]))
+        np.testing.assert_array_almost_equal(sin_data[0, 2:6, 2:6], np.sin(self.first[0]))
+
     def test_apply_complex_graph(self):
         graph = {
             "sin": {
@@ -294,6 +332,25 @@ class TestCustomFunctions(TestCase):
         print(stitched)
         self.assertEqual(1, stitched.cells[0][0][0])
 
+    def test_reduce_bands_fused(self):
+        input = self.create_spacetime_layer_singleband()
+        input = gps.Pyramid({0: input})
+
+        imagecollection = GeotrellisTimeSeriesImageCollection(input, InMemoryServiceRegistry())
+
+        gt = GeotrellisTileProcessGraphVisitor().accept_process_graph({
+            "gt": {"arguments": {"x": {"from_argument": "data"}, "y": 6.0}, "process_id": "gt", "result": True}
+        })
+        negate = GeotrellisTileProcessGraphVisitor().accept_process_graph({
+            "not": {"arguments": {"expression": {"from_argument": "data"}}, "process_id": "not", "result": True}
+        })
+        result = imagecollection.reduce_bands(gt).reduce_bands(negate)
+        self.assertEqual(2, len(result._pending))
+
+        stitched = result.pyramid.levels[0].to_spatial_layer().stitch()
+        self.assertEqual([], result._pending)
+        self.assertEqual(0, stitched.cells[0][0][0])
+
     def test_reduce_bands_arrayelement(self):
         input = self.create_spacetime_layer()
         input = gps.Pyramid({0: input})
@@ -529,5 +586,41 @@ class TestCustomFunctions(TestCase):
         stitched = sum.pyramid.levels[0].to_spatial_layer().stitch()
 
         np.testing.assert_array_equal(red_ramp, stitched.cells[0, 0:4, 0:4])        
-        np.testing.assert_array_equal(nir_ramp, stitched.cells[1, 0:4, 0:4])        
-        
\ No newline at end of file
+        np.testing.assert_array_equal(nir_ramp, stitched.cells[1, 0:4, 0:4])
+
+
+def test_fuse_process_graphs():
+    from openeogeotrellis.geotrellis_tile_processgraph_visitor import fuse_process_graphs
+
+    scale = {"scale": {"process_id": "multiply", "arguments": {"x": {"from_parameter": "x"}, "y": 2}, "result": True}}
+    ndvi = {
+        "red": {"process_id": "array_element", "arguments": {"data": {"from_parameter": "data"}, "index": 0}},
+        "nir": {"process_id": "array_element", "arguments": {"data": {"from_parameter": "data"}, "index": 1}},
+        "ndvi": {"process_id": "normalized_difference", "arguments": {"x": {"from_node": "nir"}, "y": {"from_node": "red"}},
+                 "result": True},
+    }
+
+    assert fuse_process_graphs([scale, ndvi]) == {
+        "0_scale": {"process_id": "multiply", "arguments": {"x": {"from_parameter": "x"}, "y": 2}},
+        "1_red": {"process_id": "array_element", "arguments": {"data": {"from_node": "0_scale"}, "index": 0}},
+        "1_nir": {"process_id": "array_element", "arguments": {"data": {"from_node": "0_scale"}, "index": 1}},
+        "1_ndvi": {"process_id": "normalized_difference",
+                   "arguments": {"x": {"from_node": "1_nir"}, "y": {"from_node": "1_red"}}, "result": True},
+    }
+    assert "result" in scale["scale"]
+
+    apply = {"apply": {"process_id": "apply", "arguments": {"process": {"process_graph": scale}}, "result": True}}
+    assert fuse_process_graphs([scale, apply]) is None
+
+
+def test_fuse_process_graphs_other_parameter():
+    from openeogeotrellis.geotrellis_tile_processgraph_visitor import fuse_process_graphs
+
+    scale = {"scale": {"process_id": "multiply", "arguments": {"x": {"from_parameter": "x"}, "y": 2}, "result": True}}
+    offset = {"offset": {"process_id": "add",
+                         "arguments": {"x": {"from_parameter": "x"}, "y": {"from_parameter": "context"}},
+                         "result": True}}
+
+    # "context" is a parameter of the second graph, not the result of the first one
+    assert fuse_process_graphs([scale, offset]) is None
+    assert fuse_process_graphs([offset, scale]) is None
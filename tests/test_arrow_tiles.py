@@ -0,0 +1,62 @@
+import datetime
+import unittest.mock as mock
+
+import numpy as np
+from geopyspark import SpaceTimeKey, SpatialKey, Tile
+from py4j.java_gateway import JavaClass
+
+from openeogeotrellis import arrow_tiles
+
+
+def test_encode_decode():
+    items = [
+        (SpaceTimeKey(1, 2, datetime.datetime(2017, 8, 24, 9)),
+         Tile(np.arange(12, dtype=np.float32).reshape((1, 3, 4)), 'FLOAT', np.nan)),
+        (SpaceTimeKey(3, 4, datetime.datetime(2018, 1, 1)),
+         Tile(np.arange(24, dtype=np.int16).reshape((2, 3, 4)), 'SHORT', -1)),
+        (SpatialKey(5, 6), Tile(np.ones((1, 3, 4), dtype=np.uint8), 'UBYTE', None)),
+    ]
+
+    streams = list(arrow_tiles.encode(items, tiles_per_batch=2))
+    assert len(streams) == 2
+
+    decoded = [item for stream in streams for item in arrow_tiles.decode(stream)]
+    assert [key for key, _ in decoded] == [key for key, _ in items]
+    for (_, tile), (_, decoded_tile) in zip(items, decoded):
+        np.testing.assert_array_equal(tile.cells, decoded_tile.cells)
+        assert decoded_tile.cells.dtype == tile.cells.dtype
+        assert decoded_tile.cell_type == tile.cell_type
+        np.testing.assert_equal(decoded_tile.no_data_value, tile.no_data_value)
+
+
+def test_decode_writable_cells():
+    stream = bytes(next(arrow_tiles.encode([(SpatialKey(0, 0), Tile(np.zeros((1, 2, 2), dtype=np.float32), 'FLOAT',
+                                                                     None))])))
+
+    (_, tile), = arrow_tiles.decode(stream)
+
+    # like the geopyspark tiles, UDFs and tile functions can modify the cells in place
+    assert tile.cells.flags.writeable
+    tile.cells[0, 0, 0] = 1.0
+    assert tile.cells[0, 0, 0] == 1.0
+
+
+def test_negotiate_without_jvm_transport():
+    sc = mock.Mock()  # no JavaClass: the class is missing on the JVM
+    layer = mock.Mock(pysc=sc)
+
+    assert arrow_tiles.jvm_transport(sc) is None
+    assert arrow_tiles.to_numpy_rdd(layer) is layer.to_numpy_rdd.return_value
+
+
+def test_negotiate_schema_version():
+    transport = mock.Mock(spec=JavaClass)
+    sc = mock.Mock()
+    sc._jvm.org.openeo.geotrellis.arrow.ArrowTileTransport = transport
+
+    transport.schemaVersion.return_value = arrow_tiles.SCHEMA_VERSION + 1
+    assert arrow_tiles.jvm_transport(sc) is None
+
+    arrow_tiles._negotiate.cache_clear()
+    transport.schemaVersion.return_value = arrow_tiles.SCHEMA_VERSION
+    assert arrow_tiles.jvm_transport(sc) is transport
@@ -84,3 +84,49 @@ def test_extract_application_id():
 19/07/10 15:58:11 INFO Client: Application report for application_1562328661428_5542 (state: RUNNING)
     """
     assert GpsBatchJobs._extract_application_id(yarn_log) == "application_1562328661428_5542"
+
+
+def test_job_result_files(tmp_path):
+    (tmp_path / "out").touch()
+    assert GpsBatchJobs._job_result_files(tmp_path) == {"out": str(tmp_path)}
+
+    # distributed NetCDF: the parts have to travel with the aggregate file
+    (tmp_path / "out.parts").mkdir()
+    (tmp_path / "out.parts" / "20170824T090000.h5").touch()
+    assert GpsBatchJobs._job_result_files(tmp_path) == {
+        "out": str(tmp_path),
+        "out.parts/20170824T090000.h5": str(tmp_path),
+    }
+
+
+def test_job_result_files_npy(tmp_path):
+    # JSON with the "npy" data encoding: "out" refers to the data in "out.npy"
+    (tmp_path / "out").touch()
+    (tmp_path / "out.npy").touch()
+    assert GpsBatchJobs._job_result_files(tmp_path) == {"out": str(tmp_path), "out.npy": str(tmp_path)}
+
+
+def test_job_result_files_geotiff_per_date(tmp_path):
+    # the "out" index refers to the GeoTIFFs per date next to it
+    (tmp_path / "out").touch()
+    (tmp_path / "out_20170824T090000Z.tif").touch()
+    (tmp_path / "out_20170825T090000Z.tif").touch()
+    (tmp_path / "log").touch()
+    assert GpsBatchJobs._job_result_files(tmp_path) == {
+        "out": str(tmp_path),
+        "out_20170824T090000Z.tif": str(tmp_path),
+        "out_20170825T090000Z.tif": str(tmp_path),
+    }
+
+
+def test_job_result_files_zarr(tmp_path):
+    # a Zarr store is a directory: its files are the results
+    (tmp_path / "out" / "band_0").mkdir(parents=True)
+    (tmp_path / "out" / ".zgroup").touch()
+    (tmp_path / "out" / "band_0" / ".zarray").touch()
+    (tmp_path / "out" / "band_0" / "0.0.0").touch()
+    assert GpsBatchJobs._job_result_files(tmp_path) == {
+        "out/.zgroup": str(tmp_path),
+        "out/band_0/.zarray": str(tmp_path),
+        "out/band_0/0.0.0": str(tmp_path),
+    }
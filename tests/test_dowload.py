@@ -4,6 +4,7 @@ from unittest import TestCase,skip
 
 import geopyspark as gps
 import numpy as np
+import pytest
 from geopyspark.geotrellis import (SpaceTimeKey, Tile, _convert_to_unix_time)
 from geopyspark.geotrellis.constants import LayerType
 from geopyspark.geotrellis.layer import TiledRasterLayer
@@ -167,6 +168,151 @@ class TestDownload(TestCase):
     def test_download_masked_json_reproject(self):
         self.download_masked_reproject('json')
 
+    def test_download_netcdf_distributed(self):
+        input = self.create_spacetime_layer()
+        imagecollection = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: input}), InMemoryServiceRegistry())
+        imagecollection.metadata=imagecollection.metadata.add_dimension('band_one', 'band_one', 'bands')
+        imagecollection.metadata=imagecollection.metadata.append_band(Band('band_two','',''))
+
+        collected = imagecollection.download(str(self.temp_folder / "test_download_collected.nc"), format="netcdf")
+        distributed = imagecollection.download(str(self.temp_folder / "test_download_distributed.nc"),
+                                               format="netcdf", parameters={"distributed": True})
+        assert (self.temp_folder / "test_download_distributed.nc.parts").is_dir()
+        import h5py
+        with h5py.File(distributed, "r") as f:
+            assert f.attrs["parts_directory"] == "test_download_distributed.nc.parts"
+
+        import xarray as xr
+        expected = xr.open_dataset(collected, engine='h5netcdf')
+        actual = xr.open_dataset(distributed, engine='h5netcdf')
+        assert list(actual.data_vars) == ['band_one', 'band_two']
+        assert actual['band_one'].dims == ('t', 'y', 'x')
+        np.testing.assert_array_equal(actual['band_one'].values, expected['band_one'].values)
+        np.testing.assert_array_equal(actual['band_two'].values, expected['band_two'].values)
+        np.testing.assert_array_equal(actual['x'].values, expected['x'].values)
+        np.testing.assert_array_equal(actual['t'].values, expected['t'].values)
+
+    def test_download_zarr(self):
+        input = self.create_spacetime_layer()
+        imagecollection = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: input}), InMemoryServiceRegistry())
+        imagecollection.metadata=imagecollection.metadata.add_dimension('band_one', 'band_one', 'bands')
+        imagecollection.metadata=imagecollection.metadata.append_band(Band('band_two','',''))
+
+        result = imagecollection.download(str(self.temp_folder / "test_download_result.zarr"), format="zarr")
+
+        import zarr
+        group = zarr.open_consolidated(result)
+        assert group['band_one'].shape == (1, 8, 8)
+        assert group['band_one'].chunks == (1, 4, 4)
+        assert group['band_one'].attrs['_ARRAY_DIMENSIONS'] == ['t', 'y', 'x']
+        np.testing.assert_array_equal(group['band_one'][:], np.ones((1, 8, 8)))
+        np.testing.assert_array_equal(group['band_two'][:], np.full((1, 8, 8), 2))
+        assert group['x'][0] == 0.25
+
+    def test_download_zarr_band_names_out_of_sync(self):
+        input = self.create_spacetime_layer()
+        imagecollection = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: input}), InMemoryServiceRegistry())
+        imagecollection.metadata=imagecollection.metadata.add_dimension('band_one', 'band_one', 'bands')
+
+        result = imagecollection.download(str(self.temp_folder / "test_download_out_of_sync.zarr"), format="zarr")
+
+        import zarr
+        group = zarr.open_consolidated(result)
+        np.testing.assert_array_equal(group['band_0'][:], np.ones((1, 8, 8)))
+        np.testing.assert_array_equal(group['band_1'][:], np.full((1, 8, 8), 2))
+
+    def test_download_geotiff_per_date(self):
+        input = self.create_spacetime_layer()
+        imagecollection = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: input}), InMemoryServiceRegistry())
+        imagecollection.metadata=imagecollection.metadata.add_dimension('band_one', 'band_one', 'bands')
+        imagecollection.metadata=imagecollection.metadata.append_band(Band('band_two','',''))
+
+        filename = imagecollection.download(str(self.temp_folder / "test_download_result.json"), format="GTIFF",
+                                            parameters={"multi_date": True})
+
+        import json
+        import rasterio
+        with open(filename) as f:
+            index = json.load(f)
+        assert index["type"] == "FeatureCollection"
+        assert len(index["features"]) == 1
+        item = index["features"][0]
+        assert item["id"] == "test_download_result_20170925T113700Z"
+        assert item["properties"]["datetime"] == "2017-09-25T11:37:00Z"
+        assert item["bbox"] == pytest.approx([0.0, 0.0, 4.0, 4.0])
+        href = item["assets"]["image"]["href"]
+        assert href == "test_download_result_20170925T113700Z.tif"
+
+        with rasterio.open(str(self.temp_folder / href)) as dataset:
+            assert dataset.count == 2
+            assert (dataset.width, dataset.height) == (8, 8)
+            assert dataset.descriptions == ('band_one', 'band_two')
+            assert dataset.transform.c == 0.0 and dataset.transform.f == 4.0
+            np.testing.assert_array_equal(dataset.read(1), np.ones((8, 8)))
+            np.testing.assert_array_equal(dataset.read(2), np.full((8, 8), 2))
+
+    def test_download_json_data_encodings(self):
+        input = self.create_spacetime_layer()
+        imagecollection = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: input}), InMemoryServiceRegistry())
+        imagecollection.metadata=imagecollection.metadata.add_dimension('band_one', 'band_one', 'bands')
+        imagecollection.metadata=imagecollection.metadata.append_band(Band('band_two','',''))
+
+        import base64
+        import json
+        results = {}
+        for data_encoding in ["list", "base64", "npy"]:
+            filename = imagecollection.download(str(self.temp_folder / "test_download_result.{e}.json".format(e=data_encoding)),
+                                                format="json", parameters={"data_encoding": data_encoding})
+            with open(filename) as f:
+                results[data_encoding] = json.load(f)
+
+        as_list = results["list"]
+        assert as_list["dims"] == ['t', 'bands', 'x', 'y']
+        assert as_list["attrs"]["shape"] == [1, 2, 8, 8]
+        assert as_list["coords"]["bands"]["data"] == ['band_one', 'band_two']
+        expected = np.array(as_list["data"])
+        assert expected.shape == (1, 2, 8, 8)
+
+        as_base64 = results["base64"]
+        assert as_base64["attrs"]["encoding"] == "base64"
+        date = np.frombuffer(base64.b64decode(as_base64["data"][0]), dtype=as_base64["attrs"]["dtype"])
+        np.testing.assert_array_equal(date.reshape(as_base64["attrs"]["shape"][1:]), expected[0])
+
+        as_npy = results["npy"]
+        np.testing.assert_array_equal(np.load(str(self.temp_folder / as_npy["data"])), expected)
+
+    def test_download_as_catalog_parallel_geotiff(self):
+        cells = np.array([np.full((16, 16), 1), np.full((16, 16), 2)], dtype='int32')
+        tile = Tile.from_numpy_array(cells, -1)
+        layer = [(gps.SpatialKey(0, 0), tile), (gps.SpatialKey(1, 0), tile), (gps.SpatialKey(1, 1), tile)]
+        rdd = SparkContext.getOrCreate().parallelize(layer)
+        metadata = {'cellType': 'int32ud-1',
+                    'extent': self.extent,
+                    'crs': '+proj=longlat +datum=WGS84 +no_defs ',
+                    'bounds': {'minKey': {'col': 0, 'row': 0}, 'maxKey': {'col': 1, 'row': 1}},
+                    'layoutDefinition': {
+                        'extent': self.extent,
+                        'tileLayout': {'layoutCols': 2, 'layoutRows': 2, 'tileCols': 16, 'tileRows': 16}
+                    }
+                    }
+        input = TiledRasterLayer.from_numpy_rdd(LayerType.SPATIAL, rdd, metadata)
+        imagecollection = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: input}), InMemoryServiceRegistry())
+
+        filename = str(self.temp_folder / "test_download_catalog.tiff")
+        imagecollection.download(filename, format="GTIFF", parameters={"catalog": True})
+
+        import rasterio
+        with rasterio.open(filename) as dataset:
+            assert dataset.count == 2
+            assert (dataset.width, dataset.height) == (32, 32)
+            assert dataset.block_shapes[0] == (16, 16)
+            assert dataset.crs.to_epsg() == 4326
+            assert dataset.transform.c == 0.0 and dataset.transform.f == 4.0
+            data = dataset.read()
+        assert data[0, 0, 0] == 1
+        assert data[1, 31, 31] == 2
+        # missing tile (0, 1) is sparse
+        assert data[0, 31, 0] == -1
 
     #skipped because gdal_merge.py is not available on jenkins and Travis
     @skip
@@ -0,0 +1,75 @@
+import unittest.mock as mock
+
+from openeo_driver import ProcessGraphDeserializer
+
+from openeogeotrellis.GeotrellisImageCollection import GeotrellisTimeSeriesImageCollection
+from openeogeotrellis.evaluation_cache import reuse_results, _Evaluation
+from openeogeotrellis.service_registry import InMemoryServiceRegistry
+
+
+def _load_collection(collection_id: str) -> dict:
+    return {"process_id": "load_collection", "arguments": {"id": collection_id}}
+
+
+def _merge_cubes(*cubes) -> dict:
+    """Dereferenced merge_cubes node of (node id, node) tuples."""
+    return {"process_id": "merge_cubes", "arguments": {"cubes": [
+        {"from_node": node_id, "node": node} for node_id, node in cubes
+    ]}, "result": True}
+
+
+def test_reuse_results():
+    layer = mock.Mock()
+    evaluated = []
+
+    def convert_node(process_graph, viewing_parameters=None):
+        evaluated.append(process_graph["process_id"])
+        if process_graph["process_id"] == "load_collection":
+            return GeotrellisTimeSeriesImageCollection(mock.Mock(levels={0: layer}, max_zoom=0),
+                                                       InMemoryServiceRegistry())
+        return [ProcessGraphDeserializer.convert_node(argument["node"], viewing_parameters)
+                for argument in process_graph["arguments"]["cubes"]]
+
+    foo = _load_collection("FOO")
+    merge_cubes = _merge_cubes(("loadcollection1", foo), ("loadcollection1", foo),
+                               ("loadcollection2", _load_collection("BAR")))
+
+    with mock.patch.object(ProcessGraphDeserializer, "convert_node", convert_node):
+        with reuse_results():
+            foo1, foo2, bar = ProcessGraphDeserializer.convert_node(merge_cubes, {"version": "1.0.0"})
+
+            # a node that is referred to twice is evaluated once, but every consumer gets its own collection
+            assert evaluated == ["merge_cubes", "load_collection", "load_collection"]
+            assert foo1 is not foo2
+            assert foo1._max_level() is foo2._max_level()
+            layer.persist.assert_called_once()
+
+            # with other viewing parameters, it is evaluated again
+            ProcessGraphDeserializer.convert_node(foo, {"version": "0.4.0"})
+            assert evaluated.count("load_collection") == 3
+            layer.unpersist.assert_not_called()
+
+        layer.unpersist.assert_called_once()
+        # only the evaluations within the context reuse results
+        assert ProcessGraphDeserializer.convert_node is convert_node
+
+
+def test_node_keys():
+    evaluation = _Evaluation()
+    foo = _load_collection("FOO")
+    merge_cubes = _merge_cubes(("loadcollection1", foo), ("loadcollection2", _load_collection("FOO")),
+                               ("loadcollection3", _load_collection("BAR")))
+
+    key = evaluation.node_key(merge_cubes)
+    assert evaluation.node_key(merge_cubes) == key
+
+    # the nodes that it refers to have their key already, with their node ids
+    foo1, foo2, bar = (argument["node"] for argument in merge_cubes["arguments"]["cubes"])
+    keys = [evaluation.node_key(node) for node in (foo1, foo2, bar)]
+    assert len(set(keys)) == 3
+    assert _Evaluation().node_key(foo, "loadcollection1") == keys[0]
+
+    # a node with other arguments has another key
+    other = _merge_cubes(("loadcollection1", _load_collection("FOO")), ("loadcollection2", _load_collection("BAZ")))
+    assert _Evaluation().node_key(other) != _Evaluation().node_key(
+        _merge_cubes(("loadcollection1", _load_collection("FOO")), ("loadcollection2", _load_collection("BAR"))))
@@ -2,9 +2,12 @@ from unittest import TestCase
 
 import numpy as np
 from geopyspark import Tile
+from geopyspark.geotrellis.constants import CellType
 
 from openeo.metadata import CollectionMetadata
+from openeo_udf.api.spatial_extent import SpatialExtent
 from openeogeotrellis.GeotrellisImageCollection import GeotrellisTimeSeriesImageCollection
+from openeogeotrellis.run_udf import UdfExecutor
 from openeogeotrellis.service_registry import InMemoryServiceRegistry
 
 
@@ -67,3 +70,93 @@ class TestMultiBandUDF(TestCase):
         the_array = datacube.get_array()
         assert the_array is not None
         print(the_array)
+
+    def test_apply_batch(self):
+        udf_code = """
+from typing import Dict
+from openeo_udf.api.datacube import DataCube
+
+def apply_datacube_batch(cube: DataCube, context: Dict) -> DataCube:
+    assert cube.get_array().dims == ('tiles', 'bands', 'x', 'y')
+    return DataCube(cube.get_array() * context['factor'])
+"""
+        cubes = [
+            GeotrellisTimeSeriesImageCollection._tile_to_datacube(TestMultiBandUDF.bands * i, None, band_dimension=None)
+            for i in range(1, 4)
+        ]
+        udf = UdfExecutor(udf_code)
+        assert udf.batched
+
+        result = udf.apply_batch(cubes, {'factor': 10})
+
+        assert udf.calls == 1
+        assert len(result) == 3
+        assert result[0].get_array().dims == ('bands', 'x', 'y')
+        np.testing.assert_array_equal(result[2].get_array().values, TestMultiBandUDF.bands * 30)
+
+    def test_apply_batch_tile_coordinates(self):
+        udf_code = """
+from typing import Dict
+from openeo_udf.api.datacube import DataCube
+
+def apply_datacube_batch(cube: DataCube, context: Dict) -> DataCube:
+    return DataCube(cube.get_array() + 1)
+"""
+        cubes = [
+            GeotrellisTimeSeriesImageCollection._tile_to_datacube(
+                TestMultiBandUDF.bands, SpatialExtent(top=10.0, bottom=5.0, right=5.0 * (i + 1), left=5.0 * i,
+                                                      height=5, width=5), band_dimension=None)
+            for i in range(3)
+        ]
+
+        result = UdfExecutor(udf_code).apply_batch(cubes, {})
+
+        # every tile keeps its own coordinates
+        for cube, result_cube in zip(cubes, result):
+            np.testing.assert_array_equal(cube.get_array().x.values, result_cube.get_array().x.values)
+            np.testing.assert_array_equal(cube.get_array().y.values, result_cube.get_array().y.values)
+        np.testing.assert_array_almost_equal(result[2].get_array().x.values, [10.5, 11.5, 12.5, 13.5, 14.5])
+        np.testing.assert_array_almost_equal(result[2].get_array().y.values, [9.5, 8.5, 7.5, 6.5, 5.5])
+
+    def test_udf_cell_types(self):
+        assert GeotrellisTimeSeriesImageCollection._udf_cell_types({}) == (CellType.FLOAT32, None)
+        assert GeotrellisTimeSeriesImageCollection._udf_cell_types(
+            {'input_cell_type': 'native', 'output_cell_type': 'uint8'}) == (None, CellType.UINT8)
+
+        result = GeotrellisTimeSeriesImageCollection._udf_result_tile(
+            TestMultiBandUDF.bands * 1.5, Tile.from_numpy_array(TestMultiBandUDF.bands.astype(np.int16), -1), None)
+        assert result.cells.dtype == np.int16
+        assert result.no_data_value == -1
+
+        result = GeotrellisTimeSeriesImageCollection._udf_result_tile(
+            TestMultiBandUDF.bands * 1.5, TestMultiBandUDF.tile, CellType.UINT8)
+        assert result.cells.dtype == np.uint8
+        assert result.cells[1][0][0] == 3
+
+    def test_udf_result_tile_nan_to_integer(self):
+        values = TestMultiBandUDF.bands.copy()
+        values[0][0][0] = np.nan
+
+        # NaN input no-data can't be represented: the default of the cell type
+        result = GeotrellisTimeSeriesImageCollection._udf_result_tile(values, TestMultiBandUDF.tile, CellType.INT16)
+        assert result.cells.dtype == np.int16
+        assert result.no_data_value == np.iinfo(np.int16).min
+        assert result.cells[0][0][0] == np.iinfo(np.int16).min
+        assert result.cells[0][0][1] == 1
+
+        # -1 is no valid uint8
+        input_tile = Tile.from_numpy_array(TestMultiBandUDF.bands.astype(np.int16), -1)
+        result = GeotrellisTimeSeriesImageCollection._udf_result_tile(values, input_tile, CellType.UINT8)
+        assert result.cells.dtype == np.uint8
+        assert result.no_data_value == 0
+        assert result.cells[0][0][0] == 0
+
+        # the input no-data value, if it fits
+        result = GeotrellisTimeSeriesImageCollection._udf_result_tile(values, input_tile, CellType.INT8)
+        assert result.no_data_value == -1
+        assert result.cells[0][0][0] == -1
+
+        # no no-data value at all
+        result = GeotrellisTimeSeriesImageCollection._udf_result_tile(values, input_tile, CellType.UINT8RAW)
+        assert result.no_data_value is None
+        assert result.cells[0][0][0] == 0
@@ -1,4 +1,5 @@
 import datetime
+import warnings
 from pathlib import Path
 from unittest import TestCase
 
@@ -10,12 +11,13 @@ from geopyspark.geotrellis.constants import LayerType
 from geopyspark.geotrellis.layer import TiledRasterLayer, Pyramid
 from numpy.testing import assert_array_almost_equal
 from openeo.metadata import CollectionMetadata
-from openeo_driver.errors import FeatureUnsupportedException
+from openeo_driver.errors import FeatureUnsupportedException, OpenEOApiException
 from pyspark import SparkContext
 from shapely.geometry import Point
 
 from openeogeotrellis.GeotrellisImageCollection import GeotrellisTimeSeriesImageCollection
-from openeogeotrellis.numpy_aggregators import max_composite
+from openeogeotrellis.numpy_aggregators import max_composite, mean_composite, var_composite, std_composite, \
+    sum_composite, count_composite, median_composite, percentile, VARIANCE, MAX, BandMeans
 from openeogeotrellis.service_registry import InMemoryServiceRegistry
 
 
@@ -297,6 +299,174 @@ class TestMultipleDates(TestCase):
         composite = max_composite(tiles)
         self.assertEqual(2.0, composite.cells[0][0])
 
+    def test_streaming_aggregators(self):
+        cube = np.array([self.band1, self.band2, self.band1])
+        cube[cube == -1.0] = np.nan
+
+        def tiles():
+            # a generator: aggregators should only need a single pass
+            return (Tile.from_numpy_array(cells, no_data_value=-1.0) for cells in [self.band1, self.band2, self.band1])
+
+        assert_array_almost_equal(np.nanmean(cube, axis=0), mean_composite(tiles()).cells)
+        assert_array_almost_equal(np.nanvar(cube, axis=0), var_composite(tiles()).cells)
+        assert_array_almost_equal(np.nanstd(cube, axis=0), std_composite(tiles()).cells)
+        assert_array_almost_equal(np.nansum(cube, axis=0), sum_composite(tiles()).cells)
+        assert_array_almost_equal(np.sum(~np.isnan(cube), axis=0), count_composite(tiles()).cells)
+
+    def test_sum_without_valid_observations(self):
+        tiles = [Tile.from_numpy_array(np.array([[1.0, -1.0]]), no_data_value=-1.0),
+                 Tile.from_numpy_array(np.array([[2.0, np.nan]]), no_data_value=-1.0)]
+
+        assert_array_almost_equal(np.array([[3.0, 0.0]]), sum_composite(tiles).cells)
+
+    def test_integer_aggregators(self):
+        cells = [np.array([[1, 2], [-1, 4]], dtype=np.int16), np.array([[2, 2], [3, 5]], dtype=np.int16)]
+        tiles = [Tile(cells=c, cell_type=CellType.INT16.value, no_data_value=-1) for c in cells]
+
+        mean = mean_composite(tiles)
+        self.assertEqual(np.float32, mean.cells.dtype)
+        assert_array_almost_equal(np.array([[1.5, 2.0], [3.0, 4.5]]), mean.cells)
+        assert_array_almost_equal(np.array([[0.25, 0.0], [0.0, 0.25]]), var_composite(tiles).cells)
+        self.assertEqual(np.int16, max_composite(tiles).cells.dtype)
+        self.assertEqual(np.int16, sum_composite(tiles).cells.dtype)
+
+    def test_merge_partial_aggregates(self):
+        cube = np.array([self.band1, self.band2, self.band1, self.band2])
+        cube[cube == -1.0] = np.nan
+        tiles = [Tile.from_numpy_array(cells, no_data_value=-1.0) for cells in [self.band1, self.band2, self.band1, self.band2]]
+
+        for aggregator, expected in [(VARIANCE, np.nanvar(cube, axis=0)), (MAX, np.nanmax(cube, axis=0))]:
+            # e.g. two partitions, as with combineByKey
+            left = aggregator.add(aggregator.create(tiles[0]), tiles[1])
+            right = aggregator.create(tiles[2])
+            right = aggregator.add(right, tiles[3])
+            merged = aggregator.finish(aggregator.merge(left, right))
+            assert_array_almost_equal(expected, merged.cells)
+
+    def test_count_aggregator(self):
+        tiles = [Tile(cells=np.array([[1, 0], [0, 2]], dtype=np.uint8), cell_type=CellType.UINT8.value, no_data_value=0)
+                 for _ in range(300)]
+
+        count = count_composite(tiles)
+        self.assertEqual(np.int32, count.cells.dtype)
+        assert_array_almost_equal(np.array([[300, 0], [0, 300]]), count.cells)
+        # a count of 0 is not no data
+        self.assertNotEqual(0, count.no_data_value)
+
+    def test_band_means(self):
+        cells = np.array([[[1.0, 2.0], [-1.0, np.nan]], [[3.0, -1.0], [-1.0, -1.0]], [[-1.0] * 2] * 2])
+        tiles = [Tile.from_numpy_array(cells, no_data_value=-1.0), Tile.from_numpy_array(cells + 1, no_data_value=-1.0)]
+        band_means = BandMeans(no_data=-1.0)
+
+        left = band_means.add(None, tiles[0])
+        right = band_means.add(None, tiles[1])
+        means = band_means.finish(band_means.merge(left, right))
+
+        # second tile: -1 became 0 which is valid, NaN stays NaN
+        assert means[0] == (1 + 2 + 2 + 3 + 0) / 5
+        assert means[1] == (3 + 4 + 0 + 0 + 0) / 5
+        assert means[2] == 0.0
+
+        assert np.isnan(band_means.finish(band_means.add(None, tiles[0]))[2])
+
+    def test_reduce_median_and_quantiles(self):
+        input = Pyramid({0: self.tiled_raster_rdd})
+        imagecollection = GeotrellisTimeSeriesImageCollection(input, InMemoryServiceRegistry(), metadata=self.collection_metadata)
+
+        stitched = imagecollection.reduce_dimension(dimension="t", reducer=reducer("median")).pyramid.levels[0].stitch()
+        self.assertEqual(2.0, stitched.cells[0][0][0])
+        self.assertEqual(1.0, stitched.cells[0][0][1])
+
+        quantiles = {
+            "quantiles1": {
+                "process_id": "quantiles",
+                "arguments": {"data": {"from_argument": "dimension_data"}, "probabilities": [0.75]},
+                "result": True
+            }
+        }
+        stitched = imagecollection.reduce_dimension(dimension="t", reducer=quantiles).pyramid.levels[0].stitch()
+        self.assertEqual(2.0, stitched.cells[0][0][0])
+        self.assertAlmostEqual(1.5, stitched.cells[0][0][1])
+
+    def test_reduce_quantiles_several_probabilities(self):
+        input = Pyramid({0: self.tiled_raster_rdd})
+        imagecollection = GeotrellisTimeSeriesImageCollection(input, InMemoryServiceRegistry(), metadata=self.collection_metadata)
+        quantiles = {
+            "quantiles1": {
+                "process_id": "quantiles",
+                "arguments": {"data": {"from_argument": "dimension_data"}, "probabilities": [0.25, 0.75]},
+                "result": True
+            }
+        }
+
+        with self.assertRaises(OpenEOApiException) as context:
+            imagecollection.reduce_dimension(dimension="t", reducer=quantiles)
+        self.assertEqual(400, context.exception.status_code)
+
+    def test_percentile_aggregator(self):
+        random = np.random.RandomState(0)
+        cube = random.normal(size=(200, 2, 40, 5))
+        cube[random.uniform(size=cube.shape) < 0.2] = np.nan
+        cube[:, 0, 0, 0] = np.nan
+
+        for q in [0, 1, 50, 75, 99, 100]:
+            # rows in several blocks, and partial aggregates merged as with combineByKey
+            aggregator = percentile(q)
+            left = aggregator.create(Tile.from_numpy_array(cube[0]))
+            for cells in cube[1:120]:
+                left = aggregator.add(left, Tile.from_numpy_array(cells))
+            right = aggregator.create(Tile.from_numpy_array(cube[120]))
+            for cells in cube[121:]:
+                right = aggregator.add(right, Tile.from_numpy_array(cells))
+            result = aggregator.finish(aggregator.merge(left, right)).cells
+
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)
+                expected = np.nanpercentile(cube, q, axis=0)
+            assert_array_almost_equal(expected, result, decimal=5)
+            assert np.isnan(result[0, 0, 0])
+
+    def test_aggregate_temporal_median(self):
+        input = Pyramid({0: self.tiled_raster_rdd})
+        imagecollection = GeotrellisTimeSeriesImageCollection(input, InMemoryServiceRegistry(), metadata=self.collection_metadata)
+        stitched = (
+            imagecollection.aggregate_temporal(["2017-01-01", "2018-01-01"], ["2017-01-03"], "median", dimension="t")
+                .pyramid.levels[0].to_spatial_layer().stitch()
+        )
+        self.assertEqual(2.0, stitched.cells[0][0][0])
+        self.assertAlmostEqual(1.5, stitched.cells[0][0][1])
+
+    def test_aggregate_temporal_quantiles(self):
+        input = Pyramid({0: self.tiled_raster_rdd})
+        imagecollection = GeotrellisTimeSeriesImageCollection(input, InMemoryServiceRegistry(), metadata=self.collection_metadata)
+        quantiles = {
+            "quantiles1": {
+                "process_id": "quantiles",
+                "arguments": {"data": {"from_argument": "data"}, "probabilities": [0.75]},
+                "result": True
+            }
+        }
+        stitched = (
+            imagecollection.aggregate_temporal(["2017-01-01", "2018-01-01"], ["2017-01-03"], quantiles, dimension="t")
+                .pyramid.levels[0].to_spatial_layer().stitch()
+        )
+        self.assertEqual(2.0, stitched.cells[0][0][0])
+        self.assertAlmostEqual(1.75, stitched.cells[0][0][1])
+
+    def test_median_aggregator(self):
+        composite = median_composite([self.tile, self.tile2, self.tile2])
+        self.assertEqual(2.0, composite.cells[0][0])
+        self.assertEqual(2.0, composite.cells[1][1])
+        self.assertEqual(1.0, composite.cells[2][2])
+
+    def test_reduce_count(self):
+        input = Pyramid({0: self.tiled_raster_rdd})
+        imagecollection = GeotrellisTimeSeriesImageCollection(input, InMemoryServiceRegistry(), metadata=self.collection_metadata)
+
+        stitched = imagecollection.reduce("count", dimension="t").pyramid.levels[0].stitch()
+        self.assertEqual(1.0, stitched.cells[0][0][0])
+        self.assertEqual(3.0, stitched.cells[0][0][1])
+
     def test_aggregate_max_time(self):
         input = Pyramid( {0:self.tiled_raster_rdd })
         imagecollection = GeotrellisTimeSeriesImageCollection(input, InMemoryServiceRegistry(), metadata=self.collection_metadata)
@@ -412,6 +582,79 @@ def rct_savitzky_golay(udf_data:UdfData):
             tile = result_dict[k]
             assert_array_almost_equal(np.squeeze(v.cells),np.squeeze(tile.cells),decimal=2)
 
+    def test_apply_spatiotemporal_result_dimension_order(self):
+        input = Pyramid({0: self.tiled_raster_rdd})
+        imagecollection = GeotrellisTimeSeriesImageCollection(
+            input, InMemoryServiceRegistry(),
+            metadata=CollectionMetadata({"cube:dimensions": {"bands": {"type": "bands", "values": ["2"]}}})
+        )
+
+        # the result slices per date are taken along 't', wherever the UDF puts it
+        udf_code = """
+def apply_datacube(cube: DataCube, context: dict) -> DataCube:
+    return DataCube(cube.array.transpose('bands', 'x', 'y', 't'))
+"""
+
+        result = imagecollection.apply_tiles_spatiotemporal(udf_code)
+        local_tiles = result.pyramid.levels[0].to_numpy_rdd().collect()
+        self.assertEqual(len(TestMultipleDates.layer), len(local_tiles))
+        # no data becomes NaN in the float32 tiles passed to the UDF
+        ref_dict = {e[0]: e[1] for e in
+                    imagecollection.pyramid.levels[0].convert_data_type(CellType.FLOAT32).to_numpy_rdd().collect()}
+        result_dict = {e[0]: e[1] for e in local_tiles}
+        for k, v in ref_dict.items():
+            assert_array_almost_equal(v.cells, result_dict[k].cells)
+
+    def test_apply_spatiotemporal_batched_udf(self):
+        input = Pyramid({0: self.tiled_raster_rdd})
+        imagecollection = GeotrellisTimeSeriesImageCollection(
+            input, InMemoryServiceRegistry(),
+            metadata=CollectionMetadata({"cube:dimensions": {"bands": {"type": "bands", "values": ["2"]}}})
+        )
+
+        udf_code = """
+from typing import Dict
+from openeo_udf.api.datacube import DataCube
+
+def apply_datacube_batch(cube: DataCube, context: Dict) -> DataCube:
+    # the spatial keys of a partition with the same dates, at once
+    assert cube.get_array().dims == ('tiles', 't', 'bands', 'x', 'y')
+    return DataCube(cube.get_array() * 10)
+"""
+
+        result = imagecollection.apply_tiles_spatiotemporal(udf_code)
+        ref_dict = {e[0]: e[1] for e in
+                    imagecollection.pyramid.levels[0].convert_data_type(CellType.FLOAT32).to_numpy_rdd().collect()}
+        result_dict = {e[0]: e[1] for e in result.pyramid.levels[0].to_numpy_rdd().collect()}
+        self.assertEqual(len(TestMultipleDates.layer), len(result_dict))
+        for k, v in ref_dict.items():
+            assert_array_almost_equal(v.cells * 10, result_dict[k].cells)
+
+    def test_apply_tiles_udf_coordinates(self):
+        input = Pyramid({0: self.tiled_raster_rdd})
+        imagecollection = GeotrellisTimeSeriesImageCollection(
+            input, InMemoryServiceRegistry(),
+            metadata=CollectionMetadata({"cube:dimensions": {"bands": {"type": "bands", "values": ["2"]}}})
+        )
+
+        # the UDF gets the pixel center coordinates of its tile
+        udf_code = """
+def apply_datacube(cube: DataCube, context: dict) -> DataCube:
+    array = cube.get_array()
+    return DataCube(array.fillna(0) * 0 + array.x * 1000 + array.y)
+"""
+
+        result = imagecollection.apply_tiles(udf_code)
+        local_tiles = result.pyramid.levels[0].to_numpy_rdd().collect()
+        self.assertEqual(len(TestMultipleDates.layer), len(local_tiles))
+
+        # tile (1, 0) covers x from 16.5 to 33 and y from 33 (its first row) to 16.5, in 5 x 5 pixels
+        x = np.linspace(16.5 + 1.65, 33 - 1.65, 5)
+        y = np.linspace(33 - 1.65, 16.5 + 1.65, 5)
+        tiles = [tile for key, tile in local_tiles if (key.col, key.row) == (1, 0)]
+        self.assertEqual(3, len(tiles))
+        for tile in tiles:
+            assert_array_almost_equal(tile.cells[0], x[:, np.newaxis] * 1000 + y[np.newaxis, :], decimal=2)
 
     def test_mask_raster(self):
         input = Pyramid({0: self.tiled_raster_rdd})
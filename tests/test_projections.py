@@ -0,0 +1,38 @@
+import pyproj
+import pytest
+from shapely.geometry import box
+
+from openeogeotrellis import projections
+
+
+@pytest.mark.parametrize("crs", ["EPSG:4326", "epsg:4326", "+init=epsg:4326", "+init=EPSG:4326", 4326,
+                                 pyproj.CRS("EPSG:4326")])
+def test_normalize_crs(crs):
+    assert projections.normalize_crs(crs) == "EPSG:4326"
+
+
+def test_get_transformer_is_cached():
+    transformer = projections.get_transformer("+init=EPSG:4326", "epsg:32631")
+    assert projections.get_transformer(4326, "EPSG:32631") is transformer
+
+
+def test_transform_is_always_xy():
+    x, y = projections.transform("EPSG:4326", "EPSG:32631", 4.5, 51.0)
+    assert (x, y) == pytest.approx((605251.91, 5650895.71))
+
+    xs, ys = projections.transform("EPSG:4326", "EPSG:32631", [4.5, 4.5], [51.0, 51.0])
+    assert list(xs) == pytest.approx([x, x])
+
+
+def test_transform_bounds():
+    xmin, ymin, xmax, ymax = projections.transform_bounds("EPSG:4326", "EPSG:32631", 4.0, 50.0, 5.0, 51.0)
+    assert (xmin, ymin) == pytest.approx(projections.transform("EPSG:4326", "EPSG:32631", 4.0, 50.0))
+    assert (xmax, ymax) == pytest.approx(projections.transform("EPSG:4326", "EPSG:32631", 5.0, 51.0))
+
+
+def test_reproject_geometry():
+    polygon = box(4.0, 50.0, 4.1, 50.1)
+    assert projections.reproject_geometry(polygon, "+init=epsg:4326", "EPSG:4326") is polygon
+
+    reprojected = projections.reproject_geometry(polygon, "EPSG:4326", "EPSG:32631")
+    assert reprojected.bounds == pytest.approx((571517.67, 5539109.82, 578832.95, 5550328.63))
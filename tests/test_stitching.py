@@ -0,0 +1,47 @@
+from collections import namedtuple
+
+import numpy as np
+from geopyspark import Tile
+
+from openeogeotrellis.stitching import stitch, overlap
+
+Key = namedtuple("Key", ["col", "row"])
+
+
+def test_overlap():
+    assert overlap(0, 10, 5, 10) == (5, 10)
+    assert overlap(5, 10, 0, 10) == (5, 10)
+    assert overlap(0, 10, 10, 10) is None
+
+
+def test_stitch_full_layout():
+    # 2x2 tiles of 2x2 pixels, the cell value is col + 10 * row in the whole layout (rows counted from the top)
+    layout = np.array([[col + 10 * row for col in range(4)] for row in range(4)], dtype=np.float32)
+    tiles = [
+        (Key(col, row), Tile(layout[np.newaxis, row * 2:row * 2 + 2, col * 2:col * 2 + 2], 'FLOAT', -1.0))
+        for col in range(2) for row in range(2)
+    ]
+
+    window = stitch(tiles, (0, 0, 4, 4), layout_rows=4)
+
+    assert window.shape == (1, 4, 4)
+    # (bands, x, y) with y counted from the bottom
+    np.testing.assert_array_equal(window[0], layout[::-1, :].T)
+
+
+def test_stitch_cropped_window_with_missing_tile():
+    cells = np.arange(8, dtype=np.int32).reshape((2, 2, 2))
+    tiles = [(Key(0, 0), Tile(cells, 'INT', -1)), (Key(1, 1), Tile(cells + 10, 'INT', -1))]
+
+    window = stitch(tiles, (1, 1, 2, 2), layout_rows=4)
+
+    assert window.shape == (2, 2, 2)
+    # the window is the center of the layout: its bottom right pixel is the top left cell of tile (1, 1)
+    assert window[0, 1, 0] == 10
+    assert window[1, 1, 0] == 14
+    # its top left pixel is the bottom right cell of tile (0, 0)
+    assert window[0, 0, 1] == 3
+    assert window[1, 0, 1] == 7
+    # no tiles at (0, 1) and (1, 0)
+    assert window[0, 0, 0] == -1
+    assert window[0, 1, 1] == -1
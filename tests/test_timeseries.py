@@ -15,6 +15,7 @@ from shapely.geometry import mapping, Point, Polygon, GeometryCollection, MultiP
 
 from openeogeotrellis.GeotrellisImageCollection import GeotrellisTimeSeriesImageCollection
 from openeogeotrellis.service_registry import InMemoryServiceRegistry
+from openeogeotrellis.zonal_statistics import ZoneRasterizer
 from .data import get_test_data_file
 
 
@@ -131,6 +132,22 @@ class TestTimeSeries(TestCase):
         for r in result:
             self.assertTrue(r in self.expected_spacetime_points_list)
 
+    def test_timeseries_points(self):
+        layer = self.create_spacetime_layer()
+        imagecollection = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: layer}), InMemoryServiceRegistry())
+
+        result = imagecollection.timeseries_points([p.x for p in self.points], [p.y for p in self.points])
+
+        assert result.dims == ('point', 't', 'bands')
+        assert result.shape == (5, 1, 2)
+        assert list(result.t.values) == [np.datetime64('2017-09-25T11:37:00')]
+        # same as get_point_values: no values for points outside of the layer
+        for point, (_, expected) in zip(result, self.expected_spacetime_points_list):
+            if expected[0][1] is None:
+                assert np.isnan(point.values).all()
+            else:
+                assert point.values.tolist() == [expected[0][1]]
+
     def test_zonal_statistics(self):
         layer = self.create_spacetime_layer()
         imagecollection = GeotrellisTimeSeriesImageCollection(gps.Pyramid({0: layer}), InMemoryServiceRegistry())
@@ -263,6 +280,18 @@ class TestTimeSeries(TestCase):
         }
 
 
+@pytest.fixture(params=["geotrellis", "python"])
+def zonal_statistics_engine(request, monkeypatch):
+    """Runs a test with both zonal statistics implementations: they should give the same results."""
+    monkeypatch.setenv("OPENEO_ZONAL_STATISTICS_ENGINE", request.param)
+    return request.param
+
+
+@pytest.fixture
+def python_zonal_statistics(monkeypatch):
+    monkeypatch.setenv("OPENEO_ZONAL_STATISTICS_ENGINE", "python")
+
+
 def _build_cube():
     # TODO: avoid instantiating TestTimeSeries? e.g. use pytest fixtures or simple builder functions.
     layer = TestTimeSeries().create_spacetime_layer()
@@ -274,9 +303,11 @@ def _build_cube():
     ("mean", {'2017-09-25T11:37:00': [[1.0, 2.0]]}),
     ("median", {'2017-09-25T11:37:00Z': [[1.0, 2.0]]}),
     ("histogram", {'2017-09-25T11:37:00Z': [[{1.0: 4}, {2.0: 4}]]}),
-    ("sd", {'2017-09-25T11:37:00Z': [[0.0, 0.0]]})
+    ("sd", {'2017-09-25T11:37:00Z': [[0.0, 0.0]]}),
+    ("min", {'2017-09-25T11:37:00Z': [[1.0, 2.0]]}),
+    ("count", {'2017-09-25T11:37:00Z': [[4.0, 4.0]]}),
 ])
-def test_zonal_statistics_single_polygon(func, expected):
+def test_zonal_statistics_single_polygon(func, expected, zonal_statistics_engine):
     cube = _build_cube()
     polygon = box(0.0, 0.0, 1.0, 1.0)
     result = cube.zonal_statistics(polygon, func=func)
@@ -289,7 +320,7 @@ def test_zonal_statistics_single_polygon(func, expected):
     ("histogram", {'2017-09-25T11:37:00Z': [[{1.0: 4}, {2.0: 4}], [{1.0: 23}, {2.0: 23}]]}),
     ("sd", {'2017-09-25T11:37:00Z': [[0.0, 0.0], [0.0, 0.0]]})
 ])
-def test_zonal_statistics_geometry_collection(func, expected):
+def test_zonal_statistics_geometry_collection(func, expected, zonal_statistics_engine):
     cube = _build_cube()
     geometry = GeometryCollection([
         box(0.5, 0.5, 1.5, 1.5),
@@ -299,13 +330,66 @@ def test_zonal_statistics_geometry_collection(func, expected):
     assert result.data == expected
 
 
+def test_zonal_statistics_overlapping_polygons(python_zonal_statistics):
+    cube = _build_cube()
+    geometry = GeometryCollection([box(0.0, 0.0, 2.0, 2.0), box(1.0, 1.0, 3.0, 3.0), box(10.0, 10.0, 11.0, 11.0)])
+    result = cube.zonal_statistics(geometry, func="histogram")
+    # pixels in both polygons count for both, the polygon outside of the layer has no values
+    assert result.data == {'2017-09-25T11:37:00Z': [[{1.0: 16}, {2.0: 16}], [{1.0: 16}, {2.0: 16}], [{}, {}]]}
+
+
+def test_zonal_statistics_no_data_for_any_polygon(python_zonal_statistics):
+    cube = _build_cube()
+    geometry = GeometryCollection([box(10.0, 10.0, 11.0, 11.0), box(12.0, 12.0, 13.0, 13.0)])
+    result = cube.zonal_statistics(geometry, func="mean")
+    assert result.data == {'2017-09-25T11:37:00Z': [[], []]}
+
+
+def test_zonal_statistics_csv(tmp_path, python_zonal_statistics):
+    cube = _build_cube()
+    geometry = GeometryCollection([box(0.0, 0.0, 1.0, 1.0), box(10.0, 10.0, 11.0, 11.0), box(2.0, 2.0, 3.0, 3.0)])
+    result = cube.zonal_statistics(geometry, func="mean")
+
+    filename = result.write_csv(tmp_path / "result.csv")
+
+    with open(filename) as f:
+        # no row for the polygon outside of the layer
+        assert f.read().splitlines() == [
+            "date,feature_index,band_0,band_1",
+            "2017-09-25T11:37:00Z,0,1.0,2.0",
+            "2017-09-25T11:37:00Z,2,1.0,2.0",
+        ]
+
+
+def test_zone_rasterizer_index():
+    diagonal = MultiPolygon([box(0.5, 0.5, 1.5, 1.5), box(2.5, 2.5, 3.5, 3.5)])
+    center = box(1.5, 1.5, 2.5, 2.5)
+    rasterizer = ZoneRasterizer([diagonal, center], extent=(0.0, 0.0, 4.0, 4.0), tile_layout=(2, 2, 4, 4))
+
+    # the bounds of the first polygon cover all keys, the polygon itself only the bottom left and top right ones
+    assert rasterizer.zones_by_key == {(0, 1): [0, 1], (1, 0): [0, 1], (0, 0): [1], (1, 1): [1]}
+
+    zones = rasterizer.zones(0, 1)
+    assert zones.shape == (1, 4, 4)
+    assert zones[0, 3, 0] == -1
+    assert zones[0, 2, 1] == 0
+    assert zones[0, 0, 3] == 1
+    assert rasterizer.zones(5, 5) is None
+
+
+def test_zonal_statistics_unsupported_func():
+    cube = _build_cube()
+    with pytest.raises(ValueError):
+        cube.zonal_statistics(box(0.0, 0.0, 1.0, 1.0), func="mode")
+
+
 @pytest.mark.parametrize(["func", "expected"], [
     ("mean", {'2017-09-25T11:37:00Z': [[1.0, 2.0], [1.0, 2.0]]}),
     ("median", {'2017-09-25T11:37:00Z': [[1.0, 2.0], [1.0, 2.0]]}),
     ("histogram", {'2017-09-25T11:37:00Z': [[{1.0: 4}, {2.0: 4}], [{1.0: 19}, {2.0: 19}]]}),
     ("sd", {'2017-09-25T11:37:00Z': [[0.0, 0.0], [0.0, 0.0]]})
 ])
-def test_zonal_statistics_shapefile(func, expected):
+def test_zonal_statistics_shapefile(func, expected, zonal_statistics_engine):
     cube = _build_cube()
     shapefile = str(get_test_data_file("geometries/polygons01.shp"))
     result = cube.zonal_statistics(regions=shapefile, func=func)
@@ -318,7 +402,7 @@ def test_zonal_statistics_shapefile(func, expected):
     ("histogram", {'2017-09-25T11:37:00Z': [[{1.0: 4}, {2.0: 4}], [{1.0: 19}, {2.0: 19}]]}),
     ("sd", {'2017-09-25T11:37:00Z': [[0.0, 0.0], [0.0, 0.0]]})
 ])
-def test_zonal_statistics_geojson(func, expected):
+def test_zonal_statistics_geojson(func, expected, zonal_statistics_engine):
     cube = _build_cube()
     shapefile = str(get_test_data_file("geometries/polygons01.geojson"))
     result = cube.zonal_statistics(regions=shapefile, func=func)
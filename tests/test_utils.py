@@ -1,9 +1,10 @@
+import functools
 import getpass
 from pathlib import Path
 
 import pytest
 
-from openeogeotrellis.utils import dict_merge_recursive, describe_path
+from openeogeotrellis.utils import dict_merge_recursive, describe_path, log_memory
 
 
 @pytest.mark.parametrize(["a", "b", "expected"], [
@@ -69,3 +70,23 @@ def test_describe_path(tmp_path):
         assert d["user"] == getpass.getuser()
 
     assert describe_path(tmp_path / "invalid")["status"] == "does not exist"
+
+
+def test_log_memory_generator():
+    consumed = []
+
+    def partition_function(offset, partition):
+        for x in partition:
+            consumed.append(x)
+            yield x + offset
+
+    wrapped = log_memory(functools.partial(partition_function, 10))
+    result = wrapped(iter([1, 2, 3]))
+    # the wrapper is a generator too: nothing is processed until it is consumed
+    assert consumed == []
+    assert list(result) == [11, 12, 13]
+    assert consumed == [1, 2, 3]
+
+
+def test_log_memory_function():
+    assert log_memory(lambda partition: [x * 2 for x in partition])([1, 2]) == [2, 4]